@@ -1,10 +1,13 @@
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, UploadFile, File, BackgroundTasks
 from fastapi.responses import JSONResponse, FileResponse
-from core.augment_tool import augment
-from core.reader import load_config, load_scene, load_uploaded_config
-from core.augment_writer import run_scene_builder, progress_store, progress_lock
+from core.augment_tool import create_augmenter
+from core.reader import load_config, load_scene, load_uploaded_config, load_heightfield
+from core.uploads import UploadStaging
+from core.jobs import JobScheduler, MAX_CONCURRENT_BUILDS
+from core.augment_writer import ConfigProcessor, run_scene_builder
+from core.progress import progress_broker
 from models.api import ConfigInput, CreatorInput
-from models.domain import MapConfig
+from models.domain import MapConfig, PlacedObjects
 from core.writer import write_config
 from validation.schema_test import validate_config
 from typing import List
@@ -12,8 +15,19 @@ import trimesh
 import os
 import uuid
 import asyncio
+import concurrent.futures
+import contextlib
+import functools
+import shutil
 
-app = FastAPI()
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Progress of tasks that start before anyone watches is handed to the loop of the app too
+    progress_broker.bind(asyncio.get_running_loop())
+    yield
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Define directory paths for maps, configs, and uploads
 MAPS_DIR = os.path.abspath("./maps")
@@ -25,72 +39,150 @@ os.makedirs(UPLOAD_DIR, exist_ok=True)
 os.makedirs(MAPS_DIR, exist_ok=True)
 os.makedirs(CONFIGS_DIR, exist_ok=True)
 
+# Config generation runs on its own small pool so it never blocks the event loop;
+# requests beyond the pool size wait in its queue.
+CONFIG_JOB_WORKERS = int(os.environ.get("MAPGEN_CONFIG_WORKERS", "2"))
+config_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=CONFIG_JOB_WORKERS,
+    thread_name_prefix="create-configs"
+)
+
+# Map builds are scheduled jobs: at most MAPGEN_MAX_CONCURRENT_BUILDS run at once,
+# the others wait in a priority queue and can be cancelled.
+def publish_job_status(job):
+    """
+    Publish the state of a map build to the watchers of its progress.
+    """
+    if job.error is not None:
+        progress_broker.publish(job.id, status=job.status, error=job.error)
+    else:
+        progress_broker.publish(job.id, status=job.status)
+
+
+build_scheduler = JobScheduler(MAX_CONCURRENT_BUILDS, name="create-maps", listener=publish_job_status)
+
+
+# Map configs that are sampled together by /create_configs
+CONFIG_BATCH_SIZE = 256
+
 
 def generate_map_name():
     """Generate a unique map name using UUID."""
     return f"map_{uuid.uuid4().hex[:8]}"
 
 
-def build_map_config(map_name: str, filetype: str, config, map_bounds, base_mesh) -> MapConfig:
+def build_map_config(map_name: str, filetype: str, config, map_bounds, base_mesh, heightfield=None) -> MapConfig:
     """
     Build a MapConfig object by applying augmentations to the base mesh.
     Separates landscape augmentations and model additions.
     """
-    objects = []
-    landscapes = []
+    return build_map_configs([map_name], filetype, config, map_bounds, base_mesh, heightfield)[0]
+
 
-    for aug in config.augmentations:
-        augment_results = augment(map_bounds, aug, base_mesh)
+def build_map_configs(map_names, filetype: str, config, map_bounds, base_mesh, heightfield=None,
+                      augmenters=None):
+    """
+    Build the MapConfig of every map name at once: each augmentation samples the
+    values of all the maps in one go (one ray query per placement round for all maps).
+    augmenters are optional augmenters of config.augmentations to reuse between batches.
+    """
+    if augmenters is None:
+        augmenters = [create_augmenter(map_bounds, aug, base_mesh, heightfield) for aug in config.augmentations]
+    objects = [[] for _ in map_names]
+    landscapes = [[] for _ in map_names]
 
+    for aug, augmenter in zip(config.augmentations, augmenters):
+        # Landscape augmentations go to the landscapes, model additions to the objects
         if aug.type == "landscape":
-            landscapes.extend(augment_results)
-        else:  # If augmentation type is add_model
-            objects.extend(augment_results)
-
-    return MapConfig(
-        map=f"{map_name}.{filetype}",
-        objects=objects,
-        landscapes=landscapes
-    )
+            for target, augment_results in zip(landscapes, augmenter.generate_batch(aug, len(map_names))):
+                target.extend(augment_results)
+        else:
+            for target, placed in zip(objects, augmenter.place_batch(aug, len(map_names))):
+                target.append(placed)
+
+    # The placed objects only become object models here, where the configs are written
+    return [
+        MapConfig(map=f"{map_name}.{filetype}", objects=PlacedObjects.concatenate(parts).to_models(),
+                  landscapes=map_landscapes)
+        for map_name, parts, map_landscapes in zip(map_names, objects, landscapes)
+    ]
 
 
-def generate_and_write_maps(config, scene, base_mesh, map_bounds, writer=write_config):
+def generate_and_write_maps(config, scene, base_mesh, map_bounds, writer=write_config, heightfield=None,
+                            progress_callback=None, batch_size=CONFIG_BATCH_SIZE):
     """
     Generate multiple map configurations based on config.map_count,
     write them to disk using the provided writer function,
     and return the last generated MapConfig.
-    """
-    for _ in range(config.map_count):
-        map_name = generate_map_name()
-        map_config = build_map_config(map_name, config.output_type, config, map_bounds, base_mesh)
-        writer(map_name, map_config)
+    The maps are sampled batch_size at a time and written as soon as their batch is built.
+    progress_callback(fraction) is called after every written configuration.
+    """
+    augmenters = [create_augmenter(map_bounds, aug, base_mesh, heightfield) for aug in config.augmentations]
+    map_config = None
+    written = 0
+    while written < config.map_count:
+        map_names = [generate_map_name() for _ in range(min(batch_size, config.map_count - written))]
+        map_configs = build_map_configs(map_names, config.output_type, config, map_bounds, base_mesh,
+                                        heightfield, augmenters)
+        for map_name, map_config in zip(map_names, map_configs):
+            writer(map_name, map_config)
+            written += 1
+            if progress_callback:
+                progress_callback(written / config.map_count)
     return map_config
 
 
 from os.path import basename
 
 
-@app.post("/create_configs")
-async def create_configs(data: ConfigInput):
+def run_config_job(task_id: str, data: ConfigInput):
     """
-    Create map configurations based on uploaded object and config files.
-    Loads the scene and config, generates maps, and returns success message.
+    Generate the map configurations of a /create_configs request.
+    Runs on config_executor and reports progress under task_id; an error is
+    recorded as a failure of the config file and ends the task.
     """
     obj_filename = basename(data.obj_path)
     config_filename = basename(data.config_path)
+    try:
+        scene = load_scene(obj_filename)
+        config = load_uploaded_config(config_filename)
+
+        base_mesh = trimesh.util.concatenate(scene.dump())
+        map_bounds = scene.bounds
+
+        heightfield = None
+        if data.heightfield_resolution:
+            heightfield = load_heightfield(obj_filename, base_mesh, data.heightfield_resolution)
 
-    scene = load_scene(obj_filename)
-    config = load_uploaded_config(config_filename)
+        writer = functools.partial(write_config, config_format=data.config_format)
+        generate_and_write_maps(config, scene, base_mesh, map_bounds, writer=writer, heightfield=heightfield,
+                                progress_callback=lambda p: update_progress(task_id, p))
+        print(f"[create_configs] Generated {config.map_count} map configurations.")
+    except Exception as e:
+        message = f"{type(e).__name__}: {e}"
+        print(f"[create_configs] Failed {config_filename}: {message}")
+        record_failure(task_id, config_filename, message)
+    finally:
+        update_progress(task_id, 1.0)
 
-    base_mesh = trimesh.util.concatenate(scene.dump())
-    map_bounds = scene.bounds
 
-    last_map_config = generate_and_write_maps(config, scene, base_mesh, map_bounds)
+@app.post("/create_configs")
+async def create_configs(data: ConfigInput):
+    """
+    Start generating map configurations from the uploaded object and config files
+    in the background. Returns a task ID for progress tracking; a failed generation
+    is listed under "failed" on the progress websocket.
+    """
+    task_id = str(uuid.uuid4())
+    update_progress(task_id, 0.0)
+
+    loop = asyncio.get_running_loop()
+    loop.run_in_executor(config_executor, run_config_job, task_id, data)
 
     return {
         "status": "success",
-        "message": f"Generated {config.map_count} map configurations successfully.",
-        "last_map": last_map_config.map
+        "message": "Config generation started.",
+        "task_id": task_id
     }
 
 
@@ -103,93 +195,171 @@ async def upload_model_config(
 ):
     """
     Endpoint to upload OBJ model, configuration, optional MTL, and textures.
-    Saves files to upload directory and validates the config file.
-    Deletes all uploaded files if validation fails.
-    """
-    # Save OBJ file
-    obj_path = os.path.join(UPLOAD_DIR, obj_file.filename)
-    with open(obj_path, "wb") as f:
-        f.write(await obj_file.read())
-
-    # Save config file
-    config_path = os.path.join(UPLOAD_DIR, config_file.filename)
-    with open(config_path, "wb") as f:
-        f.write(await config_file.read())
-
-    # Save MTL file if provided
-    if mtl_file:
-        mtl_path = os.path.join(UPLOAD_DIR, mtl_file.filename)
-        with open(mtl_path, "wb") as f:
-            f.write(await mtl_file.read())
-
-    # Save texture files (accept specific image extensions only)
-    for texture_file in texture_files:
-        if texture_file.filename:  # Ensure file is not empty
-            texture_ext = os.path.splitext(texture_file.filename)[1].lower()
-            if texture_ext in ['.png', '.jpg', '.jpeg', '.tga', '.bmp', '.tif']:
-                texture_path = os.path.join(UPLOAD_DIR, texture_file.filename)
-                with open(texture_path, "wb") as f:
-                    f.write(await texture_file.read())
-                print(f"Texture uploaded: {texture_file.filename}")
+    Files are streamed to a staging folder in chunks (at most MAPGEN_MAX_UPLOAD_MB each)
+    and only moved into the upload directory once the config file is valid.
+    Nothing is kept if a file is too large or validation fails.
+    """
+    staging = UploadStaging(UPLOAD_DIR)
+    try:
+        await staging.add(obj_file)
+        config_path = await staging.add(config_file)
+
+        # Save MTL file if provided
+        if mtl_file:
+            await staging.add(mtl_file)
+
+        # Save texture files (accept specific image extensions only)
+        for texture_file in texture_files:
+            if texture_file.filename:  # Ensure file is not empty
+                texture_ext = os.path.splitext(texture_file.filename)[1].lower()
+                if texture_ext in ['.png', '.jpg', '.jpeg', '.tga', '.bmp', '.tif']:
+                    await staging.add(texture_file)
+                    print(f"Texture uploaded: {texture_file.filename}")
+    except ValueError as e:
+        staging.discard()
+        return {"status": "error", "message": str(e)}
+    except BaseException:
+        staging.discard()
+        raise
 
     # Validate the config file
-    is_valid = validate_config(config_path=config_path)
+    is_valid = validate_config(config_path=str(config_path))
     if not is_valid:
-        # On validation failure, clean up all uploaded files
-        try:
-            os.remove(obj_path)
-            os.remove(config_path)
-            if mtl_file:
-                os.remove(mtl_path)
-            for texture_file in texture_files:
-                texture_path = os.path.join(UPLOAD_DIR, texture_file.filename)
-                if os.path.exists(texture_path):
-                    os.remove(texture_path)
-        except Exception as e:
-            print(f"Error cleaning up files: {e}")
-        
+        # On validation failure, nothing is moved into the upload directory
+        staging.discard()
         return {"status": "error", "message": "Config validation failed."}
 
+    staging.commit()
     return {"status": "success", "message": "Files uploaded and config validated successfully."}
 
 
 def update_progress(task_id: str, progress: float):
     """
-    Thread-safe update of task progress in shared progress_store dictionary.
+    Thread-safe publish of the task progress to its watchers.
+    """
+    progress_broker.publish(task_id, progress=progress)
+
+
+def record_failure(task_id: str, config_name: str, message: str):
+    """
+    Thread-safe publish of a map that failed to build for the given task.
+    """
+    progress_broker.publish(task_id, failed={config_name: message})
+
+
+def record_timings(task_id: str, timings: dict):
+    """
+    Thread-safe publish of the time spent in every stage of a pipelined build.
+    """
+    progress_broker.publish(task_id, timings=timings)
+
+
+def record_event(task_id: str, fields: dict):
+    """
+    Thread-safe publish of the config being built, its stage and placed objects.
     """
-    with progress_lock:
-        progress_store[task_id] = progress
+    progress_broker.publish(task_id, **fields)
+
+
+def run_map_job(job, data: CreatorInput, config_files):
+    """
+    Build the maps of a /create_maps request into its own folder, maps/<task_id>.
+    Runs on a build_scheduler thread and stops between configs when the job is cancelled.
+    Returns the files written for the job and the configs that failed to build.
+    """
+    task_id = job.id
+    output_folder = os.path.join(MAPS_DIR, task_id)
+    os.makedirs(output_folder, exist_ok=True)
+    failures = run_scene_builder(
+        task_id=task_id,
+        config_folder=CONFIGS_DIR,
+        base_map=data.base_map or "./map.obj",
+        output_folder=output_folder,
+        progress_callback=lambda p: update_progress(task_id, p),
+        heightfield_resolution=data.heightfield_resolution,
+        workers=data.workers or 1,
+        failure_callback=lambda name, message: record_failure(task_id, name, message),
+        merge_objects=bool(data.merge_objects),
+        pipeline_depth=data.pipeline_depth or 0,
+        timings_callback=lambda timings: record_timings(task_id, timings),
+        config_files=config_files,
+        cancel_event=job.cancel_event,
+        event_callback=lambda fields: record_event(task_id, fields),
+        terrain_tiles=data.terrain_tiles or None,
+        lod_ratios=data.lod_ratios or None
+    )
+    return {"files": sorted(os.listdir(output_folder)), "failed": failures}
 
 
 @app.post("/create_maps")
 async def create_maps(data: CreatorInput):
     """
-    Start the map creation process asynchronously in a background thread.
-    Initializes progress for the task and returns a task ID for progress tracking.
+    Queue a map build for the configs that exist now and return its task ID.
+    Builds with a higher priority run first; progress is reported on the websocket
+    and the job state under /jobs/{task_id}.
     """
     task_id = str(uuid.uuid4())
-    with progress_lock:
-        progress_store[task_id] = 0.0
+    config_files = ConfigProcessor(CONFIGS_DIR).get_config_files()
+    update_progress(task_id, 0.0)
 
-    loop = asyncio.get_running_loop()
-    loop.run_in_executor(
-        None,
-        lambda: run_scene_builder(
-            task_id=task_id,
-            config_folder="./configs",
-            base_map=data.base_map or "./map.obj",
-            output_folder="./maps",
-            progress_callback=lambda p: update_progress(task_id, p)
-        )
+    build_scheduler.submit(
+        lambda job: run_map_job(job, data, config_files),
+        job_id=task_id,
+        priority=data.priority or 0
     )
 
     return {
         "status": "success",
-        "message": "Map creation started.",
+        "message": "Map creation queued.",
         "task_id": task_id
     }
 
 
+@app.get("/jobs")
+def list_jobs():
+    """
+    List the queued, running and recently finished map builds.
+    """
+    return {"jobs": build_scheduler.list()}
+
+
+@app.get("/jobs/{task_id}")
+def get_job(task_id: str):
+    """
+    Status of a map build: queued (with its queue position), running, done,
+    failed (with the error) or cancelled, and the files it wrote once finished.
+    """
+    status = build_scheduler.status(task_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return status
+
+
+@app.post("/jobs/{task_id}/cancel")
+def cancel_job(task_id: str):
+    """
+    Cancel a map build. A queued build never starts, a running build stops
+    after the maps it is currently building.
+    """
+    if build_scheduler.get(task_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if not build_scheduler.cancel(task_id):
+        return {"status": "error", "message": "Job has already finished."}
+    return {"status": "success", "message": "Cancellation requested.", "task_id": task_id}
+
+
+@app.get("/jobs/{task_id}/files/{filename}")
+def get_job_file(task_id: str, filename: str):
+    """
+    Retrieve a file written by a map build.
+    Returns 404 if file does not exist.
+    """
+    file_path = os.path.join(MAPS_DIR, task_id, filename)
+    if not os.path.isfile(file_path):
+        raise HTTPException(status_code=404, detail="File not found")
+    return FileResponse(file_path, filename=filename)
+
+
 @app.get("/configs/list")
 def list_configs():
     """
@@ -216,30 +386,45 @@ def get_config_file(filename: str):
     return FileResponse(file_path, filename=filename)
 
 
+def map_folders():
+    """
+    The maps directory followed by the folders of the map builds, newest first.
+    """
+    job_folders = [
+        os.path.join(MAPS_DIR, f)
+        for f in os.listdir(MAPS_DIR)
+        if os.path.isdir(os.path.join(MAPS_DIR, f))
+    ]
+    job_folders.sort(key=os.path.getmtime, reverse=True)
+    return [MAPS_DIR] + job_folders
+
+
 @app.get("/maps/list")
 def list_maps():
     """
-    List all map files in the maps directory,
+    List all map files in the maps directory and the folders of the map builds,
     excluding any named 'info.txt'.
     """
-    files = [
-        f
-        for f in os.listdir(MAPS_DIR)
-        if os.path.isfile(os.path.join(MAPS_DIR, f)) and f != "info.txt"
-    ]
+    files = []
+    for folder in map_folders():
+        for f in os.listdir(folder):
+            if os.path.isfile(os.path.join(folder, f)) and f != "info.txt" and f not in files:
+                files.append(f)
     return JSONResponse(content={"files": files})
 
 
 @app.get("/maps/file/{filename}")
 def get_map_file(filename: str):
     """
-    Retrieve a specific map file by filename.
+    Retrieve a specific map file by filename, from the maps directory or
+    the newest map build that wrote it.
     Returns 404 if file does not exist.
     """
-    file_path = os.path.join(MAPS_DIR, filename)
-    if not os.path.exists(file_path):
-        raise HTTPException(status_code=404, detail="File not found")
-    return FileResponse(file_path, filename=filename)
+    for folder in map_folders():
+        file_path = os.path.join(folder, filename)
+        if os.path.isfile(file_path):
+            return FileResponse(file_path, filename=filename)
+    raise HTTPException(status_code=404, detail="File not found")
 
 
 @app.get("/start_progress/{task_id}")
@@ -248,32 +433,28 @@ async def start_progress(task_id: str, background_tasks: BackgroundTasks):
     Check if a given task_id exists in progress store,
     indicating that the task has started.
     """
-    with progress_lock:
-        if task_id not in progress_store:
-            return {"status": "error", "message": "Task ID not found or not started."}
-        else:
-            return {"status": "success", "message": "Task already started.", "task_id": task_id}
+    if task_id not in progress_broker:
+        return {"status": "error", "message": "Task ID not found or not started."}
+    else:
+        return {"status": "success", "message": "Task already started.", "task_id": task_id}
 
 
 @app.websocket("/ws/progress/{task_id}")
 async def websocket_endpoint(websocket: WebSocket, task_id: str):
     """
     WebSocket endpoint to stream progress updates for a given task_id.
-    Sends progress updates every second until progress reaches 100%.
-    Cleans up progress store on disconnect or completion.
+    Sends the state of the task when connected and whenever it changes:
+    "progress" and its "eta" in seconds, maps that failed to build under "failed"
+    with their error, the seconds spent in every stage of pipelined builds under
+    "timings", and for map builds the job "status", the "config" being built, its
+    "stage" and the placed "objects" as [placed, total].
+    Ends when the progress reaches 100% or the map build has finished. A task that
+    finished long ago only sends its final state, an unknown task {"status": "not_found"}.
     """
     await websocket.accept()
     try:
-        while True:
-            await asyncio.sleep(1)  
-
-            with progress_lock:
-                progress = progress_store.get(task_id, 0.0)
-
-            await websocket.send_json({"progress": progress})
-
-            if progress >= 1.0:
-                break
+        async for message in progress_broker.subscribe(task_id):
+            await websocket.send_json(message)
 
     except WebSocketDisconnect:
         print(f"WebSocket disconnected: {task_id}")
@@ -283,8 +464,6 @@ async def websocket_endpoint(websocket: WebSocket, task_id: str):
 
     finally:
         await websocket.close()
-        with progress_lock:
-            progress_store.pop(task_id, None)
 
 
 def clear_directory_but_keep_info_txt(directory_path):
@@ -314,9 +493,15 @@ def clear_configs():
 @app.delete("/clear_maps")
 def clear_maps():
     """
-    Endpoint to delete all map files except 'info.txt'.
+    Endpoint to delete all map files except 'info.txt', and the folders
+    of map builds that are no longer queued or running.
     """
     clear_directory_but_keep_info_txt(MAPS_DIR)
+    for folder in map_folders()[1:]:
+        job = build_scheduler.get(os.path.basename(folder))
+        if job is None or job.done:
+            shutil.rmtree(folder, ignore_errors=True)
+            print(f"Deleted folder: {os.path.basename(folder)}")
     return {"status": "maps content cleared"}
 
 
@@ -326,4 +511,8 @@ def clear_uploads():
     Endpoint to delete all uploaded files except 'info.txt'.
     """
     clear_directory_but_keep_info_txt(UPLOAD_DIR)
+    # Compiled base maps are folders next to their uploads
+    for filename in os.listdir(UPLOAD_DIR):
+        if filename.endswith(".terrain"):
+            shutil.rmtree(os.path.join(UPLOAD_DIR, filename), ignore_errors=True)
     return {"status": "uploads content cleared"}
@@ -0,0 +1,108 @@
+"""
+landscape_benchmark.py
+
+Measures how long applying 10 landscapes to a large grid terrain takes.
+"before" deforms the terrain one landscape at a time: distances to every vertex, a ground
+query, new vertices and repairs over the whole mesh, so trimesh rebuilds its triangle
+tree for the next query. "after" is LandScapeBuilder.apply_landscapes, which finds the
+vertices of a landscape with the vertex index of core.terrain and only refits the faces
+around the vertices the landscapes before it moved. Both ground every landscape on the
+terrain the ones before it left, so they give the same terrain.
+Both start with a terrain whose ray accelerator is built, like the base map template.
+
+Run from the repository root:
+    python benchmarks/landscape_benchmark.py
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import numpy as np
+import trimesh
+from core.augment_tool import ground_heights
+from core.augment_writer import LandScapeBuilder, apply_landscape
+from core.terrain import terrain_intersector
+from models.domain import LandscapeModel, MapConfig
+from tests.helpers import make_grid
+
+GRID = 500
+LANDSCAPES = 10
+
+
+def make_config(count):
+    rng = np.random.default_rng(0)
+    landscapes = [
+        LandscapeModel(
+            position=[float(rng.uniform(-80, 80)), float(rng.choice([-1, 1]) * rng.uniform(2, 5)),
+                      float(rng.uniform(-80, 80))],
+            radius=float(rng.uniform(1, 3)),
+            smoothness=float(rng.uniform(0, 1))
+        )
+        for _ in range(count)
+    ]
+    return MapConfig(map="map.obj", objects=[], landscapes=landscapes)
+
+
+def apply_one_by_one(config, mesh):
+    """
+    Landscapes the way they were applied before the combined pass and the footprint index.
+    """
+    for landscape in config.landscapes:
+        vertices = mesh.vertices.copy()
+        peak_y = landscape.position[1]
+        distances = np.linalg.norm(vertices[:, [0, 2]] - np.array(landscape.position)[[0, 2]], axis=1)
+        max_radius = abs(peak_y) * landscape.radius
+        affected = np.nonzero(distances <= max_radius)[0]
+        if len(affected) > 0:
+            falloff = LandScapeBuilder._compute_falloff(distances[affected], max_radius, landscape.smoothness)
+            ground_y = ground_heights(vertices[affected], mesh)
+            if peak_y >= 0:
+                target = ground_y + (peak_y - ground_y) * falloff
+                update = (target > ground_y) & (target > vertices[affected, 1])
+            else:
+                target = ground_y - abs(peak_y) * falloff
+                update = (target < ground_y) & (target < vertices[affected, 1])
+            vertices[affected[update], 1] = target[update]
+        mesh.vertices = vertices
+        mesh.remove_degenerate_faces()
+        mesh.remove_duplicate_faces()
+        mesh.fix_normals()
+    return mesh
+
+
+def time_landscapes(apply, terrain, config, probe):
+    start = time.perf_counter()
+    mesh = apply(config, terrain)
+    # Ground query on the result, like the object placement that follows
+    ground_heights(probe, mesh)
+    return time.perf_counter() - start
+
+
+def apply_combined(config, terrain):
+    scene = trimesh.Scene()
+    scene.add_geometry(terrain, geom_name="ground")
+    apply_landscape(config, LandScapeBuilder(), scene)
+    return next(iter(scene.geometry.values()))
+
+
+def main():
+    config = make_config(LANDSCAPES)
+    probe = np.column_stack([np.linspace(-90, 90, 100), np.full(100, 10.0), np.linspace(90, -90, 100)])
+
+    terrain = make_grid(GRID, size=100.0)
+    ground_heights(probe, terrain)
+    before = time_landscapes(apply_one_by_one, terrain, config, probe)
+
+    terrain = make_grid(GRID, size=100.0)
+    terrain_intersector(terrain)
+    ground_heights(probe, terrain)
+    after = time_landscapes(apply_combined, terrain, config, probe)
+
+    print(f"{'faces':>9} {'landscapes':>11} {'before (s)':>12} {'after (s)':>12} {'speedup':>9}")
+    print(f"{len(terrain.faces):>9} {LANDSCAPES:>11} {before:>12.3f} {after:>12.3f} {before / after:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+placement_benchmark.py
+
+Measures how long ModelAdder takes to place 100, 1k and 10k random objects.
+"before" checks every candidate against the list of all placed objects with
+control_collision, "after" uses the SpatialHashGrid that ModelAdder keeps.
+
+Run from the repository root:
+    python benchmarks/placement_benchmark.py
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import numpy as np
+import trimesh
+from core.augment_tool import ModelAdder, control_collision, create_random_points, ground_heights
+from models.domain import AddModelConfig
+
+BOUNDS = [(-50, 0, -50), (50, 0, 50)]
+SCALE = 0.5
+
+
+class ListScanModelAdder(ModelAdder):
+    """
+    Placement the way it was done before the spatial index: every candidate
+    is checked against every placed object.
+    """
+
+    def _find_valid_positions(self, scale, count, max_attempts=None):
+        placed = []
+        while len(placed) < count:
+            candidates = create_random_points(self.bounds, count - len(placed))
+            candidates[:, 1] = ground_heights(candidates, self.base_mesh, self.heightfield) + scale / 2
+            for candidate in candidates:
+                new_pos = candidate.tolist()
+                if not control_collision(new_pos, scale, placed):
+                    placed.append(_Placed(new_pos, scale))
+        return [obj.position for obj in placed]
+
+
+class _Placed:
+    def __init__(self, position, scale):
+        self.position = position
+        self.scale = scale
+
+
+def flat_ground():
+    ground = trimesh.creation.box(extents=[100, 1, 100])
+    ground.apply_translation([0, -0.5, 0])
+    return ground
+
+
+def time_placement(adder_class, count, mesh):
+    aug = AddModelConfig(type="add_model", model="cube", scale=SCALE, count=count, position="random")
+    np.random.seed(0)
+    start = time.perf_counter()
+    objects = adder_class(BOUNDS, mesh).generate(aug)
+    elapsed = time.perf_counter() - start
+    assert len(objects) == count
+    return elapsed
+
+
+def main():
+    mesh = flat_ground()
+    print(f"{'objects':>8} {'before (s)':>12} {'after (s)':>12} {'speedup':>9}")
+    for count in (100, 1_000, 10_000):
+        before = time_placement(ListScanModelAdder, count, mesh)
+        after = time_placement(ModelAdder, count, mesh)
+        print(f"{count:>8} {before:>12.3f} {after:>12.3f} {before / after:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
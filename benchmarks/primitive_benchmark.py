@@ -0,0 +1,76 @@
+"""
+primitive_benchmark.py
+
+Measures how long ShapeFactory takes to create 10k placed primitives.
+"before" builds every primitive with trimesh.creation and transforms it with a
+scale and a translation matrix, "after" uses the cached unit shapes of the creators.
+
+Run from the repository root:
+    python benchmarks/primitive_benchmark.py
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import numpy as np
+import trimesh
+from trimesh.transformations import translation_matrix, scale_matrix
+from core.augment_writer import ShapeFactory
+from models.domain import StandardModelObject
+
+COUNT = 10_000
+MODELS = ("cube", "sphere", "cylinder", "cone")
+COLORS = ([255, 0, 0], [0, 255, 0], [0, 0, 255])
+
+UNIT_SHAPES = {
+    "cube": lambda: trimesh.creation.box(extents=[1, 1, 1]),
+    "sphere": lambda: trimesh.creation.uv_sphere(radius=0.5),
+    "cylinder": lambda: trimesh.creation.cylinder(radius=0.5, height=1.0),
+    "cone": lambda: trimesh.creation.cone(radius=0.5, height=1.0),
+}
+
+
+def rebuild_shape(obj_conf):
+    """
+    Primitive creation the way it was done before the unit shapes were cached.
+    """
+    mesh = UNIT_SHAPES[obj_conf.model]()
+    mesh.visual.face_colors = np.array(obj_conf.color * np.ones(3))
+    mesh.apply_transform(scale_matrix(obj_conf.scale))
+    mesh.apply_transform(translation_matrix(obj_conf.position))
+    return mesh
+
+
+def make_objects(count):
+    rng = np.random.default_rng(0)
+    return [
+        StandardModelObject(
+            model=MODELS[i % len(MODELS)],
+            scale=float(rng.uniform(0.5, 3.0)),
+            position=rng.uniform(-50, 50, 3).tolist(),
+            color=COLORS[i % len(COLORS)]
+        )
+        for i in range(count)
+    ]
+
+
+def time_creation(create_shape, objects):
+    start = time.perf_counter()
+    for obj_conf in objects:
+        create_shape(obj_conf)
+    return time.perf_counter() - start
+
+
+def main():
+    objects = make_objects(COUNT)
+    factory = ShapeFactory()
+    before = time_creation(rebuild_shape, objects)
+    after = time_creation(factory.create_shape, objects)
+    print(f"{'objects':>8} {'before (s)':>12} {'after (s)':>12} {'speedup':>9}")
+    print(f"{COUNT:>8} {before:>12.3f} {after:>12.3f} {before / after:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+tile_benchmark.py
+
+Measures how long building a map takes on a large grid terrain (10 landscapes and 20k
+objects per config, export excluded). "before" deforms the whole terrain and casts the
+ground rays against it in this process, "after" splits it into 4 x 4 terrain tiles that
+worker processes deform and query. The first config warms the indexes and is not timed.
+
+Run from the repository root:
+    python benchmarks/tile_benchmark.py
+"""
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import numpy as np
+import core.reader as reader
+from core.augment_writer import SceneManager
+from models.domain import LandscapeModel, MapConfig, StandardModelObject
+from tests.helpers import make_grid
+
+GRID = 708
+TILES = 4
+WORKERS = min(os.cpu_count() or 1, 8)
+CONFIGS = 4
+OBJECTS = 20000
+
+
+def make_config(rng, name):
+    landscapes = [
+        LandscapeModel(
+            position=[float(rng.uniform(-80, 80)), float(rng.choice([-1, 1]) * rng.uniform(2, 5)),
+                      float(rng.uniform(-80, 80))],
+            radius=float(rng.uniform(1, 3)),
+            smoothness=float(rng.uniform(0, 1))
+        )
+        for _ in range(10)
+    ]
+    objects = [
+        StandardModelObject(model="cube", scale=0.3, position=[float(x), 10.0, float(z)], color=[0, 0, 255])
+        for x, z in rng.uniform(-95, 95, (OBJECTS, 2))
+    ]
+    return MapConfig(map=f"{name}.glb", objects=objects, landscapes=landscapes)
+
+
+def time_builds(config_files, **tiles):
+    manager = SceneManager(str(reader.CONFIG_DIR), "base.obj", "maps", **tiles)
+    try:
+        manager.build_map_scene(config_files[0])
+        start = time.perf_counter()
+        for config_file in config_files[1:]:
+            manager.build_map_scene(config_file)
+        return (time.perf_counter() - start) / (len(config_files) - 1)
+    finally:
+        manager.close()
+
+
+def main():
+    with tempfile.TemporaryDirectory() as folder:
+        reader.UPLOAD_DIR = Path(folder) / "uploads"
+        reader.CONFIG_DIR = Path(folder) / "configs"
+        reader.UPLOAD_DIR.mkdir()
+        reader.CONFIG_DIR.mkdir()
+        terrain = make_grid(GRID, size=100.0)
+        terrain.export(reader.UPLOAD_DIR / "base.obj")
+        rng = np.random.default_rng(0)
+        config_files = []
+        for i in range(CONFIGS):
+            config_file = reader.CONFIG_DIR / f"map_{i}.json"
+            config_file.write_text(make_config(rng, f"map_{i}").model_dump_json(), encoding="utf-8")
+            config_files.append(config_file)
+
+        before = time_builds(config_files)
+        after = time_builds(config_files, terrain_tiles=TILES, tile_workers=WORKERS)
+
+    print(f"{'faces':>9} {'tiles':>6} {'workers':>8} {'before (s)':>12} {'after (s)':>12} {'speedup':>9}")
+    print(f"{len(terrain.faces):>9} {TILES * TILES:>6} {WORKERS:>8} {before:>12.3f} {after:>12.3f} "
+          f"{before / after:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
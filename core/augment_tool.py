@@ -10,7 +10,13 @@ import math
 import random
 import numpy as np
 import trimesh
-from models.domain import CustomModelObject, StandardModelObject, LandscapeModel
+from core.terrain import closest_points
+from models.domain import LandscapeModel, PlacedObjects
+
+# Random placement draws candidates in blocks of at least this many points
+MIN_CANDIDATE_BLOCK = 64
+# Default budget of random candidates per requested object before placement gives up
+MAX_ATTEMPTS_PER_OBJECT = 1000
 
 
 class AugmenterRegistry:
@@ -37,14 +43,22 @@ class Augmenter(ABC):
     An abstract class for providing augmentation informations. 
     All other augmentations is going to inherit from this one.
     """
-    def __init__(self, bounds, base_mesh):
+    def __init__(self, bounds, base_mesh, heightfield=None):
         self.bounds = bounds
         self.base_mesh = base_mesh
+        self.heightfield = heightfield
 
     @abstractmethod
     def generate(self, aug):
         pass
 
+    def generate_batch(self, aug, map_count):
+        """
+        The results of generate for map_count independent maps, as one list per map.
+        Augmenters override this to draw the random values of all maps at once.
+        """
+        return [self.generate(aug) for _ in range(map_count)]
+
 
 
 @AugmenterRegistry.register("add_model")
@@ -53,44 +67,88 @@ class ModelAdder(Augmenter):
     ModelAdder class is for adding models to the map.
     """
     def generate(self, aug):
-        results = []
-        for _ in range(aug.count):
-            pos = self._get_position(aug, results)
-            model_obj = self._create_model_object(aug, pos)
-            results.append(model_obj)
-        return results
+        positions = self._get_positions(aug)
+        return self._placed_objects(aug, positions).to_models()
+
+    def generate_batch(self, aug, map_count):
+        return [placed.to_models() for placed in self.place_batch(aug, map_count)]
 
-    def _get_position(self, aug, results):
+    def place_batch(self, aug, map_count):
+        """
+        The objects of aug for map_count independent maps, as one PlacedObjects per map.
+        """
         if aug.position == "random":
-            return self._find_valid_position(aug.scale, results)
-        return aug.position
+            batch = self._find_valid_positions_batch(aug.scale, aug.count, map_count, aug.max_attempts)
+        else:
+            batch = [[aug.position] * aug.count for _ in range(map_count)]
+        return [self._placed_objects(aug, positions) for positions in batch]
 
-    def _create_model_object(self, aug, position):
-        base_data = {
-            'model': aug.model,
-            'position': position,
-            'scale': aug.scale
-        }
-        
+    def _placed_objects(self, aug, positions):
         if aug.model == "custom":
-            return CustomModelObject(model_path=aug.custom_path, **base_data)
-        else:
-            return StandardModelObject(color=aug.color, **base_data)
-    
-    
+            return PlacedObjects.of_kind(aug.model, positions, aug.scale, model_path=aug.custom_path)
+        return PlacedObjects.of_kind(aug.model, positions, aug.scale, color=aug.color)
+
+    def _get_positions(self, aug):
+        if aug.position == "random":
+            return self._find_valid_positions(aug.scale, aug.count, aug.max_attempts)
+        return [aug.position] * aug.count
+
+    def _find_valid_positions(self, scale, count, max_attempts=None):
+        return self._find_valid_positions_batch(scale, count, 1, max_attempts)[0].tolist()
 
-    def _find_valid_position(self, scale, placed):
+    def _find_valid_positions_batch(self, scale, count, map_count, max_attempts=None):
         """
-        Create random positions, Control if that random positions attached to the ground.
-        If it is control if that random positions collide with other objects.  
+        Rejection sampling in blocks, for map_count independent maps at once. Every round
+        draws a block of random candidates for each unfinished map and attaches all of them
+        to the ground with one ray query; then, per map, candidates colliding with placed
+        objects or with earlier candidates of the same block are dropped all at once.
+        Returns an (count, 3) array of positions per map.
+        Raises PlacementError when max_attempts candidates are drawn for a map without placing count objects.
         """
-
-        while True:
-            x, y, z = create_random_xyz(self.bounds)
-            y_fixed = control_random_creation(x, y, z, self.base_mesh) + scale / 2
-            new_pos = [x, y_fixed, z]
-            if not control_collision(new_pos, scale, placed):
-                return new_pos
+        if max_attempts is None:
+            max_attempts = max(count * MAX_ATTEMPTS_PER_OBJECT, MIN_CANDIDATE_BLOCK)
+
+        grids = [SpatialHashGrid(cell_size=scale) for _ in range(map_count)]
+        positions = [[] for _ in range(map_count)]
+        placed_counts = [0] * map_count
+        attempts = [0] * map_count
+        acceptance = [1.0] * map_count
+        unfinished = [i for i in range(map_count) if count > 0]
+        while unfinished:
+            # The ray query is shared by the round, so the minimum block is spread over its maps
+            min_block = int(math.ceil(MIN_CANDIDATE_BLOCK / len(unfinished)))
+            blocks = []
+            for i in unfinished:
+                remaining = count - placed_counts[i]
+                # Size the block from the acceptance rate of the previous one, so a filling map
+                # still gets enough candidates per ray query.
+                wanted = int(math.ceil(remaining / max(acceptance[i], 0.01)))
+                block = min(max(wanted, min_block), max_attempts - attempts[i])
+                if block <= 0:
+                    raise PlacementError(
+                        f"Could only place {placed_counts[i]} of {count} objects with scale {scale} "
+                        f"after {attempts[i]} attempts. The map is too dense for this augmentation."
+                    )
+                attempts[i] += block
+                blocks.append(block)
+
+            all_candidates = create_random_points(self.bounds, sum(blocks))
+            all_candidates[:, 1] = ground_heights(all_candidates, self.base_mesh, self.heightfield) + scale / 2
+            splits = np.cumsum(blocks)[:-1]
+
+            for i, block, candidates in zip(unfinished, blocks, np.split(all_candidates, splits)):
+                remaining = count - placed_counts[i]
+                scales = np.full(block, float(scale))
+                free = ~grids[i].collides_many(candidates, scales)
+                candidates, scales = candidates[free], scales[free]
+                accepted = candidates[grids[i].first_non_colliding(candidates, scales)][:remaining]
+
+                acceptance[i] = len(accepted) / block
+                grids[i].insert_many(accepted, scales[:len(accepted)])
+                positions[i].append(accepted)
+                placed_counts[i] += len(accepted)
+            unfinished = [i for i in unfinished if placed_counts[i] < count]
+        return [np.concatenate(parts) if parts else np.empty((0, 3)) for parts in positions]
             
 
 #TODO: Add landscape module. # pylint: disable=fixme
@@ -106,6 +164,30 @@ class LandScape(Augmenter):
             results.append(model)
 
         return results
+
+    def generate_batch(self, aug, map_count):
+        """
+        Draws the positions, smoothness and radii of all landscapes of all maps at once.
+        """
+        total = map_count * aug.count
+        if aug.position == "random":
+            positions = create_random_points(self.bounds, total).tolist()
+        else:
+            positions = [aug.position] * total
+        if aug.smoothness == "random":
+            smoothness = np.random.random(total).tolist()
+        else:
+            smoothness = [aug.smoothness] * total
+        if aug.radius == "random":
+            radii = np.random.uniform(0, 2, total).tolist()
+        else:
+            radii = [aug.radius] * total
+
+        models = [
+            LandscapeModel(position=position, smoothness=smooth, radius=radius)
+            for position, smooth, radius in zip(positions, smoothness, radii)
+        ]
+        return [models[i * aug.count:(i + 1) * aug.count] for i in range(map_count)]
     
     def _get_position(self, aug):
         if (aug.position == "random"):
@@ -138,18 +220,33 @@ class LandScape(Augmenter):
             
 
     
-def augment(bounds, aug, base_mesh):
+def augment(bounds, aug, base_mesh, heightfield=None):
     """
     The function that is going to be called from outside.
     All main functionalities will work here.
+    heightfield is an optional precomputed HeightField of base_mesh for faster ground queries.
+    """
+    return create_augmenter(bounds, aug, base_mesh, heightfield).generate(aug)
+
+
+def augment_batch(bounds, aug, base_mesh, map_count, heightfield=None):
+    """
+    Batched version of augment: the results of aug for map_count independent maps,
+    as one list per map, with the random values of all maps drawn at once.
+    """
+    return create_augmenter(bounds, aug, base_mesh, heightfield).generate_batch(aug, map_count)
+
+
+def create_augmenter(bounds, aug, base_mesh, heightfield=None):
+    """
+    The registered augmenter of the augmentation type.
     """
     augmenter_class = AugmenterRegistry.get(aug.type)
 
     if augmenter_class is None:
         raise ValueError(f"Unknown augment type: {aug.type}")
 
-    augmenter = augmenter_class(bounds, base_mesh)
-    return augmenter.generate(aug)
+    return augmenter_class(bounds, base_mesh, heightfield)
 
 
 
@@ -164,6 +261,195 @@ def create_random_xyz(map_bounds):
 
 
 
+def create_random_points(map_bounds, count):
+    """
+    Creates count random locations at once as an (count, 3) array.
+    """
+    low = np.asarray(map_bounds[0], dtype=np.float64)
+    high = np.asarray(map_bounds[1], dtype=np.float64)
+    return np.random.uniform(low, high, size=(count, 3))
+
+
+class PlacementError(ValueError):
+    """
+    Raised when the objects of an augmentation can not be placed without collisions.
+    """
+
+
+class SpatialHashGrid:
+    """
+    Uniform grid of the placed objects for collision checks.
+    Objects are hashed into cubic cells by their position, so a collision query
+    only looks at the cells that an object could be colliding from instead of
+    every placed object. Gives the same answers as control_collision.
+
+    Single queries use a dict of cells. Bulk queries use the same cells as sorted
+    int64 keys, so a whole block of candidates is checked with NumPy at once.
+    """
+
+    # Cells are hashed into one int64 key. Two cells sharing a key only add
+    # candidates to the exact distance check, they never hide a collision.
+    _HASH = np.array([73856093, 19349663, 83492791], dtype=np.int64)
+
+    def __init__(self, cell_size):
+        self.cell_size = float(cell_size) if cell_size > 0 else 1.0
+        self._cells = {}
+        self._max_scale = 0.0
+        self._positions = np.empty((0, 3))
+        self._scales = np.empty(0)
+        self._pending = []
+        self._sorted = None
+
+    def __len__(self):
+        return len(self._scales) + sum(len(scales) for _, scales in self._pending)
+
+    def _cell(self, value):
+        return int(math.floor(value / self.cell_size))
+
+    def insert(self, position, scale):
+        key = (self._cell(position[0]), self._cell(position[1]), self._cell(position[2]))
+        self._cells.setdefault(key, []).append((position[0], position[1], position[2], scale))
+        self._max_scale = max(self._max_scale, scale)
+        self._pending.append((np.array([position[:3]], dtype=np.float64), np.array([scale], dtype=np.float64)))
+        self._sorted = None
+
+    def insert_many(self, positions, scales):
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+        scales = np.asarray(scales, dtype=np.float64).reshape(-1)
+        if len(positions) == 0:
+            return
+        for position, scale in zip(positions.tolist(), scales.tolist()):
+            key = (self._cell(position[0]), self._cell(position[1]), self._cell(position[2]))
+            self._cells.setdefault(key, []).append((position[0], position[1], position[2], scale))
+        self._max_scale = max(self._max_scale, float(scales.max()))
+        self._pending.append((positions, scales))
+        self._sorted = None
+
+    def collides(self, new_pos, new_scale):
+        """
+        Check if an object at new_pos with new_scale would collide with any placed object.
+        """
+        if not self._cells:
+            return False
+
+        # Farthest distance that can still be a collision with any placed object.
+        reach = (new_scale + self._max_scale) / 2
+        ranges = [
+            range(self._cell(new_pos[axis] - reach), self._cell(new_pos[axis] + reach) + 1)
+            for axis in range(3)
+        ]
+        cells = self._cells
+        for i in ranges[0]:
+            for j in ranges[1]:
+                for k in ranges[2]:
+                    for old_x, old_y, old_z, old_scale in cells.get((i, j, k), ()):
+                        dist = math.sqrt(
+                            (new_pos[0] - old_x) ** 2 +
+                            (new_pos[1] - old_y) ** 2 +
+                            (new_pos[2] - old_z) ** 2
+                        )
+                        if dist < (new_scale + old_scale) / 2:
+                            return True
+        return False
+
+    def collides_many(self, positions, scales):
+        """
+        Bulk version of collides. Returns a mask of the positions that collide with a placed object.
+        """
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+        scales = np.asarray(scales, dtype=np.float64).reshape(-1)
+        result = np.zeros(len(positions), dtype=bool)
+        if len(positions) == 0 or not self._cells:
+            return result
+
+        self._flush()
+        keys, order = self._sorted
+        reach = (scales.max() + self._max_scale) / 2
+        query, other = self._candidate_pairs(positions, reach, keys, order)
+        hits = self._pair_collides(positions, scales, query, self._positions, self._scales, other)
+        result[query[hits]] = True
+        return result
+
+    def first_non_colliding(self, positions, scales):
+        """
+        Mask of the positions to keep when they are placed in order:
+        a position is dropped if it collides with an earlier kept one.
+        """
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+        scales = np.asarray(scales, dtype=np.float64).reshape(-1)
+        keep = np.ones(len(positions), dtype=bool)
+        if len(positions) < 2:
+            return keep
+
+        keys = self._keys(np.floor(positions / self.cell_size).astype(np.int64))
+        order = np.argsort(keys, kind="stable")
+        reach = scales.max()
+        query, other = self._candidate_pairs(positions, reach, keys[order], order)
+        later = query > other
+        query, other = query[later], other[later]
+        hits = self._pair_collides(positions, scales, query, positions, scales, other)
+        query, other = query[hits], other[hits]
+        if len(query) == 0:
+            return keep
+
+        # Only the candidates that take part in a collision need the sequential pass.
+        pairs = np.lexsort((other, query))
+        conflicts = {}
+        for later_idx, earlier_idx in zip(query[pairs].tolist(), other[pairs].tolist()):
+            conflicts.setdefault(later_idx, []).append(earlier_idx)
+        for later_idx in sorted(conflicts):
+            if any(keep[earlier_idx] for earlier_idx in conflicts[later_idx]):
+                keep[later_idx] = False
+        return keep
+
+    def _flush(self):
+        if self._pending:
+            self._positions = np.concatenate([self._positions] + [p for p, _ in self._pending])
+            self._scales = np.concatenate([self._scales] + [s for _, s in self._pending])
+            self._pending = []
+            self._sorted = None
+        if self._sorted is None:
+            keys = self._keys(np.floor(self._positions / self.cell_size).astype(np.int64))
+            order = np.argsort(keys, kind="stable")
+            self._sorted = (keys[order], order)
+
+    def _keys(self, cells):
+        return (cells * self._HASH).sum(axis=1)
+
+    def _candidate_pairs(self, positions, reach, sorted_keys, order):
+        """
+        (query index, stored index) pairs of every stored object in the cells within reach of a query position.
+        """
+        low = np.floor((positions - reach) / self.cell_size).astype(np.int64)
+        high = np.floor((positions + reach) / self.cell_size).astype(np.int64)
+        span = int((high - low).max()) + 1
+        steps = np.arange(span)
+        offsets = np.stack(np.meshgrid(steps, steps, steps, indexing="ij"), axis=-1).reshape(-1, 3)
+
+        cells = low[:, None, :] + offsets[None, :, :]
+        inside = np.all(cells <= high[:, None, :], axis=2)
+        query = np.broadcast_to(np.arange(len(positions))[:, None], inside.shape)[inside]
+        keys = self._keys(cells[inside])
+
+        start = np.searchsorted(sorted_keys, keys, side="left")
+        stop = np.searchsorted(sorted_keys, keys, side="right")
+        counts = stop - start
+        total = int(counts.sum())
+        if total == 0:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty
+
+        first = np.repeat(start - np.cumsum(counts) + counts, counts)
+        other = order[first + np.arange(total)]
+        return np.repeat(query, counts), other
+
+    @staticmethod
+    def _pair_collides(positions, scales, query, other_positions, other_scales, other):
+        delta = positions[query] - other_positions[other]
+        dist = np.sqrt(delta[:, 0] ** 2 + delta[:, 1] ** 2 + delta[:, 2] ** 2)
+        return dist < (scales[query] + other_scales[other]) / 2
+
+
 def control_collision(new_pos, new_scale, placed_objects):
     """
     Check if the model that is going to be created is colliding.
@@ -208,10 +494,74 @@ def control_random_creation(x, y, z, mesh_for_query):
         closest_idx = np.argmin(distances)
         closest_intersection = locations[closest_idx]
         return closest_intersection[1]
-    closest_point, _, _ = mesh_for_query.nearest.on_surface([ray_origin])
+    closest_point, _, _ = closest_points(mesh_for_query, [ray_origin])
     return closest_point[0][1]
 
 
+def ground_heights(points, mesh_for_query, heightfield=None):
+    """
+    Batched version of control_random_creation.
+    Takes N (x, y, z) points and returns N ground heights from one ray query.
+    Rays that miss the ground fall back to the closest point on the surface.
+    If a heightfield of the mesh is given, the grid answers instead and the rays
+    are only cast for the points it can not answer.
+    """
+    if heightfield is not None:
+        return heightfield.ground_heights(points, mesh_for_query)
+
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    heights = ray_heights(points, mesh_for_query)
+    misses = np.nonzero(np.isnan(heights))[0]
+    if len(misses) > 0:
+        ray_origins, _ = _ground_rays(points[misses])
+        on_surface, _, _ = closest_points(mesh_for_query, ray_origins)
+        heights[misses] = np.asarray(on_surface)[:, 1]
+    return heights
+
+
+def ray_heights(points, mesh_for_query):
+    """
+    Ground heights of N (x, y, z) points from one vertical ray query, NaN where the ray misses.
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    count = len(points)
+    heights = np.full(count, np.nan)
+    if count == 0:
+        return heights
+
+    ray_origins, ray_directions = _ground_rays(points)
+    locations, index_ray, _ = mesh_for_query.ray.intersects_location(
+        ray_origins=ray_origins,
+        ray_directions=ray_directions
+    )
+    locations = np.asarray(locations, dtype=np.float64).reshape(-1, 3)
+    index_ray = np.asarray(index_ray, dtype=np.int64).reshape(-1)
+
+    if len(locations) > 0:
+        distances = np.linalg.norm(locations - ray_origins[index_ray], axis=1)
+        # Sort hits by ray, then by distance; the first hit of each ray is the closest one.
+        order = np.lexsort((distances, index_ray))
+        sorted_rays = index_ray[order]
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = sorted_rays[1:] != sorted_rays[:-1]
+        closest = order[first]
+        heights[index_ray[closest]] = locations[closest, 1]
+    return heights
+
+
+def _ground_rays(points):
+    """Origins and directions of the vertical rays that look for the ground at the points."""
+    offset = 0.01
+    scene_center = 0
+
+    below = points[:, 1] < scene_center
+    ray_origins = points.copy()
+    ray_origins[:, 1] = np.where(below, points[:, 1] - offset, points[:, 1] + offset)
+    ray_directions = np.zeros((len(points), 3))
+    ray_directions[:, 1] = np.where(below, 1.0, -1.0)
+    return ray_origins, ray_directions
+
+
 def visualize_ray(scene, origin, direction, length=10.0, hit_points=None):
     """
     Just a helper function to see can we find the nearest point to the ground.
@@ -1,17 +1,32 @@
 import numpy as np
 import trimesh
 import asyncio
+import os
+import queue
 import threading
+import time
 import concurrent.futures
 from fastapi import WebSocket
 from pathlib import Path
 from abc import ABC, abstractmethod
-from core.reader import load_map_config, load_scene
+from core.reader import load_map_config, load_heightfield, SceneTemplate, CONFIG_EXTENSIONS
 from trimesh.transformations import translation_matrix, scale_matrix
-from core.augment_tool import control_random_creation
+from core.augment_tool import ground_heights
+from core.lod import LODS_KEY, LodShapeFactory, check_ratios, decimate, lod_cache, lod_filename, lod_scene, msft_lod
+from core.mesh_cache import mesh_cache, clone_geometry
+from core.obj_writer import export_obj, serialize_obj
+from core.terrain import deform, terrain_intersector, touched_faces, vertices_within
+from core.tiles import TilePool
+from models.domain import PlacedObject, PlacedObjects
 
-progress_lock = threading.Lock()
-progress_store = {}
+# Output formats that keep scene graph instancing, repeated models are stored once
+INSTANCED_FORMATS = {".glb", ".gltf"}
+
+# Object placement progress is reported at most this many times per map
+OBJECT_EVENTS = 100
+
+# Ends a stage of the export pipeline
+_STOP = object()
 
 class ShapeCreator(ABC):
     """
@@ -22,6 +37,21 @@ class ShapeCreator(ABC):
     def create_shape(self, obj_conf) -> trimesh.Trimesh:
         """Create a specific shape based on configuration."""
         pass
+
+    def template_key(self, obj_conf):
+        """Objects with the same key share one template geometry when instancing."""
+        return (obj_conf.model, tuple(getattr(obj_conf, "color", None) or ()))
+
+    def create_template(self, obj_conf):
+        """
+        The shape of the object at scale 1 and the origin.
+        Placed instances reference it with a scale + translation transform.
+        """
+        if isinstance(obj_conf, PlacedObject):
+            unit_conf = obj_conf._replace(scale=1.0, position=[0.0, 0.0, 0.0])
+        else:
+            unit_conf = obj_conf.model_copy(update={"scale": 1.0, "position": [0.0, 0.0, 0.0]})
+        return self.create_shape(unit_conf)
     
     def _apply_transformations(self, mesh: trimesh.Trimesh, obj_conf):
         """Apply common transformations (scale, position, color)."""
@@ -36,52 +66,120 @@ class ShapeCreator(ABC):
         return mesh
 
 
-class CubeCreator(ShapeCreator):
+class PrimitiveCreator(ShapeCreator):
+    """
+    Base class of the basic shapes.
+    The unit shape is built once per creator. A placed shape is a copy of its vertices
+    with one fused scale + translation; faces and face normals are shared with the unit
+    shape and the face colors of a color are only computed once.
+    """
+
+    def __init__(self):
+        self._unit = None
+        self._face_colors = {}
+
+    @abstractmethod
+    def create_unit_shape(self) -> trimesh.Trimesh:
+        """Create the shape at scale 1 around the origin."""
+        pass
+
+    def unit_shape(self) -> trimesh.Trimesh:
+        if self._unit is None:
+            unit = self.create_unit_shape()
+            unit.vertices.flags.writeable = False
+            unit.faces.flags.writeable = False
+            self._unit = unit
+        return self._unit
+
+    def create_shape(self, obj_conf) -> trimesh.Trimesh:
+        unit = self.unit_shape()
+        scale = float(obj_conf.scale)
+        vertices = unit.vertices * scale + np.asarray(obj_conf.position, dtype=np.float64)
+        mesh = trimesh.Trimesh(
+            vertices=vertices,
+            faces=unit.faces,
+            metadata=unit.metadata.copy(),
+            process=False,
+            validate=False
+        )
+        mesh.visual = trimesh.visual.ColorVisuals(mesh, face_colors=self._colors(obj_conf.color))
+        return mesh
+
+    def _colors(self, color):
+        """Face colors of the unit shape in one color, computed once per color."""
+        key = tuple(color)
+        face_colors = self._face_colors.get(key)
+        if face_colors is None:
+            colored = self.unit_shape().copy()
+            colored.visual.face_colors = np.array(color * np.ones(3))
+            face_colors = np.ascontiguousarray(colored.visual.face_colors)
+            face_colors.flags.writeable = False
+            self._face_colors[key] = face_colors
+        return face_colors
+
+
+class CubeCreator(PrimitiveCreator):
     """Creates cube shapes."""
     
-    def create_shape(self, obj_conf) -> trimesh.Trimesh:
-        cube = trimesh.creation.box(extents=[1, 1, 1])
-        return self._apply_transformations(cube, obj_conf)
+    def create_unit_shape(self) -> trimesh.Trimesh:
+        return trimesh.creation.box(extents=[1, 1, 1])
 
 
-class SphereCreator(ShapeCreator):
+class SphereCreator(PrimitiveCreator):
     """Creates sphere shapes."""
     
-    def create_shape(self, obj_conf) -> trimesh.Trimesh:
-        sphere = trimesh.creation.uv_sphere(radius=0.5)
-        return self._apply_transformations(sphere, obj_conf)
+    def create_unit_shape(self) -> trimesh.Trimesh:
+        return trimesh.creation.uv_sphere(radius=0.5)
 
 
-class CylinderCreator(ShapeCreator):
+class CylinderCreator(PrimitiveCreator):
     """Creates cylinder shapes."""
     
-    def create_shape(self, obj_conf) -> trimesh.Trimesh:
-        cylinder = trimesh.creation.cylinder(radius=0.5, height=1.0)
-        return self._apply_transformations(cylinder, obj_conf)
+    def create_unit_shape(self) -> trimesh.Trimesh:
+        return trimesh.creation.cylinder(radius=0.5, height=1.0)
 
 
-class ConeCreator(ShapeCreator):
+class ConeCreator(PrimitiveCreator):
     """Creates cone shapes."""
     
-    def create_shape(self, obj_conf) -> trimesh.Trimesh:
-        cone = trimesh.creation.cone(radius=0.5, height=1.0)
-        return self._apply_transformations(cone, obj_conf)
+    def create_unit_shape(self) -> trimesh.Trimesh:
+        return trimesh.creation.cone(radius=0.5, height=1.0)
 
 
 class CustomModelCreator(ShapeCreator):
     """
     Creates shapes from custom model files.
+    Every model file is loaded once per creator as a template of parts with their node
+    transforms already applied. A placed shape is baked from the template with one
+    scale + translation of the vertices, sharing faces and materials with the template.
     """
+
+    def __init__(self):
+        self._templates = {}
+
+    def template_key(self, obj_conf):
+        return ("custom", obj_conf.model_path)
+
+    def create_template(self, obj_conf) -> trimesh.Scene:
+        template = self._templates.get(obj_conf.model_path)
+        if template is None:
+            # Load custom model (parsed once per file content, this is a copy)
+            template = flatten_scene(mesh_cache.load(obj_conf.model_path))
+            self._templates[obj_conf.model_path] = template
+        return template
     
-    def create_shape(self, obj_conf) -> trimesh.Trimesh:
-        # Load custom model 
-        mesh = trimesh.load(obj_conf.model_path)
-        
+    def create_shape(self, obj_conf) -> trimesh.Scene:
+        template = self.create_template(obj_conf)
         # Only apply scale and position for custom models (they have their own materials)
-        mesh.apply_transform(scale_matrix(obj_conf.scale))
-        mesh.apply_transform(translation_matrix(obj_conf.position))
-        
-        return mesh
+        scale = float(obj_conf.scale)
+        position = np.asarray(obj_conf.position, dtype=np.float64)
+        shape = trimesh.Scene()
+        for name, part in template.geometry.items():
+            shape.add_geometry(
+                clone_geometry(part, vertices=part.vertices * scale + position),
+                geom_name=name
+            )
+        return shape
     
     def _apply_transformations(self, mesh, obj_conf):
         """
@@ -109,54 +207,284 @@ class ShapeFactory:
             'cone': ConeCreator(),
             'custom': CustomModelCreator(),
         }
+        self._templates = {}
     
     def create_shape(self, obj_conf) -> trimesh.Trimesh:
         """Create a shape based on the object configuration."""
+        return self._get_creator(obj_conf).create_shape(obj_conf)
+
+    def create_template(self, obj_conf):
+        """
+        Return (key, template) of the object. Objects with the same key share the template.
+        """
+        creator = self._get_creator(obj_conf)
+        key = creator.template_key(obj_conf)
+        template = self._templates.get(key)
+        if template is None:
+            template = flatten_scene(creator.create_template(obj_conf))
+            self._templates[key] = template
+        return key, template
+
+    def _get_creator(self, obj_conf):
         model_type = obj_conf.model.lower()
-        
         if model_type not in self._creators:
             raise ValueError(f"Unsupported model type: {model_type}")
-        
-        return self._creators[model_type].create_shape(obj_conf)
+        return self._creators[model_type]
     
     def register_creator(self, model_type: str, creator: ShapeCreator):
         """Register a new shape creator."""
         self._creators[model_type] = creator
 
 
-def apply_landscape(config, landscape_builder, base_scene):
-
-    for land in config.landscapes:
-        new_mesh = landscape_builder.create_landscape(base_scene, land)
-        geom_name = next(iter(base_scene.geometry.keys()))
-        del base_scene.geometry[geom_name]
-        base_scene.add_geometry(new_mesh, geom_name)
+def apply_landscape(config, landscape_builder, base_scene, heightfield=None, query_mesh=None):
+    """
+    Apply every landscape of the config to the base mesh of the scene in one pass.
+    query_mesh is an optional undeformed copy of the base mesh (with a warm ray accelerator)
+    whose terrain index the deformed mesh shares.
+    """
+    if config.landscapes:
+        landscape_builder.apply_landscapes(base_scene, config.landscapes, heightfield, query_mesh)
     return base_scene
 
 
-def build_scene(config, shape_factory, base_scene):
+def build_scene(config, shape_factory, base_scene, heightfield=None, query_mesh=None, instancing=False,
+                merge_objects=False, object_callback=None, objects=None):
     """
     Load the scene, load the shape factory, find the correct create_shape function.
     Create the shape with trimesh add_geometry api.
     Do it for all the objects that map configuration contains.
+    heightfield is an optional HeightField of the (deformed) base mesh for the ground queries.
+    query_mesh is an optional mesh with the same geometry as the base mesh to ray cast against instead.
+    With instancing every distinct model is added once and objects become node transforms
+    referencing it (glTF/GLB keep this, OBJ export bakes the nodes).
+    With merge_objects the objects are merged into one mesh per model and color/material,
+    which takes precedence over instancing.
+    object_callback(placed, total) reports the objects added so far.
+    objects is an optional PlacedObjects of config.objects that is already placed on the ground.
     """
-    mesh = next(iter(base_scene.geometry.values()))
-    for obj in config.objects:
-        new_y = control_random_creation(obj.position[0], obj.position[1], obj.position[2], mesh) + (obj.scale / 2)
-        obj.position[1] = new_y
+    if objects is None:
+        mesh = query_mesh if query_mesh is not None else next(iter(base_scene.geometry.values()))
+        objects = place_objects(config, mesh, heightfield)
+    if merge_objects:
+        return add_merged_objects(base_scene, shape_factory, objects, object_callback)
+    if instancing:
+        add_instances(base_scene, shape_factory, objects, object_callback)
+        return base_scene
+
+    step = _object_step(len(objects))
+    for i, obj in enumerate(objects.rows()):
         shape = shape_factory.create_shape(obj)
-        base_scene.add_geometry(shape)
+        if isinstance(shape, trimesh.Scene):
+            # Adding the parts one by one is much cheaper than merging a whole scene graph per object.
+            for name, part in shape.geometry.items():
+                base_scene.add_geometry(part, geom_name=name)
+        else:
+            base_scene.add_geometry(shape)
+        _report_objects(i + 1, len(objects), step, object_callback)
     return base_scene
 
+
+def place_objects(config, mesh, heightfield=None):
+    """
+    The objects of the config as PlacedObjects standing on the ground of mesh
+    (or of heightfield, a HeightField of it).
+    """
+    # The objects are placed as arrays, not as one object model each
+    objects = PlacedObjects.from_models(config.objects)
+    if len(objects):
+        objects.positions[:, 1] = ground_heights(objects.positions, mesh, heightfield) + objects.scales / 2
+    return objects
+
+
+def _object_step(total):
+    return max(1, total // OBJECT_EVENTS)
+
+
+def _report_objects(placed, total, step, object_callback=None):
+    if object_callback and (placed % step == 0 or placed == total):
+        object_callback(placed, total)
+
+
+def add_instances(base_scene, shape_factory, objects, object_callback=None):
+    """
+    Add every distinct model geometry to the scene once and place each object
+    as a scene graph node that references it with a scale + translation transform.
+    objects is a PlacedObjects.
+    """
+    # geometry names of the template of every object
+    object_names = [None] * len(objects)
+    for _, template, indices in _template_groups(shape_factory, objects):
+        names = []
+        for name, part in template.geometry.items():
+            geom_name = trimesh.util.unique_name(name, base_scene.geometry.keys())
+            base_scene.geometry[geom_name] = part
+            names.append(geom_name)
+        for i in indices.tolist():
+            object_names[i] = names
+
+    # scale + translation transforms of all objects at once
+    matrices = np.tile(np.eye(4), (len(objects), 1, 1))
+    matrices[:, :3, :3] *= objects.scales[:, None, None]
+    matrices[:, :3, 3] = objects.positions
+
+    step = _object_step(len(objects))
+    for i, kind_id in enumerate(objects.kind_ids.tolist()):
+        model = objects.kinds[kind_id][0]
+        for geom_name in object_names[i]:
+            base_scene.graph.update(
+                frame_to=f"{model}_{i}_{geom_name}",
+                frame_from=base_scene.graph.base_frame,
+                matrix=matrices[i],
+                geometry=geom_name
+            )
+        _report_objects(i + 1, len(objects), step, object_callback)
+
+
+def _template_groups(shape_factory, objects):
+    """
+    (template key, template, object indices) of every template the PlacedObjects use,
+    in the order the templates first appear. Only one object per kind and color is
+    turned into an object model to look its template up.
+    """
+    groups = {}
+    for first, indices in objects.groups():
+        key, template = shape_factory.create_template(objects.model(first))
+        if key in groups:
+            # Kinds that share a template, e.g. custom models with different colors
+            _, _, earlier = groups[key]
+            groups[key] = (key, template, np.sort(np.concatenate((earlier, indices))))
+        else:
+            groups[key] = (key, template, indices)
+    return list(groups.values())
+
+
+def add_merged_objects(base_scene, shape_factory, objects, object_callback=None):
+    """
+    Add the objects as one mesh per model part and color/material instead of one mesh per object.
+    Every group is written into preallocated vertex and face buffers: the template vertices
+    scaled and translated once per object, the template faces offset once per object.
+    objects is a PlacedObjects, the scales and positions of a group are sliced from its arrays.
+    """
+    placed = 0
+    for _, template, indices in _template_groups(shape_factory, objects):
+        model = objects.kinds[objects.kind_ids[indices[0]]][0]
+        scales = objects.scales[indices]
+        positions = objects.positions[indices]
+        for name, part in template.geometry.items():
+            merged = _merge_part(part, scales, positions)
+            geom_name = trimesh.util.unique_name(f"{model}_{name}", base_scene.geometry.keys())
+            base_scene.add_geometry(merged, geom_name=geom_name)
+        placed += len(scales)
+        if object_callback:
+            object_callback(placed, len(objects))
+    return base_scene
+
+
+def _merge_part(part, scales, positions):
+    """
+    One mesh holding a copy of the template part for every (scale, position).
+    """
+    count = len(scales)
+    vertex_count = len(part.vertices)
+    vertices = np.empty((count, vertex_count, 3), dtype=np.float64)
+    np.multiply(part.vertices[np.newaxis], scales[:, np.newaxis, np.newaxis], out=vertices)
+    vertices += positions[:, np.newaxis, :]
+
+    faces = np.empty((count,) + part.faces.shape, dtype=np.int64)
+    np.add(part.faces[np.newaxis], (np.arange(count) * vertex_count)[:, np.newaxis, np.newaxis], out=faces)
+
+    merged = trimesh.Trimesh(
+        vertices=vertices.reshape(-1, 3),
+        faces=faces.reshape(-1, 3),
+        process=False,
+        validate=False
+    )
+    visual = part.visual
+    if isinstance(visual, trimesh.visual.TextureVisuals):
+        # Every copy uses the same material, only the uv coordinates are repeated.
+        uv = None if visual.uv is None else np.tile(visual.uv, (count, 1))
+        merged.visual = trimesh.visual.TextureVisuals(uv=uv, material=visual.material)
+    elif visual.kind == "face":
+        merged.visual = trimesh.visual.ColorVisuals(merged, face_colors=np.tile(visual.face_colors, (count, 1)))
+    elif visual.kind == "vertex":
+        merged.visual = trimesh.visual.ColorVisuals(merged, vertex_colors=np.tile(visual.vertex_colors, (count, 1)))
+    return merged
+
+
+def flatten_scene(shape) -> trimesh.Scene:
+    """
+    Turn a shape (mesh or scene) into a scene of parts whose node transforms
+    are applied to their vertices, so every part sits at the origin frame.
+    """
+    if isinstance(shape, trimesh.Trimesh):
+        scene = trimesh.Scene()
+        scene.add_geometry(shape, geom_name=shape.metadata.get("name", "geometry"))
+        return scene
+
+    scene = trimesh.Scene()
+    for node in shape.graph.nodes_geometry:
+        matrix, geom_name = shape.graph[node]
+        part = shape.geometry[geom_name]
+        if not np.allclose(matrix, np.eye(4)):
+            part = clone_geometry(part, vertices=trimesh.transform_points(part.vertices, matrix))
+        scene.add_geometry(part, geom_name=geom_name)
+    return scene
+
 def export_scene(scene, filename, output_folder="maps"):
     """
     Go into the output folder. If it's not exists create one.
     Then export the scene to the output folder with the correspounding filename
     The filename is going to be created uniquely when the entry code is executed.
+    The levels of detail of a map (see SceneManager.build_lods) go into the same file
+    with MSFT_lod for glTF/GLB and into <map>_lod<level> files next to it otherwise.
     """
 
     Path(output_folder).mkdir(exist_ok=True)
-    scene.export(f"{output_folder}/{filename}")
+    lods = scene.metadata.pop(LODS_KEY, None)
+    suffix = Path(filename).suffix.lower()
+    if lods and suffix in INSTANCED_FORMATS:
+        lod_scene(scene, lods).export(f"{output_folder}/{filename}", tree_postprocessor=msft_lod(lods))
+        return
+    if suffix == ".obj":
+        # OBJ maps are streamed geometry by geometry instead of being built as one string.
+        export_obj(scene, Path(output_folder) / filename)
+    else:
+        scene.export(f"{output_folder}/{filename}")
+    for level, (_, lod) in enumerate(lods or (), start=1):
+        export_scene(lod, lod_filename(filename, level), output_folder)
+
+
+def serialize_scene(scene, filename, **kwargs):
+    """
+    Returns (chunks, files) of the map: the encoded map file as an iterable of chunks
+    and {file name: bytes} of the files that go next to it (materials, textures, buffers,
+    and the levels of detail of formats without MSFT_lod, like export_scene writes them).
+    kwargs go to the trimesh exporter.
+    """
+    lods = scene.metadata.pop(LODS_KEY, None)
+    file_type = Path(filename).suffix.lower().lstrip(".")
+    if lods and f".{file_type}" in INSTANCED_FORMATS:
+        return serialize_scene(lod_scene(scene, lods), filename, tree_postprocessor=msft_lod(lods))
+    if file_type == "obj":
+        chunks, files = serialize_obj(scene)
+    else:
+        data = trimesh.exchange.export.export_scene(scene, file_obj=None, file_type=file_type, **kwargs)
+        if isinstance(data, dict):
+            # glTF: the model file takes the map name, the buffers keep theirs
+            files = dict(data)
+            chunks = [files.pop("model.gltf")]
+        else:
+            if isinstance(data, str):
+                data = data.encode("utf-8")
+            chunks, files = [data], {}
+    for level, (_, lod) in enumerate(lods or (), start=1):
+        lod_name = lod_filename(filename, level)
+        lod_chunks, lod_files = serialize_scene(lod, lod_name)
+        files[lod_name] = b"".join(lod_chunks)
+        # The levels share their materials and textures with the map
+        for name, data in lod_files.items():
+            files.setdefault(name, data)
+    return chunks, files
 
 
 
@@ -165,7 +493,7 @@ class ConfigProcessor:
         self.config_folder = Path(config_folder)
     
     def get_config_files(self) -> list[Path]:
-        return [p for p in self.config_folder.glob("*.yaml") if p.stem.startswith("map_")]
+        return sorted(p for p in self.config_folder.glob("map_*") if p.suffix.lower() in CONFIG_EXTENSIONS)
 
     
     def load_config(self, config_file: Path):
@@ -178,65 +506,118 @@ class LandScapeBuilder:
     def __init__(self):
         pass
         
-    def create_landscape(self, scene, landscape_config):
+    def create_landscape(self, scene, landscape_config, heightfield=None, query_mesh=None):
+        """
+        Raise or lower the terrain around the landscape position.
+        """
+        return self.apply_landscapes(scene, [landscape_config], heightfield, query_mesh)
 
+    def apply_landscapes(self, scene, landscapes, heightfield=None, query_mesh=None):
+        """
+        Raise or lower the terrain around every landscape position, in the order of the landscapes.
+        Every landscape only evaluates the vertices within its radius, found with the vertex
+        index of the terrain, and grounds them with one query against the terrain the
+        landscapes before it left (the heightfield when one is given). The moved vertices
+        are refitted into the terrain index before the next landscape queries it, and only
+        when that landscape has vertices to query.
+        If a heightfield is given it is refreshed over the deformed areas as it goes.
+        query_mesh is an optional mesh with the same geometry whose terrain index is shared.
+        """
         mesh = next(iter(scene.geometry.values()))
-        position = list(landscape_config.position)
-        smoothness = float(landscape_config.smoothness)
-        radius = float(landscape_config.radius)
-
+        # Ray queries and deformations of the mesh share the footprint index of query_mesh
+        terrain_intersector(mesh, source=query_mesh)
 
         vertices = mesh.vertices.copy()
-        peak_x, peak_y, peak_z = position[0], position[1], position[2]
-        
-        vertex_xz = vertices[:, [0, 2]]
-        peak_xz = np.array([peak_x, peak_z])
-        distances = np.linalg.norm(vertex_xz - peak_xz, axis=1)
+        heights = vertices[:, 1]
+        peaks = np.array([list(landscape.position) for landscape in landscapes], dtype=np.float64).reshape(-1, 3)
+        # Use absolute value for radius calculation
+        max_radii = np.abs(peaks[:, 1]) * np.array([float(landscape.radius) for landscape in landscapes])
+
+        pending = []
+        for landscape, peak, max_radius, candidates in zip(
+                landscapes, peaks, max_radii, vertices_within(mesh, peaks[:, [0, 2]], max_radii)):
+            distances = np.linalg.norm(vertices[candidates][:, [0, 2]] - peak[[0, 2]], axis=1)
+            inside = distances <= max_radius
+            affected_vertices = candidates[inside]
+            if len(affected_vertices) == 0:
+                continue
+            if pending:
+                # The mesh keeps the array it is given, the next landscapes write into their own
+                _settle_landscapes(mesh, vertices.copy(), pending, heightfield)
+                pending = []
+            falloff = self._compute_falloff(distances[inside], max_radius, float(landscape.smoothness))
+            ground_y = ground_heights(vertices[affected_vertices], mesh, heightfield)
+            current_y = heights[affected_vertices]
+            peak_y = peak[1]
 
-        max_radius = abs(peak_y) * radius  # Use absolute value for radius calculation
-        affected_mask = distances <= max_radius
-        affected_vertices = np.where(affected_mask)[0]
-        
-        for i in affected_vertices:
-            vertex = vertices[i]
-            distance = distances[i]
-            
-            if distance == 0:
-                falloff = 1.0
-            else:
-                normalized_distance = distance / max_radius
-                if smoothness == 0:
-                    # Linear falloff (sharp edges)
-                    falloff = max(0, 1 - normalized_distance)
-                elif smoothness == 1:
-                    # Smooth polynomial falloff (cosine-based for natural hills)
-                    falloff = 0.5 * (1 - np.cos(np.pi * (1-normalized_distance))) if normalized_distance <= 1 else 0
-                else:
-                    # Blend between linear and polynomial
-                    linear_falloff = max(0, 1 - normalized_distance)
-                    smooth_falloff = 0.5 * (1 + np.cos(np.pi * normalized_distance)) if normalized_distance <= 1 else 0
-                    falloff = linear_falloff * (1 - smoothness) + smooth_falloff * smoothness
-            
-            ground_y = control_random_creation(vertex[0], vertex[1], vertex[2], mesh)
-            
             if peak_y >= 0:
                 # Raising terrain (mountains/hills)
                 target_height = ground_y + (peak_y - ground_y) * falloff
-                if target_height > ground_y and target_height > vertex[1]:
-                    vertices[i][1] = target_height
+                update = (target_height > ground_y) & (target_height > current_y)
             else:
                 # Lowering terrain (valleys/depressions)
                 depression_depth = abs(peak_y) * falloff
                 target_height = ground_y - depression_depth
-                if target_height < ground_y and target_height < vertex[1]:
-                    vertices[i][1] = target_height
+                update = (target_height < ground_y) & (target_height < current_y)
+
+            moved = affected_vertices[update]
+            heights[moved] = target_height[update]
+            if len(moved) > 0:
+                pending.append(moved)
 
-        mesh.vertices = vertices
-        mesh.remove_degenerate_faces()
-        mesh.remove_duplicate_faces()
-        mesh.fix_normals()
+        _settle_landscapes(mesh, vertices, pending, heightfield)
         return mesh
 
+    @staticmethod
+    def _compute_falloff(distances, max_radius, smoothness):
+        """
+        Falloff of the deformation for every affected vertex.
+        smoothness 0 is a linear falloff, 1 is a cosine falloff and
+        anything in between blends the two.
+        """
+        falloff = np.ones(len(distances))
+        off_center = distances != 0
+        if not np.any(off_center):
+            return falloff
+
+        normalized_distance = distances[off_center] / max_radius
+        inside = normalized_distance <= 1
+        if smoothness == 0:
+            # Linear falloff (sharp edges)
+            values = np.maximum(0, 1 - normalized_distance)
+        elif smoothness == 1:
+            # Smooth polynomial falloff (cosine-based for natural hills)
+            values = np.where(inside, 0.5 * (1 - np.cos(np.pi * (1 - normalized_distance))), 0)
+        else:
+            # Blend between linear and polynomial
+            linear_falloff = np.maximum(0, 1 - normalized_distance)
+            smooth_falloff = np.where(inside, 0.5 * (1 + np.cos(np.pi * normalized_distance)), 0)
+            values = linear_falloff * (1 - smoothness) + smooth_falloff * smoothness
+        falloff[off_center] = values
+        return falloff
+
+
+def _settle_landscapes(mesh, vertices, moved_groups, heightfield=None):
+    """Deform mesh into vertices, of which the groups of moved vertices changed, and refresh the heightfield over them."""
+    moved = np.unique(np.concatenate(moved_groups)) if moved_groups else np.empty(0, dtype=np.int64)
+    # Refits and repairs only the faces around the moved vertices where it can
+    deform(mesh, vertices, moved)
+    if heightfield is not None:
+        refresh_heightfield(heightfield, mesh, moved_groups)
+
+
+def refresh_heightfield(heightfield, mesh, moved_groups):
+    """
+    Rasterize the heightfield again around every group of moved vertices of the deformed mesh.
+    Every grid node on a face around a moved vertex can have changed.
+    """
+    for moved in moved_groups:
+        faces = touched_faces(mesh, moved)
+        if len(faces) == 0:
+            continue
+        footprint = mesh.vertices[mesh.faces[faces].ravel()][:, [0, 2]]
+        heightfield.refresh(mesh, footprint.min(axis=0), footprint.max(axis=0))
+
 
 
     
@@ -248,49 +629,432 @@ class SceneManager:
     the map output folder.
     """
     
-    def __init__(self, config_folder, base_map, output_folder):
+    def __init__(self, config_folder, base_map, output_folder, heightfield_resolution=None, merge_objects=False,
+                 terrain_tiles=None, tile_workers=1, lod_ratios=None):
         self.base_map = base_map
         self.config_processor = ConfigProcessor(config_folder)
         self.shape_factory = ShapeFactory()
         self.landscape_builder = LandScapeBuilder()
         self.output_folder = output_folder
-        self.base_scene = load_scene(self.base_map)
+        self.merge_objects = merge_objects
+        # The base map is parsed once; every config builds on a cheap clone of it.
+        self.base_template = SceneTemplate.load(self.base_map)
+        self.heightfield = None
+        if heightfield_resolution:
+            self.heightfield = load_heightfield(self.base_map, self.base_template.base_mesh, heightfield_resolution)
+        # With terrain tiles the landscapes and ground queries of every config run on tile workers.
+        # A heightfield covers the whole terrain and grounds the landscapes, so it leaves the tiles out.
+        self.tile_pool = None
+        if terrain_tiles and self.heightfield is not None:
+            print("[SceneManager] Terrain tiles are not used with a heightfield")
+        elif terrain_tiles:
+            self.tile_pool = TilePool(self.base_template.base_mesh, terrain_tiles, tile_workers,
+                                      self.landscape_builder)
+        # Every map also gets a decimated version at each of these face ratios
+        self.lod_factories = [LodShapeFactory(self.shape_factory, ratio) for ratio in check_ratios(lod_ratios)]
+
+    def close(self):
+        """Stop the tile workers, if any."""
+        if self.tile_pool is not None:
+            self.tile_pool.close()
+            self.tile_pool = None
+
+    def fresh_heightfield(self):
+        """
+        Every config deforms its own copy of the base map, so it gets its own copy of the heightfield.
+        """
+        return self.heightfield.copy() if self.heightfield is not None else None
     
+    def build_config_scene(self, config_file, event_callback=None):
+        """
+        Build and export the map of a single config file. Returns the exported map name.
+        """
+        map_name, final_scene = self.build_map_scene(config_file, event_callback)
+        _report_event({"stage": "export"}, event_callback)
+        export_scene(final_scene, map_name, self.output_folder)
+        return map_name
+
+    def build_map_scene(self, config_file, event_callback=None):
+        """
+        Build the map of a single config file without exporting it. Returns (map name, scene).
+        event_callback({"stage": ...}) reports the landscape and object stages, the latter
+        with "objects": [placed, total], and the lod stage when there are LOD ratios.
+        The levels of detail are in scene.metadata["lods"] as [(ratio, scene)].
+        """
+        _report_event({"stage": "landscape"}, event_callback)
+        config = self.config_processor.load_config(config_file)
+        fresh_base_scene = self.base_template.clone()
+        heightfield = self.fresh_heightfield()
+        # Until a landscape deforms the clone, ray queries go to the template and reuse its accelerator.
+        template_mesh = self.base_template.base_mesh
+
+        objects = None
+        if self.tile_pool is not None:
+            scene_with_landscape = fresh_base_scene
+            objects = self.apply_tiles(config, fresh_base_scene)
+        else:
+            scene_with_landscape = apply_landscape(config, self.landscape_builder, fresh_base_scene, heightfield,
+                                                   query_mesh=template_mesh)
+        query_mesh = template_mesh if not config.landscapes else None
+        terrain = next(iter(scene_with_landscape.geometry.values()))
+        if objects is None and self.lod_factories:
+            # Every level of detail places the objects at the same spots
+            objects = place_objects(config, query_mesh if query_mesh is not None else terrain, heightfield)
+        instancing = Path(config.map).suffix.lower() in INSTANCED_FORMATS
+        _report_event({"stage": "objects", "objects": [0, len(config.objects)]}, event_callback)
+        object_callback = None
+        if event_callback:
+            object_callback = lambda placed, total: event_callback({"stage": "objects", "objects": [placed, total]})
+        final_scene = build_scene(config, self.shape_factory, scene_with_landscape, heightfield, query_mesh,
+                                  instancing=instancing, merge_objects=self.merge_objects,
+                                  object_callback=object_callback, objects=objects)
+        if self.lod_factories:
+            _report_event({"stage": "lod"}, event_callback)
+            final_scene.metadata[LODS_KEY] = self.build_lods(config, terrain, objects, instancing)
+        return config.map, final_scene
+
+    def build_lods(self, config, terrain, objects, instancing=False):
+        """
+        [(ratio, scene)] of the map at every LOD ratio: the base map with its (deformed) terrain
+        and other geometry decimated, and the placed objects baked from decimated models.
+        Decimated models and the other base map geometry are taken from the LOD cache, so each
+        is decimated once per ratio. The deformed terrain is different for every map, it is
+        decimated directly instead of hashed and cached for nothing.
+        """
+        lods = []
+        for shape_factory in self.lod_factories:
+            scene = self.base_template.clone()
+            names = list(scene.geometry)
+            scene.geometry[names[0]] = decimate(terrain, shape_factory.ratio)
+            for name in names[1:]:
+                scene.geometry[name] = lod_cache.decimate(scene.geometry[name], shape_factory.ratio)
+            build_scene(config, shape_factory, scene, instancing=instancing, merge_objects=self.merge_objects,
+                        objects=objects)
+            lods.append((shape_factory.ratio, scene))
+        return lods
+
+    def apply_tiles(self, config, scene):
+        """
+        Deform the base mesh of the scene with the landscapes of the config on the tile workers,
+        stitch the heights of all tiles back into it and place the objects of the config on
+        the deformed ground. Returns the placed objects as PlacedObjects.
+        Rays that miss the tile of their object are answered here against the whole terrain.
+        """
+        mesh = next(iter(scene.geometry.values()))
+        template_mesh = self.base_template.base_mesh
+        objects = PlacedObjects.from_models(config.objects)
+        moved, heights, ground = self.tile_pool.run(config.landscapes, objects.positions)
+
+        query_mesh = template_mesh
+        all_moved = np.concatenate(moved) if moved else np.empty(0, dtype=np.int64)
+        if len(all_moved) > 0:
+            terrain_intersector(mesh, source=template_mesh)
+            vertices = mesh.vertices.copy()
+            vertices[all_moved, 1] = np.concatenate(heights)
+            deform(mesh, vertices, all_moved)
+            query_mesh = mesh
+
+        if len(objects):
+            misses = np.nonzero(np.isnan(ground))[0]
+            if len(misses) > 0:
+                ground[misses] = ground_heights(objects.positions[misses], query_mesh)
+            objects.positions[:, 1] = ground + objects.scales / 2
+        return objects
+
     def process_all_scenes(self, progress_callback=None):
-        config_files = self.config_processor.get_config_files()
-        total = len(config_files)
+        return _build_sequentially(self, self.config_processor.get_config_files(), progress_callback)
+
+
+def _cancelled(cancel_event):
+    return cancel_event is not None and cancel_event.is_set()
 
-        for i, config_file in enumerate(config_files):
-            config = self.config_processor.load_config(config_file)
-            fresh_base_scene = load_scene(self.base_map)
 
-            scene_with_landscape = apply_landscape(config, self.landscape_builder, fresh_base_scene)
-            final_scene = build_scene(config, self.shape_factory, scene_with_landscape)
-            export_scene(final_scene, config.map, self.output_folder)
+def _build_sequentially(manager, config_files, progress_callback=None, failure_callback=None,
+                        cancel_event=None, event_callback=None):
+    """
+    Build every config in this process. Returns {config file name: error message} of the failed ones.
+    """
+    failures = {}
+    total = len(config_files)
+    for i, config_file in enumerate(config_files):
+        if _cancelled(cancel_event):
+            break
+        try:
+            manager.build_config_scene(config_file, _config_events(config_file, event_callback))
+        except Exception as e:
+            _record_failure(failures, config_file, e, failure_callback)
+        _report_progress((i + 1) / total, progress_callback)
+    return failures
 
-            if progress_callback:
-                progress_callback((i + 1) / total)
 
+# Every pool worker builds its own SceneManager once and reuses it for all of its configs.
+_worker_manager = None
 
-def run_scene_builder(task_id=None, config_folder="./configs", base_map="./map.obj", output_folder="./maps", progress_callback=None):
-    print(f"[run_scene_builder] Base map: {base_map}")
-    manager = SceneManager(config_folder, base_map, output_folder)
 
-    config_files = manager.config_processor.get_config_files()
+def _init_worker(config_folder, base_map, output_folder, heightfield_resolution, merge_objects, lod_ratios):
+    global _worker_manager
+    _worker_manager = SceneManager(config_folder, base_map, output_folder, heightfield_resolution, merge_objects,
+                                   lod_ratios=lod_ratios)
+
+
+def _build_in_worker(config_file):
+    return _worker_manager.build_config_scene(config_file)
+
+
+def _build_in_pool(config_files, workers, manager_args, progress_callback=None, failure_callback=None,
+                   cancel_event=None):
+    """
+    Fan the configs out to a pool of worker processes. The maps are independent and the
+    work holds the GIL, so processes are used instead of threads.
+    Returns {config file name: error message} of the failed ones.
+    """
+    failures = {}
     total = len(config_files)
+    done = 0
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=manager_args
+    ) as pool:
+        futures = {pool.submit(_build_in_worker, config_file): config_file for config_file in config_files}
+        for future in concurrent.futures.as_completed(futures):
+            if _cancelled(cancel_event):
+                # Configs that have not started yet are dropped, running ones finish
+                for pending in futures:
+                    pending.cancel()
+            if future.cancelled():
+                continue
+            config_file = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                _record_failure(failures, config_file, e, failure_callback)
+            done += 1
+            _report_progress(done / total, progress_callback)
+    return failures
 
-    for i, config_file in enumerate(config_files):
-        config = manager.config_processor.load_config(config_file)
-        fresh_base_scene = load_scene(base_map)
 
-        scene_with_landscape = apply_landscape(config, manager.landscape_builder, fresh_base_scene)
-        final_scene = build_scene(config, manager.shape_factory, scene_with_landscape)
-        export_scene(final_scene, config.map, output_folder)
+def _build_pipelined(manager, config_files, depth, progress_callback=None, failure_callback=None,
+                     timings_callback=None, cancel_event=None, event_callback=None):
+    """
+    Build the maps in three stages connected by queues of at most depth items: this thread
+    builds the scenes, a serializer thread turns them into encoded chunks and a writer thread
+    writes the chunks to disk (fsynced, under a temporary name until complete). Building the
+    next map overlaps with exporting the previous ones.
+    timings_callback({stage: seconds}) gets the time spent in every stage so far whenever a
+    map is done, before its progress is reported.
+    A callback that raises on the writer thread does not stop the stages; the first such
+    error is raised here once all maps went through.
+    Returns {config file name: error message} of the failed ones.
+    """
+    failures = {}
+    callback_errors = []
+    timings = {"build": 0.0, "serialize": 0.0, "write": 0.0}
+    total = len(config_files)
+    done = 0
+    done_lock = threading.Lock()
+    scenes = queue.Queue(maxsize=depth)
+    chunks = queue.Queue(maxsize=depth)
+    output_folder = Path(manager.output_folder)
+    output_folder.mkdir(exist_ok=True)
 
-        progress = (i + 1) / total
-        print(f"[run_scene_builder] Progress: {progress:.2f}")
-        if progress_callback:
-            progress_callback(progress)
+    def finish(config_file, error=None):
+        nonlocal done
+        with done_lock:
+            if error is not None:
+                _record_failure(failures, config_file, error, failure_callback)
+            done += 1
+            if timings_callback:
+                timings_callback(dict(timings))
+            _report_progress(done / total, progress_callback)
+
+    def serialize_stage():
+        while True:
+            item = scenes.get()
+            if item is _STOP:
+                chunks.put(_STOP)
+                return
+            config_file, map_name, scene = item
+            chunks.put(("open", config_file, map_name))
+            try:
+                start = time.perf_counter()
+                parts, files = serialize_scene(scene, map_name)
+                parts = iter(parts)
+                timings["serialize"] += time.perf_counter() - start
+                while True:
+                    start = time.perf_counter()
+                    part = next(parts, None)
+                    timings["serialize"] += time.perf_counter() - start
+                    if part is None:
+                        break
+                    chunks.put(("data", config_file, part))
+                chunks.put(("close", config_file, files))
+            except Exception as e:
+                chunks.put(("fail", config_file, e))
+
+    def write_stage():
+        # (file, temporary path, map path) of the map being written, None after it failed
+        current = None
+        while True:
+            item = chunks.get()
+            if item is _STOP:
+                return
+            kind, config_file, payload = item
+            start = time.perf_counter()
+            result = None
+            try:
+                if kind == "open":
+                    path = output_folder / payload
+                    temp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+                    current = (open(temp_path, "wb"), temp_path, path)
+                elif kind == "data" and current is not None:
+                    current[0].write(payload)
+                elif kind == "close" and current is not None:
+                    file, temp_path, path = current
+                    file.flush()
+                    os.fsync(file.fileno())
+                    file.close()
+                    os.replace(temp_path, path)
+                    current = None
+                    for name, data in payload.items():
+                        with open(output_folder / name, "wb") as side_file:
+                            side_file.write(data)
+                    result = (config_file, None)
+                elif kind == "fail" and current is not None:
+                    _discard(current)
+                    current = None
+                    result = (config_file, payload)
+            except Exception as e:
+                if current is not None:
+                    _discard(current)
+                    current = None
+                result = (config_file, e)
+            timings["write"] += time.perf_counter() - start
+            if result is not None:
+                try:
+                    finish(*result)
+                except Exception as e:
+                    # The writer has to keep draining the chunks, or the other stages wait for it forever
+                    print(f"[run_scene_builder] Callback failed for {result[0].name}: {type(e).__name__}: {e}")
+                    callback_errors.append(e)
+
+    serializer = threading.Thread(target=serialize_stage, name="map-serializer", daemon=True)
+    writer = threading.Thread(target=write_stage, name="map-writer", daemon=True)
+    serializer.start()
+    writer.start()
+    started = time.perf_counter()
+    try:
+        for config_file in config_files:
+            if _cancelled(cancel_event):
+                break
+            start = time.perf_counter()
+            try:
+                map_name, scene = manager.build_map_scene(config_file, _config_events(config_file, event_callback))
+            except Exception as e:
+                timings["build"] += time.perf_counter() - start
+                finish(config_file, e)
+                continue
+            timings["build"] += time.perf_counter() - start
+            scenes.put((config_file, map_name, scene))
+    finally:
+        scenes.put(_STOP)
+        serializer.join()
+        writer.join()
+
+    stages = ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in timings.items())
+    print(f"[run_scene_builder] Stage timings: {stages} (wall {time.perf_counter() - started:.2f}s)")
+    if callback_errors:
+        raise callback_errors[0]
+    return failures
+
+
+def _discard(current):
+    file, temp_path, _ = current
+    file.close()
+    if temp_path.exists():
+        temp_path.unlink()
+
+
+def _record_failure(failures, config_file, error, failure_callback=None):
+    message = f"{type(error).__name__}: {error}"
+    failures[config_file.name] = message
+    print(f"[run_scene_builder] Failed {config_file.name}: {message}")
+    if failure_callback:
+        failure_callback(config_file.name, message)
+
+
+def _report_event(fields, event_callback=None):
+    if event_callback:
+        event_callback(fields)
+
+
+def _config_events(config_file, event_callback=None):
+    """The event_callback of a single config, adding the config file name to every event."""
+    if event_callback is None:
+        return None
+    return lambda fields: event_callback({"config": config_file.name, **fields})
+
+
+def _report_progress(progress, progress_callback=None):
+    print(f"[run_scene_builder] Progress: {progress:.2f}")
+    if progress_callback:
+        progress_callback(progress)
+
+
+def run_scene_builder(task_id=None, config_folder="./configs", base_map="./map.obj", output_folder="./maps", progress_callback=None,
+                      heightfield_resolution=None, workers=1, failure_callback=None, merge_objects=False,
+                      pipeline_depth=0, timings_callback=None, config_files=None, cancel_event=None,
+                      event_callback=None, terrain_tiles=None, lod_ratios=None):
+    """
+    Build a map for every map_* config (YAML or JSON) in config_folder, or for the given config_files.
+    With workers > 1 the configs are built in parallel by a pool of processes.
+    Output names come from the configs, so they do not depend on the build order.
+    A failing config does not stop the others; failure_callback(config file name, error message)
+    is called for it before the progress is updated.
+    With merge_objects the objects of a map are exported as one mesh per model and
+    color/material instead of one node per object.
+    With pipeline_depth > 0 (and a single worker) building, serializing and writing the maps
+    run as pipelined stages with queues of that depth; timings_callback({stage: seconds})
+    reports where the time goes.
+    Setting cancel_event (a threading.Event) stops the build between configs: maps that are
+    already being built are finished, the remaining configs are skipped.
+    With a single worker event_callback({"config": ..., "stage": ..., "objects": [placed, total]})
+    reports the config being built and how far it got; the pool only reports whole maps.
+    With terrain_tiles the base terrain is split into terrain_tiles x terrain_tiles tiles and the
+    workers deform the tiles and place the objects on them for every config, while the configs
+    are built one after the other like with a single worker. A heightfield_resolution turns
+    the tiles off, the landscapes are grounded on the heightfield of the whole terrain.
+    With lod_ratios (face ratios between 0 and 1) every map also gets a level of detail per
+    ratio with a decimated terrain and decimated models, see export_scene for the files.
+    Returns {config file name: error message} of the configs that failed to build.
+    """
+    print(f"[run_scene_builder] Base map: {base_map}")
+    lod_ratios = check_ratios(lod_ratios)
+    if config_files is None:
+        config_files = ConfigProcessor(config_folder).get_config_files()
+    config_files = [Path(config_file) for config_file in config_files]
+    if not config_files:
+        _report_progress(1.0, progress_callback)
+        return {}
 
+    workers = max(1, int(workers or 1))
+    if (terrain_tiles and not heightfield_resolution) or workers == 1 or len(config_files) == 1:
+        manager = SceneManager(config_folder, base_map, output_folder, heightfield_resolution, merge_objects,
+                               terrain_tiles, workers, lod_ratios)
+        try:
+            if pipeline_depth and pipeline_depth > 0:
+                return _build_pipelined(manager, config_files, int(pipeline_depth), progress_callback,
+                                        failure_callback, timings_callback, cancel_event, event_callback)
+            return _build_sequentially(manager, config_files, progress_callback, failure_callback, cancel_event,
+                                       event_callback)
+        finally:
+            manager.close()
+    workers = min(workers, len(config_files))
 
+    # Compile the base map and build (and cache) the heightfield once here, so the workers only open them.
+    base_template = SceneTemplate.load(base_map)
+    if heightfield_resolution:
+        load_heightfield(base_map, base_template.base_mesh, heightfield_resolution)
 
+    manager_args = (config_folder, base_map, output_folder, heightfield_resolution, merge_objects, lod_ratios)
+    return _build_in_pool(config_files, workers, manager_args, progress_callback, failure_callback, cancel_event)
@@ -0,0 +1,171 @@
+"""
+heightfield.py
+
+Rasterized ground heights of the base map.
+The base terrain is a 2.5D surface along Y, so it is sampled once on an XZ grid
+and ground queries are answered by bilinear interpolation instead of ray casts.
+Grid nodes where the terrain has holes or overhangs are marked invalid and
+queries touching them fall back to exact ray casting.
+"""
+import numpy as np
+from core.augment_tool import ground_heights
+
+# Two hits closer than this along one vertical ray are the same surface
+# (ray passing through a shared edge or vertex).
+SAME_HIT_TOLERANCE = 1e-6
+
+
+class HeightField:
+    """
+    Heights of the terrain sampled on a regular XZ grid.
+    heights[i, j] is the ground height at (xs[i], zs[j]).
+    """
+
+    def __init__(self, origin, spacing, heights, valid):
+        self.origin = np.asarray(origin, dtype=np.float64)
+        self.spacing = np.asarray(spacing, dtype=np.float64)
+        self.heights = np.asarray(heights, dtype=np.float64)
+        self.valid = np.asarray(valid, dtype=bool)
+
+    @property
+    def shape(self):
+        return self.heights.shape
+
+    @classmethod
+    def from_mesh(cls, mesh, resolution):
+        """
+        Rasterize the mesh into a resolution x resolution grid with one batched ray query.
+        """
+        resolution = int(resolution)
+        if resolution < 2:
+            raise ValueError(f"Heightfield resolution must be at least 2, got {resolution}")
+
+        bounds = np.asarray(mesh.bounds, dtype=np.float64)
+        origin = bounds[0, [0, 2]]
+        spacing = (bounds[1, [0, 2]] - origin) / (resolution - 1)
+        spacing[spacing == 0] = 1.0
+
+        heights = np.zeros((resolution, resolution))
+        valid = np.zeros((resolution, resolution), dtype=bool)
+        field = cls(origin, spacing, heights, valid)
+        field._rasterize(mesh, (0, resolution), (0, resolution), top=bounds[1, 1] + 1.0)
+        return field
+
+    def copy(self):
+        return HeightField(self.origin, self.spacing, self.heights.copy(), self.valid.copy())
+
+    def refresh(self, mesh, xz_min, xz_max):
+        """
+        Rasterize the grid nodes inside the given XZ rectangle again.
+        Used after a part of the terrain has been deformed.
+        """
+        rows = self._node_range(xz_min[0], xz_max[0], axis=0)
+        cols = self._node_range(xz_min[1], xz_max[1], axis=1)
+        if rows[0] >= rows[1] or cols[0] >= cols[1]:
+            return
+        self._rasterize(mesh, rows, cols, top=mesh.bounds[1][1] + 1.0)
+
+    def _node_range(self, low, high, axis):
+        count = self.heights.shape[axis]
+        start = int(np.floor((low - self.origin[axis]) / self.spacing[axis]))
+        stop = int(np.ceil((high - self.origin[axis]) / self.spacing[axis])) + 1
+        return max(start, 0), min(stop, count)
+
+    def _rasterize(self, mesh, rows, cols, top):
+        xs = self.origin[0] + np.arange(*rows) * self.spacing[0]
+        zs = self.origin[1] + np.arange(*cols) * self.spacing[1]
+        grid_x, grid_z = np.meshgrid(xs, zs, indexing="ij")
+        count = grid_x.size
+
+        ray_origins = np.column_stack([grid_x.ravel(), np.full(count, top), grid_z.ravel()])
+        ray_directions = np.tile([0.0, -1.0, 0.0], (count, 1))
+        locations, index_ray, _ = mesh.ray.intersects_location(
+            ray_origins=ray_origins,
+            ray_directions=ray_directions
+        )
+        locations = np.asarray(locations, dtype=np.float64).reshape(-1, 3)
+        index_ray = np.asarray(index_ray, dtype=np.int64).reshape(-1)
+
+        heights = np.zeros(count)
+        surfaces = np.zeros(count, dtype=np.int64)
+        if len(locations) > 0:
+            order = np.lexsort((-locations[:, 1], index_ray))
+            sorted_rays = index_ray[order]
+            sorted_y = locations[order, 1]
+            new_surface = np.ones(len(order), dtype=bool)
+            same_ray = sorted_rays[1:] == sorted_rays[:-1]
+            new_surface[1:] = ~same_ray | (sorted_y[:-1] - sorted_y[1:] > SAME_HIT_TOLERANCE)
+            np.add.at(surfaces, sorted_rays[new_surface], 1)
+            first = np.ones(len(order), dtype=bool)
+            first[1:] = ~same_ray
+            heights[sorted_rays[first]] = sorted_y[first]
+
+        shape = grid_x.shape
+        self.heights[rows[0]:rows[1], cols[0]:cols[1]] = heights.reshape(shape)
+        # Exactly one surface under a node: no hole and no overhang.
+        self.valid[rows[0]:rows[1], cols[0]:cols[1]] = (surfaces == 1).reshape(shape)
+
+    def sample(self, points):
+        """
+        Bilinear interpolation of the ground height under each (x, y, z) point.
+        Returns the heights and a mask of the points the grid could answer.
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        rows, cols = self.heights.shape
+
+        fx = (points[:, 0] - self.origin[0]) / self.spacing[0]
+        fz = (points[:, 2] - self.origin[1]) / self.spacing[1]
+        inside = (fx >= 0) & (fx <= rows - 1) & (fz >= 0) & (fz <= cols - 1)
+
+        i = np.clip(np.floor(fx).astype(np.int64), 0, rows - 2)
+        j = np.clip(np.floor(fz).astype(np.int64), 0, cols - 2)
+        tx = np.clip(fx - i, 0, 1)
+        tz = np.clip(fz - j, 0, 1)
+
+        h00 = self.heights[i, j]
+        h10 = self.heights[i + 1, j]
+        h01 = self.heights[i, j + 1]
+        h11 = self.heights[i + 1, j + 1]
+        heights = (
+            h00 * (1 - tx) * (1 - tz) +
+            h10 * tx * (1 - tz) +
+            h01 * (1 - tx) * tz +
+            h11 * tx * tz
+        )
+
+        valid = (
+            inside &
+            self.valid[i, j] & self.valid[i + 1, j] &
+            self.valid[i, j + 1] & self.valid[i + 1, j + 1]
+        )
+        return heights, valid
+
+    def ground_heights(self, points, mesh_for_query):
+        """
+        Ground heights from the grid, with exact ray casting for points
+        that fall outside of it or next to holes and overhangs.
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        heights, valid = self.sample(points)
+        misses = np.where(~valid)[0]
+        if len(misses) > 0:
+            heights[misses] = ground_heights(points[misses], mesh_for_query)
+        return heights
+
+    def save(self, path, **metadata):
+        np.savez(
+            path,
+            origin=self.origin,
+            spacing=self.spacing,
+            heights=self.heights,
+            valid=self.valid,
+            **metadata
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            field = cls(data["origin"], data["spacing"], data["heights"], data["valid"])
+            metadata = {key: data[key] for key in data.files
+                        if key not in ("origin", "spacing", "heights", "valid")}
+        return field, metadata
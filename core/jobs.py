@@ -0,0 +1,184 @@
+"""
+jobs.py
+
+Scheduler of background jobs with a bounded number of concurrently running jobs.
+Jobs wait in a priority queue (higher priority first, first come first served within
+a priority) and can be cancelled: a queued job is dropped, a running job is asked to
+stop through its cancel_event and decides itself where it is safe to stop.
+"""
+import heapq
+import itertools
+import os
+import threading
+import time
+import uuid
+
+# Map builds that may run at the same time, every build holds a full scene in memory
+MAX_CONCURRENT_BUILDS = int(os.environ.get("MAPGEN_MAX_CONCURRENT_BUILDS", "2"))
+# Finished jobs that are remembered for status queries
+MAX_FINISHED_JOBS = 100
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINAL_STATES = {DONE, FAILED, CANCELLED}
+
+
+class Job:
+    """
+    A unit of work for the scheduler. func(job) runs on a scheduler thread and
+    its return value becomes the result of the job.
+    """
+
+    def __init__(self, func, job_id=None, priority=0):
+        self.id = job_id or str(uuid.uuid4())
+        self.func = func
+        self.priority = priority
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        self.cancel_event = threading.Event()
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+
+    @property
+    def done(self):
+        return self.status in FINAL_STATES
+
+    def to_dict(self, position=None):
+        info = {
+            "task_id": self.id,
+            "status": self.status,
+            "priority": self.priority,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+        }
+        if position is not None:
+            info["position"] = position
+        if self.error is not None:
+            info["error"] = self.error
+        if self.result is not None:
+            info["result"] = self.result
+        return info
+
+
+class JobScheduler:
+    """
+    Runs submitted jobs on max_concurrent worker threads.
+    listener(job) is called after every status change of a job.
+    """
+
+    def __init__(self, max_concurrent=MAX_CONCURRENT_BUILDS, name="jobs", listener=None):
+        self.max_concurrent = max(1, int(max_concurrent))
+        self.listener = listener
+        self._jobs = {}
+        self._queue = []
+        self._order = itertools.count()
+        self._condition = threading.Condition()
+        self._workers = [
+            threading.Thread(target=self._work, name=f"{name}-{i}", daemon=True)
+            for i in range(self.max_concurrent)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, func, job_id=None, priority=0):
+        """
+        Queue func(job) and return the job.
+        """
+        job = Job(func, job_id, int(priority or 0))
+        with self._condition:
+            if job.id in self._jobs:
+                raise ValueError(f"Job already exists: {job.id}")
+            self._jobs[job.id] = job
+            heapq.heappush(self._queue, (-job.priority, next(self._order), job))
+            self._condition.notify()
+        self._notify(job)
+        return job
+
+    def get(self, job_id):
+        with self._condition:
+            return self._jobs.get(job_id)
+
+    def status(self, job_id):
+        """
+        Status dict of the job (with its queue position while queued), None if unknown.
+        """
+        with self._condition:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            return job.to_dict(self._position(job))
+
+    def list(self):
+        with self._condition:
+            return [job.to_dict(self._position(job)) for job in self._jobs.values()]
+
+    def cancel(self, job_id):
+        """
+        Cancel a queued job or ask a running one to stop.
+        Returns False if the job is unknown or already finished.
+        """
+        with self._condition:
+            job = self._jobs.get(job_id)
+            if job is None or job.done:
+                return False
+            job.cancel_event.set()
+            dropped = job.status == QUEUED
+            if dropped:
+                # Stays in the heap until a worker pops and skips it
+                self._finish(job, CANCELLED)
+        if dropped:
+            self._notify(job)
+        return True
+
+    def _position(self, job):
+        """0-based place of a queued job in the run order, None for other jobs."""
+        if job.status != QUEUED:
+            return None
+        waiting = sorted(entry for entry in self._queue if entry[2].status == QUEUED)
+        return next(i for i, entry in enumerate(waiting) if entry[2] is job)
+
+    def _next_job(self):
+        with self._condition:
+            while True:
+                while self._queue:
+                    _, _, job = heapq.heappop(self._queue)
+                    if job.status == QUEUED:
+                        job.status = RUNNING
+                        job.started = time.time()
+                        return job
+                self._condition.wait()
+
+    def _work(self):
+        while True:
+            job = self._next_job()
+            self._notify(job)
+            try:
+                result = job.func(job)
+            except Exception as e:
+                print(f"[jobs] Job {job.id} failed: {type(e).__name__}: {e}")
+                with self._condition:
+                    job.error = f"{type(e).__name__}: {e}"
+                    self._finish(job, FAILED)
+                self._notify(job)
+                continue
+            with self._condition:
+                job.result = result
+                self._finish(job, CANCELLED if job.cancel_event.is_set() else DONE)
+            self._notify(job)
+
+    def _notify(self, job):
+        if self.listener:
+            self.listener(job)
+
+    def _finish(self, job, status):
+        job.status = status
+        job.finished = time.time()
+        finished = [other for other in self._jobs.values() if other.done]
+        for old in sorted(finished, key=lambda other: other.finished)[:-MAX_FINISHED_JOBS]:
+            del self._jobs[old.id]
@@ -0,0 +1,312 @@
+"""
+lod.py
+
+Level of detail versions of generated maps.
+Meshes are decimated by vertex clustering: the vertices are snapped to a grid of cubic
+cells, the vertices of a cell become one vertex at their mean (with the mean UV and color)
+and the faces that collapse are dropped. The cell size is searched for the face count of
+the requested ratio. Vertices with far apart UVs stay apart, so texture seams survive.
+Decimated meshes are cached by content hash, so every distinct model (and the other
+geometry of the base map) is decimated once per ratio however many maps use it.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import trimesh
+from trimesh import grouping
+
+from core.mesh_cache import clone_geometry, estimate_bytes
+
+# Memory budget of the cache of decimated meshes
+LOD_CACHE_BYTES = int(os.environ.get("MAPGEN_LOD_CACHE_MB", "256")) * 1024 * 1024
+# Meshes with at most this many faces are kept as they are
+MIN_LOD_FACES = 16
+# Most cells along the longest side of a mesh the search tries
+MAX_LOD_CELLS = 4096
+# The search stops when the face count is this close to the target
+LOD_TOLERANCE = 0.05
+LOD_SEARCH_STEPS = 16
+# The scene metadata key under which a built map carries its [(ratio, scene)] LODs
+LODS_KEY = "lods"
+
+
+def check_ratios(ratios):
+    """The LOD ratios as floats, each between 0 and 1."""
+    ratios = [float(ratio) for ratio in ratios or ()]
+    for ratio in ratios:
+        if not 0 < ratio < 1:
+            raise ValueError(f"LOD ratios must be between 0 and 1, got {ratio}")
+    return ratios
+
+
+def lod_filename(filename, level):
+    """The file name of LOD level of a map exported as separate files, e.g. map_a_lod1.obj."""
+    stem, dot, suffix = str(filename).rpartition(".")
+    if not dot:
+        return f"{filename}_lod{level}"
+    return f"{stem}_lod{level}.{suffix}"
+
+
+def decimate(mesh, ratio):
+    """
+    A copy of mesh with about ratio of its faces, found by vertex clustering.
+    Meshes that are too small to decimate are returned as a clone.
+    """
+    face_count = len(mesh.faces)
+    if ratio >= 1 or face_count <= MIN_LOD_FACES:
+        return clone_geometry(mesh)
+    vertices = mesh.vertices.view(np.ndarray)
+    low = vertices.min(axis=0)
+    extent = float((vertices.max(axis=0) - low).max())
+    if extent == 0:
+        return clone_geometry(mesh)
+
+    target = max(1, int(round(face_count * ratio)))
+    uv = _uv(mesh)
+    best = None
+    lower, upper = 1, MAX_LOD_CELLS
+    for _ in range(LOD_SEARCH_STEPS):
+        if lower > upper:
+            break
+        # Geometric middle, the face count grows with the square of the cells for surfaces
+        cells = int(round(np.sqrt(lower * upper)))
+        labels, faces, kept = _cluster(vertices, mesh.faces.view(np.ndarray), uv, low, extent, cells)
+        if best is None or abs(len(faces) - target) < abs(len(best[1]) - target):
+            best = (labels, faces, kept)
+        if abs(len(faces) - target) <= target * LOD_TOLERANCE:
+            break
+        if len(faces) > target:
+            upper = cells - 1
+        else:
+            lower = cells + 1
+    return _clustered_mesh(mesh, uv, *best)
+
+
+def _uv(mesh):
+    visual = mesh.visual
+    if isinstance(visual, trimesh.visual.TextureVisuals) and len(np.shape(visual.uv)) == 2:
+        return np.asarray(visual.uv, dtype=np.float64)
+    return None
+
+
+def _cluster(vertices, faces, uv, low, extent, cells):
+    """
+    (cluster of every vertex, faces between clusters without collapsed or repeated ones,
+    indices of the kept faces) for a grid of cells cells along the longest side.
+    """
+    size = extent / cells
+    grid = np.minimum(np.floor((vertices - low) / size).astype(np.int64), cells - 1)
+    keys = (grid[:, 0] * cells + grid[:, 1]) * cells + grid[:, 2]
+    if uv is not None:
+        uv_low = uv.min(axis=0)
+        uv_size = max(float((uv.max(axis=0) - uv_low).max()), 1e-12) / cells
+        uv_grid = np.minimum(np.floor((uv - uv_low) / uv_size).astype(np.int64), cells - 1)
+        keys = (keys * cells + uv_grid[:, 0]) * cells + uv_grid[:, 1]
+    _, labels = np.unique(keys, return_inverse=True)
+    labels = labels.reshape(-1)
+
+    clustered = labels[faces]
+    kept = np.nonzero((clustered[:, 0] != clustered[:, 1]) & (clustered[:, 1] != clustered[:, 2])
+                      & (clustered[:, 0] != clustered[:, 2]))[0]
+    unique = np.sort(grouping.unique_rows(np.sort(clustered[kept], axis=1))[0])
+    kept = kept[unique]
+    return labels, clustered[kept], kept
+
+
+def _clustered_mesh(mesh, uv, labels, faces, kept):
+    """The mesh of the clusters that faces use, every cluster at the mean of its vertices."""
+    used, faces = np.unique(faces, return_inverse=True)
+    faces = faces.reshape(-1, 3)
+    remap = np.full(labels.max() + 1, -1, dtype=np.int64)
+    remap[used] = np.arange(len(used))
+    members = remap[labels]
+    inside = members >= 0
+    members = members[inside]
+    counts = np.bincount(members, minlength=len(used))[:, np.newaxis]
+
+    def mean(values):
+        values = np.asarray(values, dtype=np.float64)[inside]
+        return np.column_stack([
+            np.bincount(members, weights=values[:, column], minlength=len(used))
+            for column in range(values.shape[1])
+        ]) / counts
+
+    decimated = trimesh.Trimesh(
+        vertices=mean(mesh.vertices),
+        faces=faces,
+        metadata=mesh.metadata.copy(),
+        process=False,
+        validate=False
+    )
+    visual = mesh.visual
+    if isinstance(visual, trimesh.visual.TextureVisuals):
+        decimated.visual = trimesh.visual.TextureVisuals(
+            uv=None if uv is None else mean(uv),
+            material=visual.material
+        )
+    elif visual.kind == "face":
+        decimated.visual = trimesh.visual.ColorVisuals(decimated, face_colors=visual.face_colors[kept])
+    elif visual.kind == "vertex":
+        colors = np.round(mean(visual.vertex_colors)).astype(np.uint8)
+        decimated.visual = trimesh.visual.ColorVisuals(decimated, vertex_colors=colors)
+    return decimated
+
+
+def content_hash(mesh):
+    """sha256 of everything a decimated copy of the mesh depends on."""
+    hasher = hashlib.sha256()
+    hasher.update(np.ascontiguousarray(mesh.vertices, dtype=np.float64).tobytes())
+    hasher.update(np.ascontiguousarray(mesh.faces, dtype=np.int64).tobytes())
+    visual = mesh.visual
+    if isinstance(visual, trimesh.visual.TextureVisuals):
+        if visual.uv is not None:
+            hasher.update(np.ascontiguousarray(visual.uv, dtype=np.float64).tobytes())
+        hasher.update(str(hash(visual.material)).encode())
+    elif visual.kind == "face":
+        hasher.update(np.ascontiguousarray(visual.face_colors).tobytes())
+    elif visual.kind == "vertex":
+        hasher.update(np.ascontiguousarray(visual.vertex_colors).tobytes())
+    return hasher.hexdigest()
+
+
+class LodCache:
+    """
+    LRU cache of decimated meshes keyed by the content hash of the mesh and the ratio.
+    Callers get clones that share the cached (read-only) arrays.
+    """
+
+    def __init__(self, max_bytes=LOD_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def decimate(self, mesh, ratio):
+        """Decimated copy of mesh (any other geometry is copied as it is)."""
+        if not isinstance(mesh, trimesh.Trimesh):
+            return mesh.copy()
+        key = (content_hash(mesh), float(ratio))
+        with self._lock:
+            decimated = self._entries.get(key)
+            if decimated is not None:
+                self._entries.move_to_end(key)
+        if decimated is None:
+            decimated = decimate(mesh, ratio)
+            decimated.vertices.flags.writeable = False
+            decimated.faces.flags.writeable = False
+            self._store(key, decimated)
+        return clone_geometry(decimated)
+
+    def decimate_scene(self, scene, ratio):
+        """A scene of the decimated geometry of scene under the same names and nodes."""
+        return trimesh.Scene(
+            geometry={name: self.decimate(geometry, ratio) for name, geometry in scene.geometry.items()},
+            graph=scene.graph.copy(),
+            metadata=scene.metadata.copy()
+        )
+
+    def _store(self, key, decimated):
+        size = estimate_bytes(decimated)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = decimated
+            self._size += size
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= estimate_bytes(evicted)
+
+
+class LodShapeFactory:
+    """
+    A ShapeFactory whose templates are the templates of shape_factory decimated to ratio.
+    Objects are baked from the decimated templates with one scale + translation.
+    """
+
+    def __init__(self, shape_factory, ratio):
+        self.shape_factory = shape_factory
+        self.ratio = ratio
+        self._templates = {}
+
+    def create_template(self, obj_conf):
+        key, template = self.shape_factory.create_template(obj_conf)
+        decimated = self._templates.get(key)
+        if decimated is None:
+            decimated = lod_cache.decimate_scene(template, self.ratio)
+            self._templates[key] = decimated
+        return key, decimated
+
+    def create_shape(self, obj_conf) -> trimesh.Scene:
+        _, template = self.create_template(obj_conf)
+        scale = float(obj_conf.scale)
+        position = np.asarray(obj_conf.position, dtype=np.float64)
+        shape = trimesh.Scene()
+        for name, part in template.geometry.items():
+            shape.add_geometry(clone_geometry(part, vertices=part.vertices * scale + position), geom_name=name)
+        return shape
+
+
+def lod_scene(scene, lods):
+    """
+    One scene holding scene and all its [(ratio, scene)] LODs for glTF export with MSFT_lod:
+    the nodes of level k (0 is the full map) hang below a node LOD<k>, every node with the
+    world transform it had. Geometry is shared between the nodes of a level like before.
+    """
+    combined = trimesh.Scene(metadata=scene.metadata.copy())
+    levels = [scene] + [level for _, level in lods]
+    for level, source in enumerate(levels):
+        group = f"LOD{level}"
+        combined.graph.update(frame_to=group, frame_from=combined.graph.base_frame, matrix=np.eye(4))
+        names = {}
+        for node in source.graph.nodes_geometry:
+            matrix, geom_name = source.graph[node]
+            if geom_name not in names:
+                name = geom_name if level == 0 else f"{geom_name}_lod{level}"
+                names[geom_name] = trimesh.util.unique_name(name, combined.geometry.keys())
+                combined.geometry[names[geom_name]] = source.geometry[geom_name]
+            node_name = node if level == 0 else f"{node}_lod{level}"
+            combined.graph.update(frame_to=node_name, frame_from=group, matrix=matrix, geometry=names[geom_name])
+    return combined
+
+
+def msft_lod(lods):
+    """
+    tree_postprocessor for the glTF export of lod_scene: LOD0 lists the other levels in the
+    MSFT_lod extension with the MSFT_screencoverage of every level (half the level's ratio),
+    and the other levels are taken out of the scene so only LOD0 is drawn by default.
+    """
+    coverages = [0.5] + [0.5 * ratio for ratio, _ in lods]
+
+    def postprocess(tree):
+        index = {node.get("name"): i for i, node in enumerate(tree["nodes"])}
+        levels = [index[f"LOD{level}"] for level in range(1, len(lods) + 1)]
+        for node in tree["nodes"]:
+            if "children" in node:
+                node["children"] = [child for child in node["children"] if child not in levels]
+        for scene in tree.get("scenes", []):
+            scene["nodes"] = [node for node in scene.get("nodes", []) if node not in levels]
+        first = tree["nodes"][index["LOD0"]]
+        first.setdefault("extensions", {})["MSFT_lod"] = {"ids": levels}
+        first.setdefault("extras", {})["MSFT_screencoverage"] = coverages
+        used = tree.setdefault("extensionsUsed", [])
+        if "MSFT_lod" not in used:
+            used.append("MSFT_lod")
+
+    return postprocess
+
+
+# The cache shared by everything in this process
+lod_cache = LodCache()
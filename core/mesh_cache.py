@@ -0,0 +1,442 @@
+"""
+mesh_cache.py
+
+Process-wide cache of parsed meshes.
+Meshes are keyed by the hash of the file content, not by the file name, because
+uploads overwrite each other under the same name. The files a mesh pulls in (the MTL
+libraries of an OBJ and their textures, the buffers and images of a glTF) are part of
+the key, so a changed material is a different mesh. Callers get cheap clones that share
+the cached (read-only) vertex and face arrays. Optionally the parsed meshes are also
+compiled into .npz files so a restarted server does not parse the same OBJ again.
+save_mapped/load_mapped store the same arrays as one .npy file each, which every process
+opens as a read-only memory map of the same pages instead of a copy of its own.
+"""
+import hashlib
+import io
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+import trimesh
+from trimesh.parent import LoadSource
+from urllib.parse import unquote
+
+# Memory budget of the in-memory cache
+MESH_CACHE_BYTES = int(os.environ.get("MAPGEN_MESH_CACHE_MB", "512")) * 1024 * 1024
+# Folder of the compiled on-disk cache, disabled when not set
+MESH_CACHE_DIR = os.environ.get("MAPGEN_MESH_CACHE_DIR")
+
+_HASH_CHUNK = 1024 * 1024
+
+# Lines of OBJ and MTL files that name other files
+_OBJ_LIBRARY = re.compile(rb"^[ \t]*mtllib[ \t]+([^\r\n#]+)", re.MULTILINE)
+_MTL_TEXTURE = re.compile(rb"^[ \t]*(?:map_\w+|bump|disp|decal|refl|norm)[ \t]+([^\r\n#]+)", re.MULTILINE)
+
+
+def clone_geometry(geometry, source=None, vertices=None):
+    """
+    Cheap copy of a geometry. Trimesh clones share the vertex and face arrays;
+    everything that changes geometry in trimesh assigns new arrays, so the shared
+    ones are never written to. vertices replaces the vertex array of the clone.
+    """
+    if not isinstance(geometry, trimesh.Trimesh):
+        return geometry.copy()
+    clone = trimesh.Trimesh(
+        vertices=geometry.vertices if vertices is None else vertices,
+        faces=geometry.faces,
+        visual=_clone_visual(geometry.visual),
+        metadata=geometry.metadata.copy(),
+        process=False,
+        validate=False
+    )
+    # Keep where the geometry was loaded from, scenes name their geometry after it.
+    clone._source = source if source is not None else geometry.source
+    return clone
+
+
+def clone_scene(scene, source=None):
+    geometry = {name: clone_geometry(geom, source) for name, geom in scene.geometry.items()}
+    return trimesh.Scene(
+        geometry=geometry,
+        graph=scene.graph.copy(),
+        metadata=scene.metadata.copy()
+    )
+
+
+def _clone_visual(visual):
+    if isinstance(visual, trimesh.visual.TextureVisuals):
+        # The material is shared, only the per-vertex data belongs to the mesh.
+        return trimesh.visual.TextureVisuals(
+            uv=visual.uv,
+            material=visual.material,
+            face_materials=visual.face_materials
+        )
+    return visual.copy()
+
+
+def _freeze(loaded):
+    """
+    Make the arrays of a cached mesh read-only so a caller can never change the cache by accident.
+    """
+    geometries = loaded.geometry.values() if isinstance(loaded, trimesh.Scene) else [loaded]
+    for geometry in geometries:
+        if isinstance(geometry, trimesh.Trimesh):
+            geometry.vertices.flags.writeable = False
+            geometry.faces.flags.writeable = False
+
+
+def _geometry_bytes(geometry):
+    if not isinstance(geometry, trimesh.Trimesh):
+        return 0
+    size = geometry.vertices.nbytes + geometry.faces.nbytes
+    visual = geometry.visual
+    if isinstance(visual, trimesh.visual.TextureVisuals):
+        if visual.uv is not None:
+            size += visual.uv.nbytes
+        image = getattr(visual.material, "image", None)
+        if image is not None:
+            size += image.width * image.height * len(image.getbands())
+    elif visual.defined:
+        size += visual.face_colors.nbytes
+    return size
+
+
+def estimate_bytes(loaded):
+    if isinstance(loaded, trimesh.Scene):
+        return sum(_geometry_bytes(geometry) for geometry in loaded.geometry.values())
+    return _geometry_bytes(loaded)
+
+
+class MeshCache:
+    """
+    LRU cache of parsed meshes keyed by file content hash.
+    """
+
+    def __init__(self, max_bytes=MESH_CACHE_BYTES, disk_dir=MESH_CACHE_DIR):
+        self.max_bytes = max_bytes
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        self._entries = OrderedDict()
+        self._size = 0
+        self._hashes = {}
+        self._side_files = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def size(self):
+        return self._size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._hashes.clear()
+            self._side_files.clear()
+            self._size = 0
+
+    def content_hash(self, path):
+        """
+        sha256 of the file content. Remembered per (path, size, mtime) so an
+        unchanged file is only read once.
+        """
+        path = Path(path).resolve()
+        stat = path.stat()
+        key = (str(path), stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            digest = self._hashes.get(key)
+        if digest is not None:
+            return digest
+
+        hasher = hashlib.sha256()
+        with open(path, "rb") as file:
+            for chunk in iter(lambda: file.read(_HASH_CHUNK), b""):
+                hasher.update(chunk)
+        digest = hasher.hexdigest()
+        self.remember_hash(path, digest)
+        return digest
+
+    def content_key(self, path, _seen=None):
+        """
+        Cache key of the mesh file: the content hash of the file combined with the keys of
+        the files it references. A referenced file that does not exist counts as missing,
+        so adding it later changes the key too.
+        """
+        path = Path(path).resolve()
+        digest = self.content_hash(path)
+        side_files = self.side_files(path)
+        if not side_files:
+            return digest
+        seen = (_seen or set()) | {path}
+        hasher = hashlib.sha256(digest.encode())
+        for side_file in side_files:
+            hasher.update(side_file.name.encode())
+            if side_file in seen:
+                continue
+            hasher.update(self.content_key(side_file, seen).encode() if side_file.is_file() else b"missing")
+        return hasher.hexdigest()
+
+    def side_files(self, path):
+        """
+        Paths of the files the mesh file references: material libraries of an OBJ,
+        textures of an MTL, buffers and images of a glTF. Remembered per (path, size, mtime).
+        """
+        path = Path(path).resolve()
+        suffix = path.suffix.lower()
+        if suffix not in (".obj", ".mtl", ".gltf"):
+            return []
+        stat = path.stat()
+        key = (str(path), stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            side_files = self._side_files.get(key)
+        if side_files is not None:
+            return side_files
+
+        if suffix == ".obj":
+            names = [name for line in _scan(path, _OBJ_LIBRARY) for name in line.split()]
+        elif suffix == ".mtl":
+            # Options may come before the texture name, it is the last word
+            names = [line.split()[-1] for line in _scan(path, _MTL_TEXTURE) if line.split()]
+        else:
+            try:
+                tree = json.loads(path.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                tree = {}
+            names = [
+                unquote(item["uri"]) for field in ("buffers", "images") for item in tree.get(field, [])
+                if isinstance(item, dict) and isinstance(item.get("uri"), str) and not item["uri"].startswith("data:")
+            ]
+        side_files = [(path.parent / name).resolve() for name in names]
+        with self._lock:
+            self._side_files[key] = side_files
+        return side_files
+
+    def remember_hash(self, path, digest):
+        """
+        Record an already known content hash of a file (e.g. computed while it was uploaded).
+        """
+        path = Path(path).resolve()
+        stat = path.stat()
+        with self._lock:
+            self._hashes[(str(path), stat.st_size, stat.st_mtime_ns)] = digest
+
+    def load(self, path):
+        """
+        Return a clone of the parsed mesh (trimesh.Trimesh or trimesh.Scene) of the file.
+        """
+        path = Path(path)
+        digest = self.content_key(path)
+        source = LoadSource(file_type=path.suffix.lstrip(".").lower(), file_path=str(path.resolve()))
+
+        with self._lock:
+            loaded = self._entries.get(digest)
+            if loaded is not None:
+                self._entries.move_to_end(digest)
+
+        if loaded is None:
+            loaded = self._load_compiled(digest)
+            if loaded is None:
+                loaded = trimesh.load(path)
+                self._save_compiled(digest, loaded)
+            _freeze(loaded)
+            self._store(digest, loaded)
+
+        if isinstance(loaded, trimesh.Scene):
+            return clone_scene(loaded, source)
+        return clone_geometry(loaded, source)
+
+    def _store(self, digest, loaded):
+        size = estimate_bytes(loaded)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if digest in self._entries:
+                return
+            self._entries[digest] = loaded
+            self._size += size
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= estimate_bytes(evicted)
+
+    def _compiled_path(self, digest):
+        return self.disk_dir / f"{digest}.npz"
+
+    def _load_compiled(self, digest):
+        if self.disk_dir is None:
+            return None
+        compiled_path = self._compiled_path(digest)
+        if not compiled_path.exists():
+            return None
+        try:
+            with np.load(compiled_path) as data:
+                return _decode(data)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"[mesh_cache] Ignoring unreadable compiled mesh {compiled_path.name}: {e}")
+            return None
+
+    def _save_compiled(self, digest, loaded):
+        if self.disk_dir is None:
+            return
+        arrays = _encode(loaded)
+        if arrays is None:
+            return
+        self.disk_dir.mkdir(parents=True, exist_ok=True)
+        compiled_path = self._compiled_path(digest)
+        temp_path = compiled_path.with_name(f"{compiled_path.name}.{os.getpid()}.tmp")
+        with open(temp_path, "wb") as file:
+            np.savez(file, **arrays)
+        os.replace(temp_path, compiled_path)
+
+
+def _scan(path, pattern):
+    """The first group of every match of pattern in the file, as text, read in chunks."""
+    found = []
+    carry = b""
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(_HASH_CHUNK), b""):
+            data = carry + chunk
+            # Keep the last (maybe unfinished) line for the next chunk
+            end = data.rfind(b"\n") + 1
+            data, carry = data[:end], data[end:]
+            found.extend(match.group(1) for match in pattern.finditer(data))
+    found.extend(match.group(1) for match in pattern.finditer(carry))
+    return [name.decode("utf-8", "replace").strip() for name in found]
+
+
+def _encode(loaded):
+    """
+    Arrays of a parsed mesh for the compiled cache.
+    Returns None for content it can not store (anything but triangle meshes with
+    simple materials or colors); those are only cached in memory.
+    """
+    if isinstance(loaded, trimesh.Scene):
+        kind = "scene"
+        geometry = loaded.geometry
+        nodes = []
+        for node in loaded.graph.nodes_geometry:
+            matrix, geom_name = loaded.graph[node]
+            nodes.append([node, geom_name, np.asarray(matrix).tolist()])
+    else:
+        kind = "mesh"
+        geometry = {"geometry_0": loaded}
+        nodes = []
+
+    header = {"kind": kind, "geometry": [], "nodes": nodes}
+    arrays = {}
+    for i, (name, geom) in enumerate(geometry.items()):
+        if not isinstance(geom, trimesh.Trimesh):
+            return None
+        entry = {"name": name}
+        arrays[f"g{i}_vertices"] = np.asarray(geom.vertices)
+        arrays[f"g{i}_faces"] = np.asarray(geom.faces)
+        visual = geom.visual
+        if isinstance(visual, trimesh.visual.TextureVisuals):
+            material = visual.material
+            if not isinstance(material, trimesh.visual.material.SimpleMaterial):
+                return None
+            if visual.uv is not None:
+                arrays[f"g{i}_uv"] = np.asarray(visual.uv)
+            entry["material"] = {
+                "name": material.name,
+                "ambient": np.asarray(material.ambient).tolist(),
+                "diffuse": np.asarray(material.diffuse).tolist(),
+                "specular": np.asarray(material.specular).tolist(),
+                "glossiness": material.glossiness,
+            }
+            if material.image is not None:
+                buffer = io.BytesIO()
+                material.image.save(buffer, format="PNG")
+                arrays[f"g{i}_image"] = np.frombuffer(buffer.getvalue(), dtype=np.uint8)
+        elif visual.defined:
+            arrays[f"g{i}_face_colors"] = np.asarray(visual.face_colors)
+        header["geometry"].append(entry)
+
+    arrays["header"] = np.frombuffer(json.dumps(header).encode("utf-8"), dtype=np.uint8)
+    return arrays
+
+
+def save_mapped(loaded, folder):
+    """
+    Write the arrays of a parsed mesh into folder as .npy files for load_mapped.
+    Returns False (and writes nothing) for content the compiled cache can not store.
+    """
+    arrays = _encode(loaded)
+    if arrays is None:
+        return False
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    for name, array in arrays.items():
+        np.save(folder / f"{name}.npy", array)
+    return True
+
+
+def load_mapped(folder):
+    """
+    The mesh (trimesh.Trimesh or trimesh.Scene) written by save_mapped, with its arrays
+    memory mapped read-only from the files.
+    """
+    return _decode(_MappedArrays(folder))
+
+
+class _MappedArrays:
+    """The arrays of a save_mapped folder in the interface of np.load(...) of an .npz."""
+
+    def __init__(self, folder):
+        self.folder = Path(folder)
+        self.files = [path.stem for path in self.folder.glob("*.npy")]
+
+    def __getitem__(self, name):
+        return np.load(self.folder / f"{name}.npy", mmap_mode="r")
+
+
+def _decode(data):
+    header = json.loads(bytes(data["header"]).decode("utf-8"))
+    geometry = {}
+    for i, entry in enumerate(header["geometry"]):
+        visual = None
+        if "material" in entry:
+            material = entry["material"]
+            image = None
+            if f"g{i}_image" in data.files:
+                from PIL import Image
+                image = Image.open(io.BytesIO(data[f"g{i}_image"].tobytes()))
+                image.load()
+            uv = data[f"g{i}_uv"] if f"g{i}_uv" in data.files else None
+            visual = trimesh.visual.TextureVisuals(
+                uv=uv,
+                material=trimesh.visual.material.SimpleMaterial(
+                    image=image,
+                    ambient=material["ambient"],
+                    diffuse=material["diffuse"],
+                    specular=material["specular"],
+                    glossiness=material["glossiness"],
+                    name=material["name"]
+                )
+            )
+        elif f"g{i}_face_colors" in data.files:
+            visual = trimesh.visual.ColorVisuals(face_colors=data[f"g{i}_face_colors"])
+        geometry[entry["name"]] = trimesh.Trimesh(
+            vertices=data[f"g{i}_vertices"],
+            faces=data[f"g{i}_faces"],
+            visual=visual,
+            process=False,
+            validate=False
+        )
+
+    if header["kind"] == "mesh":
+        return geometry["geometry_0"]
+
+    scene = trimesh.Scene()
+    for name, geom in geometry.items():
+        scene.geometry[name] = geom
+    for node, geom_name, matrix in header["nodes"]:
+        scene.graph.update(frame_to=node, matrix=np.asarray(matrix), geometry=geom_name)
+    return scene
+
+
+# The cache shared by everything in this process
+mesh_cache = MeshCache()
@@ -0,0 +1,217 @@
+"""
+obj_writer.py
+
+Streaming Wavefront OBJ/MTL export of scenes.
+trimesh builds the whole OBJ text of a scene in memory before writing it. This writer
+bakes, formats and writes one geometry at a time in chunks of rows, so the memory used
+while exporting is bounded by the largest single geometry instead of the whole scene.
+The output follows the trimesh OBJ exporter, so maps look the same to their readers.
+"""
+import os
+from pathlib import Path
+
+import numpy as np
+import trimesh
+from trimesh import transformations
+from trimesh.visual.color import to_float
+
+# Same header and material library name as the trimesh OBJ exporter
+HEADER = "https://github.com/mikedh/trimesh"
+MTL_NAME = "material.mtl"
+# Rows that are formatted and written at once
+CHUNK_ROWS = 65536
+# Text collected before it is handed on as one chunk
+CHUNK_BYTES = 1024 * 1024
+DIGITS = 8
+
+_IDENTITY = np.eye(4)
+
+
+def export_obj(scene, path, include_normals=False, chunk_rows=CHUNK_ROWS):
+    """
+    Write the scene to path as an OBJ file, with its materials and textures next to it.
+    Every node is baked with its transform like trimesh.Scene.dump does.
+    include_normals also writes the vertex normals (trimesh only writes them when cached).
+    The file is written under a temporary name and renamed when complete.
+    """
+    path = Path(path)
+    chunks, files = serialize_obj(scene, include_normals, chunk_rows)
+    temp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    try:
+        with open(temp_path, "wb") as file:
+            for chunk in chunks:
+                file.write(chunk)
+        os.replace(temp_path, path)
+    finally:
+        if temp_path.exists():
+            temp_path.unlink()
+
+    for file_name, file_data in files.items():
+        with open(path.parent / file_name, "wb") as file:
+            file.write(file_data)
+    return path
+
+
+def serialize_obj(scene, include_normals=False, chunk_rows=CHUNK_ROWS):
+    """
+    Returns (chunks, files): an iterator over the encoded OBJ text, produced one chunk of
+    rows at a time, and {file name: bytes} of the material library and textures it uses.
+    """
+    if isinstance(scene, trimesh.Trimesh):
+        scene = trimesh.Scene(scene)
+    nodes = _mesh_nodes(scene)
+    material_names, materials = _collect_materials(scene, nodes)
+    files = _material_files(materials) if materials else {}
+    return _obj_chunks(scene, nodes, material_names, bool(materials), include_normals, chunk_rows), files
+
+
+def _obj_chunks(scene, nodes, material_names, has_materials, include_normals, chunk_rows):
+    """
+    The OBJ text encoded in chunks of about CHUNK_BYTES; small geometries are
+    collected into one chunk instead of being written piece by piece.
+    """
+    pending = [f"# {HEADER}\n"]
+    if has_materials:
+        pending.append(f"mtllib {MTL_NAME}\n")
+    size = 0
+    counts = {"v": 0, "vt": 0, "vn": 0}
+    for _, matrix, geom_name in nodes:
+        geometry = scene.geometry[geom_name]
+        for text in _geometry_chunks(geometry, matrix, geom_name, material_names.get(geom_name),
+                                     counts, include_normals, chunk_rows):
+            pending.append(text)
+            size += len(text)
+            if size >= CHUNK_BYTES:
+                yield "".join(pending).encode("utf-8")
+                pending = []
+                size = 0
+    pending.append("\n")
+    yield "".join(pending).encode("utf-8")
+
+
+def _mesh_nodes(scene):
+    """(node name, transform, geometry name) of every node that references a mesh."""
+    nodes = []
+    for node_name in scene.graph.nodes_geometry:
+        matrix, geom_name = scene.graph[node_name]
+        if isinstance(scene.geometry.get(geom_name), trimesh.Trimesh):
+            nodes.append((node_name, np.asarray(matrix, dtype=np.float64), geom_name))
+    return nodes
+
+
+def _collect_materials(scene, nodes):
+    """
+    Material names by geometry name, and the (name, material) of every distinct material
+    in the order they are first used. Materials that are equal share one name.
+    """
+    material_names = {}
+    materials = {}
+    used_names = set()
+    for _, _, geom_name in nodes:
+        if geom_name in material_names:
+            continue
+        visual = scene.geometry[geom_name].visual
+        if not hasattr(visual, "uv"):
+            continue
+        material = visual.material
+        if hasattr(material, "to_simple"):
+            material = material.to_simple()
+        hashed = hash(material)
+        if hashed not in materials:
+            name = trimesh.util.unique_name(material.name, used_names)
+            used_names.add(name)
+            materials[hashed] = (name, material)
+        material_names[geom_name] = materials[hashed][0]
+    return material_names, list(materials.values())
+
+
+def _geometry_chunks(geometry, matrix, geom_name, material_name, counts, include_normals, chunk_rows):
+    vertices = geometry.vertices
+    faces = geometry.faces
+    has_rotation = False
+    if not trimesh.util.allclose(matrix, _IDENTITY, 1e-8):
+        vertices = transformations.transform_points(vertices, matrix=matrix)
+        has_rotation = not trimesh.util.allclose(matrix[:3, :3], _IDENTITY[:3, :3], atol=1e-6)
+        if has_rotation and transformations.flips_winding(matrix):
+            faces = np.fliplr(faces)
+
+    visual = geometry.visual
+    if visual.kind in ("vertex", "face") and len(visual.vertex_colors):
+        vertex_rows = np.column_stack((vertices, to_float(visual.vertex_colors[:, :3])))
+    else:
+        vertex_rows = vertices
+
+    head = f"\no {geom_name}\n"
+    if material_name is not None:
+        head += f"usemtl {material_name}\n"
+    yield head
+    yield from _row_chunks("v", vertex_rows, chunk_rows)
+
+    face_columns = ["v"]
+    if material_name is not None and len(np.shape(visual.uv)) == 2:
+        yield from _row_chunks("vt", visual.uv, chunk_rows)
+        face_columns.append("vt")
+    if include_normals:
+        normals = geometry.vertex_normals
+        if has_rotation:
+            normals = trimesh.util.unitize(
+                transformations.transform_points(normals, matrix=matrix, translate=False)
+            )
+        yield from _row_chunks("vn", normals, chunk_rows)
+        face_columns.append("vn")
+
+    yield from _face_chunks(faces, face_columns, counts, chunk_rows)
+    counts["v"] += len(geometry.vertices)
+    if "vt" in face_columns:
+        counts["vt"] += len(visual.uv)
+    if "vn" in face_columns:
+        counts["vn"] += len(geometry.vertices)
+
+
+def _row_chunks(prefix, rows, chunk_rows):
+    rows = np.asarray(rows, dtype=np.float64)
+    line = prefix + " " + " ".join(["{:." + str(DIGITS) + "f}"] * rows.shape[1]) + "\n"
+    for start in range(0, len(rows), chunk_rows):
+        chunk = rows[start:start + chunk_rows]
+        yield (line * len(chunk)).format(*chunk.ravel())
+
+
+def _face_chunks(faces, face_columns, counts, chunk_rows):
+    """
+    Faces with 1-based indices into every written vertex attribute.
+    Each attribute has its own offset, so geometries without uvs or normals
+    do not shift the indices of the ones after them.
+    """
+    if face_columns == ["v"]:
+        corner = "{}"
+    elif face_columns == ["v", "vt"]:
+        corner = "{}/{}"
+    elif face_columns == ["v", "vn"]:
+        corner = "{}//{}"
+    else:
+        corner = "{}/{}/{}"
+    line = "f " + " ".join([corner] * faces.shape[1]) + "\n"
+    offsets = [counts[column] + 1 for column in face_columns]
+
+    for start in range(0, len(faces), chunk_rows):
+        chunk = np.asarray(faces[start:start + chunk_rows], dtype=np.int64)
+        # one column per attribute index of every corner: v, (vt), (vn)
+        corners = np.stack([chunk + offset for offset in offsets], axis=-1)
+        yield (line * len(chunk)).format(*corners.ravel())
+
+
+def _material_files(materials):
+    """
+    {file name: bytes} of the material library and the textures it references.
+    """
+    mtl_blocks = []
+    files = {}
+    for name, material in materials:
+        data, _ = material.to_obj(name=name)
+        for file_name, file_data in data.items():
+            if file_name.lower().endswith(".mtl"):
+                mtl_blocks.append(file_data)
+            elif file_name not in files:
+                files[file_name] = file_data
+    files[MTL_NAME] = f"# {HEADER}\n\n".encode() + b"\n\n".join(mtl_blocks)
+    return files
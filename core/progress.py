@@ -0,0 +1,203 @@
+"""
+progress.py
+
+Push-based progress of background tasks.
+Worker threads publish progress events, websocket handlers subscribe to them. Every task
+keeps only its latest state; an asyncio.Event that is replaced on every change wakes the
+subscribers, so idle watchers cost nothing and any number of them share one wake-up.
+Events published from threads are merged and handed to the event loop in one
+call_soon_threadsafe per batch instead of one per event.
+A finished task is dropped RETENTION seconds after it finished; its final state is kept
+for the last MAX_FINISHED_TASKS of them, so late subscribers still get it.
+"""
+import asyncio
+import threading
+import time
+from collections import OrderedDict, deque
+
+# Seconds a finished task stays available to late subscribers
+RETENTION = 60.0
+# Finished tasks whose final state is remembered after their retention
+MAX_FINISHED_TASKS = 100
+# Least seconds between two messages to the same subscriber; changes in between are merged
+MIN_INTERVAL = 0.1
+# Job states after which no more progress follows
+FINAL_STATUSES = {"done", "failed", "cancelled"}
+# The only message subscribers of an unknown (or long forgotten) task get
+NOT_FOUND = {"status": "not_found"}
+
+
+class _Topic:
+    """Latest state of one task."""
+
+    def __init__(self):
+        self.state = {"progress": 0.0}
+        self.version = 0
+        self.changed = asyncio.Event()
+        self.started = time.monotonic()
+        self.finished_at = None
+
+    def apply(self, fields):
+        for key, value in fields.items():
+            if isinstance(value, dict):
+                # dict fields such as "failed" accumulate
+                value = {**self.state.get(key, {}), **value}
+            self.state[key] = value
+        if "progress" in fields:
+            self._update_eta()
+        self.version += 1
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+
+    def _update_eta(self):
+        progress = self.state["progress"]
+        if progress >= 1.0:
+            self.state["eta"] = 0.0
+        elif progress > 0:
+            elapsed = time.monotonic() - self.started
+            self.state["eta"] = round(elapsed * (1 - progress) / progress, 1)
+
+    @property
+    def finished(self):
+        return self.state["progress"] >= 1.0 or self.state.get("status") in FINAL_STATUSES
+
+
+class ProgressBroker:
+    """
+    publish(task_id, **fields) may be called from any thread, subscribe(task_id) is an
+    async iterator over the changed states of the task on the event loop.
+    Until bind(loop) is called (or the first subscriber binds its loop) events are
+    applied right away on the publishing thread.
+    """
+
+    def __init__(self, retention=RETENTION, min_interval=MIN_INTERVAL, max_finished=MAX_FINISHED_TASKS):
+        self.retention = retention
+        self.min_interval = min_interval
+        self.max_finished = max_finished
+        self._lock = threading.Lock()
+        self._loop = None
+        self._topics = {}
+        # task id -> fields published since the last hand-off to the loop
+        self._pending = {}
+        # (finish time, task id, topic) of the finished topics, in the order they finished
+        self._expiring = deque()
+        # task id -> final state of the expired topics, oldest first
+        self._finished = OrderedDict()
+
+    def __contains__(self, task_id):
+        with self._lock:
+            self._purge()
+            return task_id in self._topics or task_id in self._pending or task_id in self._finished
+
+    def bind(self, loop):
+        """Hand the events to subscribers on loop, the loop of the app."""
+        with self._lock:
+            self._loop = loop
+
+    def publish(self, task_id, **fields):
+        """
+        Merge fields into the state of the task and wake its subscribers.
+        """
+        with self._lock:
+            self._purge()
+            loop = self._loop
+            if loop is None or loop.is_closed():
+                # Nobody can be waiting without a loop, apply right away
+                self._apply(task_id, fields)
+                return
+            pending = self._pending.get(task_id)
+            schedule = pending is None
+            if schedule:
+                pending = self._pending[task_id] = {}
+            _merge(pending, fields)
+        if schedule:
+            loop.call_soon_threadsafe(self._flush, task_id)
+
+    def snapshot(self, task_id):
+        with self._lock:
+            self._purge()
+            topic = self._topics.get(task_id)
+            if topic is not None:
+                return dict(topic.state)
+            state = self._finished.get(task_id)
+            return dict(state) if state is not None else None
+
+    async def subscribe(self, task_id):
+        """
+        Yield the state of the task now and after every change, at most every
+        min_interval seconds, until the task has finished.
+        A task that finished long ago only yields its final state, an unknown
+        task only NOT_FOUND.
+        """
+        with self._lock:
+            self._loop = asyncio.get_running_loop()
+        version = -1
+        while True:
+            with self._lock:
+                self._purge()
+                topic = self._topics.get(task_id)
+                if topic is None and task_id in self._pending:
+                    # Published, but not handed to the loop yet
+                    topic = self._topic(task_id)
+                if topic is None:
+                    # Never create a topic for a subscriber, nothing would ever publish to it
+                    state = dict(self._finished.get(task_id, NOT_FOUND))
+                    finished = True
+                else:
+                    changed = topic.changed
+                    state = dict(topic.state) if topic.version != version else None
+                    version = topic.version
+                    finished = topic.finished
+            if state is None:
+                await changed.wait()
+                continue
+            yield state
+            if finished:
+                return
+            await asyncio.sleep(self.min_interval)
+
+    def _topic(self, task_id):
+        topic = self._topics.get(task_id)
+        if topic is None:
+            topic = self._topics[task_id] = _Topic()
+            # A forgotten task that publishes again continues from its final state
+            state = self._finished.pop(task_id, None)
+            if state is not None:
+                topic.state = state
+        return topic
+
+    def _apply(self, task_id, fields):
+        """Merge fields into the topic of the task, with the lock held."""
+        topic = self._topic(task_id)
+        topic.apply(fields)
+        if topic.finished and topic.finished_at is None:
+            topic.finished_at = time.monotonic()
+            self._expiring.append((topic.finished_at, task_id, topic))
+
+    def _purge(self):
+        """Drop the topics that finished more than retention seconds ago, with the lock held."""
+        now = time.monotonic()
+        while self._expiring and now - self._expiring[0][0] >= self.retention:
+            _, task_id, topic = self._expiring.popleft()
+            if self._topics.get(task_id) is topic:
+                del self._topics[task_id]
+                self._finished[task_id] = topic.state
+                while len(self._finished) > self.max_finished:
+                    self._finished.popitem(last=False)
+
+    def _flush(self, task_id):
+        """Apply the pending fields of a task, runs on the loop."""
+        with self._lock:
+            fields = self._pending.pop(task_id, None)
+            if fields:
+                self._apply(task_id, fields)
+
+
+def _merge(pending, fields):
+    for key, value in fields.items():
+        if isinstance(value, dict) and isinstance(pending.get(key), dict):
+            value = {**pending[key], **value}
+        pending[key] = value
+
+
+progress_broker = ProgressBroker()
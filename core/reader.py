@@ -5,57 +5,78 @@ This file contains all of the loading operations.
 Configs, maps etc. loading to the system here.
 """
 
+import json
+import os
+import shutil
 from pathlib import Path
+import numpy as np
 import trimesh
 import yaml
+from rtree.exceptions import RTreeError
 from models.domain import MainConfig, MapConfig
+from core.heightfield import HeightField
+from core.mesh_cache import mesh_cache, clone_scene, load_mapped, save_mapped
+from core.terrain import FootprintIndex, TerrainRayIntersector, terrain_intersector
 
 UPLOAD_DIR = Path("./uploads")
 CONFIG_DIR = Path("./configs")
 
+# Base maps are compiled next to their upload and memory mapped by every process that builds on them
+TERRAIN_CACHE = os.environ.get("MAPGEN_TERRAIN_CACHE", "1") != "0"
+# Changes whenever the layout of a compiled base map changes
+TERRAIN_CACHE_VERSION = 2
+
+# Config files are read by extension: JSON is parsed and validated by pydantic in one step,
+# YAML (for hand-edited configs) with the libyaml loader when PyYAML was built with it.
+CONFIG_EXTENSIONS = (".yaml", ".yml", ".json")
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
 def _safe_upload_path(filename: str) -> Path:
     return UPLOAD_DIR / Path(filename).name
 
 def _safe_config_path(filename: str) -> Path:
     return CONFIG_DIR / Path(filename).name
 
+def read_config_file(path: Path, model):
+    """
+    Read a config file into the pydantic model, as JSON or YAML by its extension.
+    """
+    if path.suffix.lower() == ".json":
+        return model.model_validate_json(path.read_bytes())
+
+    with open(path, 'r', encoding="utf-8") as file:
+        data = yaml.load(file, Loader=YAML_LOADER)
+
+    return model(**data)
+
 # Reads the main config file from configs folder (not uploads)
 def load_config(filename: str) -> MainConfig:
     """
     Loading the main configuration file from configs folder.
     """
-    yaml_path = _safe_config_path(filename)
-    if not yaml_path.exists():
-        raise FileNotFoundError(f"YAML file not found: {yaml_path}")
+    config_path = _safe_config_path(filename)
+    if not config_path.exists():
+        raise FileNotFoundError(f"Config file not found: {config_path}")
 
-    with open(yaml_path, 'r', encoding="utf-8") as file:
-        data = yaml.safe_load(file)
-
-    return MainConfig(**data)
+    return read_config_file(config_path, MainConfig)
 
 def load_uploaded_config(filename: str) -> MainConfig:
     """
     Load main config file from uploads folder (used right after upload).
     """
-    yaml_path = _safe_upload_path(filename)
-    if not yaml_path.exists():
-        raise FileNotFoundError(f"YAML file not found in uploads: {yaml_path}")
-
-    with open(yaml_path, 'r', encoding="utf-8") as file:
-        data = yaml.safe_load(file)
+    config_path = _safe_upload_path(filename)
+    if not config_path.exists():
+        raise FileNotFoundError(f"Config file not found in uploads: {config_path}")
 
-    return MainConfig(**data)
+    return read_config_file(config_path, MainConfig)
 
 # Reads the map config file from configs folder (not uploads)
 def load_map_config(filename: str) -> MapConfig:
-    yaml_path = _safe_config_path(filename)
-    if not yaml_path.exists():
-        raise FileNotFoundError(f"YAML file not found: {yaml_path}")
-
-    with open(yaml_path, 'r', encoding="utf-8") as file:
-        data = yaml.safe_load(file)
+    config_path = _safe_config_path(filename)
+    if not config_path.exists():
+        raise FileNotFoundError(f"Config file not found: {config_path}")
 
-    return MapConfig(**data)
+    return read_config_file(config_path, MapConfig)
 
 
 # Loads the trimesh scene from uploads folder (base map or models)
@@ -67,7 +88,8 @@ def load_scene(filename: str) -> trimesh.Scene:
     if not mesh_path.exists():
         raise FileNotFoundError(f"Mesh file not found: {mesh_path}")
 
-    mesh = trimesh.load(mesh_path)
+    # Parsed once per file content, every call gets its own copy
+    mesh = mesh_cache.load(mesh_path)
     if isinstance(mesh, trimesh.Trimesh):
         scene = trimesh.Scene()
         scene.add_geometry(mesh)
@@ -85,3 +107,184 @@ def load_scene(filename: str) -> trimesh.Scene:
         scene.add_geometry(mesh)
 
     return scene
+
+
+def _heightfield_cache_path(filename: str, resolution: int) -> Path:
+    mesh_path = _safe_upload_path(filename)
+    return mesh_path.with_name(f"{mesh_path.stem}.heightfield_{int(resolution)}.npz")
+
+
+# Loads (or builds and caches) the heightfield of a base map from uploads folder
+def load_heightfield(filename: str, mesh: trimesh.Trimesh, resolution: int) -> HeightField:
+    """
+    Loading the rasterized heightfield of an uploaded base map.
+    The heightfield is built once and cached next to the upload. The cache is rebuilt
+    when the upload or the mesh it was built from changes.
+    """
+    mesh_path = _safe_upload_path(filename)
+    if not mesh_path.exists():
+        raise FileNotFoundError(f"Mesh file not found: {mesh_path}")
+
+    stat = mesh_path.stat()
+    signature = np.array([
+        stat.st_size, stat.st_mtime_ns, len(mesh.vertices), len(mesh.faces)
+    ], dtype=np.int64)
+
+    cache_path = _heightfield_cache_path(filename, resolution)
+    if cache_path.exists():
+        try:
+            heightfield, metadata = HeightField.load(cache_path)
+            if np.array_equal(metadata.get("signature"), signature):
+                return heightfield
+        except (OSError, ValueError, KeyError):
+            pass
+
+    heightfield = HeightField.from_mesh(mesh, resolution)
+    # Write to a temporary file first so concurrent builds never read a half written cache.
+    temp_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}.tmp")
+    with open(temp_path, "wb") as file:
+        heightfield.save(file, signature=signature)
+    os.replace(temp_path, cache_path)
+    return heightfield
+
+
+def _terrain_cache_path(filename: str) -> Path:
+    mesh_path = _safe_upload_path(filename)
+    # The full name, map.obj and map.glb are different base maps
+    return mesh_path.with_name(f"{mesh_path.name}.terrain")
+
+
+def _terrain_side_files(mesh_path: Path) -> list:
+    """Every file the base map pulls in: its material libraries, their textures and so on."""
+    found, pending = [], [mesh_path]
+    while pending:
+        for side_file in mesh_cache.side_files(pending.pop()):
+            if side_file not in found and side_file != mesh_path.resolve():
+                found.append(side_file)
+                if side_file.is_file():
+                    pending.append(side_file)
+    return found
+
+
+def _terrain_signature(mesh_path: Path, side_files) -> dict:
+    """
+    Signature of the upload and of every side file by size and mtime, a side file that
+    does not exist as None. Stats only, so opening a compiled base map never reads the upload.
+    """
+    stat = mesh_path.stat()
+    files = {}
+    for side_file in side_files:
+        try:
+            side_stat = os.stat(side_file)
+            files[str(side_file)] = [side_stat.st_size, side_stat.st_mtime_ns]
+        except OSError:
+            files[str(side_file)] = None
+    return {"version": TERRAIN_CACHE_VERSION, "name": mesh_path.name, "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns, "files": files}
+
+
+def _open_terrain_cache(cache_path: Path, mesh_path: Path):
+    """
+    The SceneTemplate of a compiled base map, None if there is none for this upload.
+    The side files are the ones listed in the stored signature: editing the upload or
+    one of them changes a stat, and adding a reference means editing the referencing file.
+    """
+    try:
+        stored = json.loads((cache_path / "signature.json").read_text(encoding="utf-8"))
+        if stored != _terrain_signature(mesh_path, stored.get("files", {})):
+            return None
+        scene = load_mapped(cache_path / "mesh")
+        index = FootprintIndex.open(next(iter(scene.geometry.values())), cache_path / "footprint")
+        return SceneTemplate(scene, index)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError, AttributeError, RTreeError) as e:
+        print(f"[reader] Ignoring unreadable compiled base map {cache_path.name}: {e}")
+        return None
+
+
+def _write_terrain_cache(template, cache_path: Path, signature: dict):
+    """
+    Compile the base map of template into cache_path: its arrays, the triangle index of the
+    base mesh and the signature of the upload it was parsed from, written last. The folder
+    is written under a temporary name and swapped in whole, so readers never see half of it.
+    """
+    if not isinstance(template.base_mesh, trimesh.Trimesh):
+        return
+    temp_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}.tmp")
+    shutil.rmtree(temp_path, ignore_errors=True)
+    try:
+        if not save_mapped(template.scene, temp_path / "mesh"):
+            return
+        template.base_mesh.ray.index.save(temp_path / "footprint")
+        (temp_path / "signature.json").write_text(json.dumps(signature), encoding="utf-8")
+        if cache_path.exists():
+            # Processes that mapped the old files keep reading them until they are done
+            stale_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}.old")
+            os.replace(cache_path, stale_path)
+            shutil.rmtree(stale_path, ignore_errors=True)
+        os.replace(temp_path, cache_path)
+    except (OSError, RTreeError) as e:
+        # Another process swapped its copy in first, or the disk is full
+        print(f"[reader] Could not compile base map {cache_path.name}: {e}")
+    finally:
+        shutil.rmtree(temp_path, ignore_errors=True)
+
+
+class SceneTemplate:
+    """
+    A base map scene that is parsed once and then never modified.
+    Every config gets a clone that shares the vertex and face arrays of the template.
+    The shared arrays are read-only: deforming a clone assigns new arrays to it,
+    it never writes into the template. Ray queries against geometry that has not been
+    modified can use base_mesh, whose ray accelerator is built once and reused; it indexes
+    the triangle footprints, so the clones keep using it while landscapes deform them.
+    index is an optional FootprintIndex of the base mesh to use for it.
+    """
+
+    def __init__(self, scene: trimesh.Scene, index: FootprintIndex = None):
+        self.scene = scene
+        for geometry in scene.geometry.values():
+            if isinstance(geometry, trimesh.Trimesh):
+                geometry.vertices.flags.writeable = False
+                geometry.faces.flags.writeable = False
+        if index is not None:
+            self.base_mesh.ray = TerrainRayIntersector(self.base_mesh, index)
+        elif isinstance(self.base_mesh, trimesh.Trimesh):
+            terrain_intersector(self.base_mesh)
+
+    @classmethod
+    def load(cls, filename: str) -> "SceneTemplate":
+        """
+        The template of an uploaded base map. With the terrain cache the first load compiles
+        the base map next to the upload (uploads/<map>.terrain/) and every load opens it from
+        there: vertices, faces, UVs, triangles and normals are memory mapped and the triangle
+        index reads its pages from disk, so all processes building on the same base map
+        share one read-only copy and skip parsing it.
+        """
+        if not TERRAIN_CACHE:
+            return cls(load_scene(filename))
+        mesh_path = _safe_upload_path(filename)
+        if not mesh_path.exists():
+            raise FileNotFoundError(f"Mesh file not found: {mesh_path}")
+
+        cache_path = _terrain_cache_path(filename)
+        template = _open_terrain_cache(cache_path, mesh_path)
+        if template is not None:
+            return template
+        # Stat the files before parsing them, an edit during the parse makes the next load compile again
+        signature = _terrain_signature(mesh_path, _terrain_side_files(mesh_path))
+        template = cls(load_scene(filename))
+        _write_terrain_cache(template, cache_path, signature)
+        return _open_terrain_cache(cache_path, mesh_path) or template
+
+    @property
+    def base_mesh(self) -> trimesh.Trimesh:
+        return next(iter(self.scene.geometry.values()))
+
+    def clone(self) -> trimesh.Scene:
+        """
+        Cheap copy of the template scene for one config.
+        """
+        return clone_scene(self.scene)
+
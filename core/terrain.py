@@ -0,0 +1,354 @@
+"""
+terrain.py
+
+Ray queries against a base terrain that landscapes deform.
+Landscapes only move vertices along Y and every ground query casts a vertical ray, so the
+broad phase indexes the triangles by their XZ footprint alone; the Y extent of every box
+spans all heights. That index stays valid through any deformation: it is built once for
+the base mesh and shared by all its clones, and a deformation only refits the triangles
+and normals of the faces around the moved vertices. Trimesh would throw its triangle
+tree away on every vertex change and rebuild it over the whole mesh on the next query.
+Closest point queries, which answer the rays that miss, use the same index.
+An index can be saved into a folder and opened from it by other processes: the arrays are
+memory mapped and the tree is read from its disk pages, so they share one copy.
+"""
+import json
+from pathlib import Path
+import numpy as np
+import rtree
+import trimesh
+from scipy.spatial import cKDTree
+from trimesh import graph, grouping, util
+from trimesh import triangles as triangles_mod
+from trimesh.constants import tol
+from trimesh.ray.ray_triangle import RayMeshIntersector, ray_triangle_id
+
+# Half height of the boxes of the footprint index, far beyond any deformed terrain
+FOOTPRINT_HEIGHT = 1e9
+# Pages (4 KB) of a saved footprint tree that an opened index buffers once it has read them,
+# about the whole tree of a 1M-face terrain; with a small buffer every query reads from the file
+FOOTPRINT_BUFFER_PAGES = 32768
+
+
+class FootprintIndex:
+    """
+    Triangle tree of a mesh keyed by the XZ footprint of every face, with the triangles,
+    normals and repair state of the mesh at the time the index was made. Everything is
+    computed on first use and never changes afterwards.
+    """
+
+    def __init__(self, mesh):
+        self.vertices = mesh.vertices.view(np.ndarray)
+        self.faces = mesh.faces.view(np.ndarray)
+        self._tree = None
+        self._triangles = None
+        self._normals = None
+        self._vertex_tree = None
+        self._state = None
+
+    def matches(self, mesh):
+        """Whether mesh has the geometry the index was made from."""
+        return (mesh.faces.shape == self.faces.shape and mesh.vertices.shape == self.vertices.shape
+                and np.array_equal(mesh.faces, self.faces) and np.array_equal(mesh.vertices, self.vertices))
+
+    @classmethod
+    def open(cls, mesh, folder):
+        """
+        The index of mesh saved into folder by save(), with memory mapped arrays and a
+        tree that reads its pages from disk.
+        """
+        folder = Path(folder)
+        index = cls(mesh)
+        index._triangles = np.load(folder / "triangles.npy", mmap_mode="r")
+        index._normals = np.load(folder / "normals.npy", mmap_mode="r")
+        state = json.loads((folder / "state.json").read_text(encoding="utf-8"))
+        bodies = None
+        if state["bodies"]:
+            labels = np.load(folder / "bodies.npy", mmap_mode="r")
+            bodies = [np.nonzero(labels == body)[0] for body in range(state["bodies"])]
+        index._state = {"clean": state["clean"], "bodies": bodies}
+        if not (folder / "tree.dat").exists():
+            # rtree would make a new, empty tree
+            raise FileNotFoundError(f"Footprint tree not found: {folder / 'tree.dat'}")
+        properties = rtree.index.Property(dimension=3, buffering_capacity=FOOTPRINT_BUFFER_PAGES)
+        index._tree = rtree.index.Index(str(folder / "tree"), properties=properties)
+        return index
+
+    def save(self, folder):
+        """Write the arrays, the tree and the repair state of the index into folder."""
+        folder = Path(folder)
+        folder.mkdir(parents=True, exist_ok=True)
+        np.save(folder / "triangles.npy", self.triangles)
+        np.save(folder / "normals.npy", self.normals)
+        bodies = self.bodies
+        if bodies is not None:
+            labels = np.zeros(len(self.faces), dtype=np.int64)
+            for body, faces in enumerate(bodies):
+                labels[faces] = body
+            np.save(folder / "bodies.npy", labels)
+        state = {"clean": self.clean, "bodies": None if bodies is None else len(bodies)}
+        (folder / "state.json").write_text(json.dumps(state), encoding="utf-8")
+        self._build_tree(str(folder / "tree")).close()
+
+    @property
+    def tree(self):
+        if self._tree is None:
+            self._tree = self._build_tree()
+        return self._tree
+
+    def _build_tree(self, path=None):
+        """The footprint tree, in memory or in the files at path."""
+        triangles = self.triangles
+        bounds = np.column_stack((triangles.min(axis=1), triangles.max(axis=1)))
+        bounds[:, 1] = -FOOTPRINT_HEIGHT
+        bounds[:, 4] = FOOTPRINT_HEIGHT
+        properties = rtree.index.Property(dimension=3)
+        location = () if path is None else (path,)
+        try:
+            # Bulk loading from arrays, several times faster than a stream of Python tuples
+            return rtree.index.Index(*location, (np.arange(len(bounds)), bounds[:, :3], bounds[:, 3:]),
+                                     properties=properties)
+        except NotImplementedError:
+            # libspatialindex before 2.1
+            if path is None:
+                return util.bounds_tree(bounds)
+            return rtree.index.Index(path, ((i, box, None) for i, box in enumerate(bounds)),
+                                     properties=properties)
+
+    @property
+    def vertex_tree(self):
+        """KD-tree of the XZ positions of the vertices, which deformations along Y keep."""
+        if self._vertex_tree is None:
+            self._vertex_tree = cKDTree(self.vertices[:, [0, 2]])
+        return self._vertex_tree
+
+    @property
+    def triangles(self):
+        if self._triangles is None:
+            self._triangles = self.vertices[self.faces]
+        return self._triangles
+
+    @property
+    def normals(self):
+        if self._normals is None:
+            self._normals = _face_normals(self.triangles)
+        return self._normals
+
+    @property
+    def clean(self):
+        """
+        Whether remove_degenerate_faces, remove_duplicate_faces and fix_winding leave
+        the mesh as it is. Deformations keep the faces, so for a clean mesh only the faces
+        they touch can need a repair.
+        """
+        return self._inspect()["clean"]
+
+    @property
+    def bodies(self):
+        """
+        None if fix_inversion skips the mesh (not watertight), else the face indices of
+        every body it checks for a negative volume.
+        """
+        return self._inspect()["bodies"]
+
+    def _inspect(self):
+        if self._state is None:
+            mesh = trimesh.Trimesh(vertices=self.vertices, faces=self.faces, process=False, validate=False)
+            clean = bool(mesh.nondegenerate_faces().all() and mesh.unique_faces().all()
+                         and mesh.is_winding_consistent)
+            bodies = None
+            if mesh.is_watertight:
+                if mesh.body_count > 1:
+                    bodies = graph.connected_components(mesh.face_adjacency)
+                else:
+                    bodies = [np.arange(len(self.faces))]
+            self._state = {"clean": clean, "bodies": bodies}
+        return self._state
+
+
+class TerrainRayIntersector(RayMeshIntersector):
+    """
+    Ray queries of a mesh against a FootprintIndex.
+    refit(faces) updates the triangles and normals of the given faces after
+    their vertices moved; until the first refit the arrays of the index are used.
+    """
+
+    def __init__(self, mesh, index=None):
+        super().__init__(mesh)
+        self.index = index if index is not None else FootprintIndex(mesh)
+        self._triangles = None
+        self._normals = None
+
+    @property
+    def triangles(self):
+        return self._triangles if self._triangles is not None else self.index.triangles
+
+    @property
+    def normals(self):
+        return self._normals if self._normals is not None else self.index.normals
+
+    def intersects_id(self, ray_origins, ray_directions, return_locations=False, multiple_hits=True, **kwargs):
+        index_tri, index_ray, locations = ray_triangle_id(
+            triangles=self.triangles,
+            ray_origins=ray_origins,
+            ray_directions=ray_directions,
+            tree=self.index.tree,
+            multiple_hits=multiple_hits,
+            triangles_normal=self.normals
+        )
+        if return_locations:
+            if len(index_tri) == 0:
+                return index_tri, index_ray, locations
+            unique = grouping.unique_rows(np.column_stack((locations, index_ray)))[0]
+            return index_tri[unique], index_ray[unique], locations[unique]
+        return index_tri, index_ray
+
+    def refit(self, faces):
+        if self._triangles is None:
+            self._triangles = self.index.triangles.copy()
+            self._normals = self.index.normals.copy()
+        triangles = self.mesh.vertices.view(np.ndarray)[self.mesh.faces.view(np.ndarray)[faces]]
+        self._triangles[faces] = triangles
+        self._normals[faces] = _face_normals(triangles)
+
+    def closest_points(self, points):
+        """
+        (closest points, distances, triangle ids) on the surface like mesh.nearest.on_surface,
+        with the candidates from the footprint index: the closest point on the triangle with
+        the nearest footprint bounds the distance, and every triangle that can be closer
+        has a footprint within that distance.
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        if len(points) == 0:
+            return np.empty((0, 3)), np.empty(0), np.empty(0, dtype=np.int64)
+        triangles = self.triangles
+        tree = self.index.tree
+        first = np.array([next(iter(tree.nearest(_footprint(point, 0.0), 1))) for point in points], dtype=np.int64)
+        bounds = np.linalg.norm(triangles_mod.closest_point(triangles[first], points) - points, axis=1) + tol.merge
+        candidates = [np.fromiter(tree.intersection(_footprint(point, bound)), dtype=np.int64)
+                      for point, bound in zip(points, bounds)]
+        counts = np.array([len(found) for found in candidates])
+        owners = np.repeat(np.arange(len(points)), counts)
+        faces = np.concatenate(candidates)
+        on_surface = triangles_mod.closest_point(triangles[faces], points[owners])
+        distances = np.linalg.norm(on_surface - points[owners], axis=1)
+        # Sorted by point, then by distance: the first candidate of every point is its closest
+        order = np.lexsort((distances, owners))
+        best = order[np.concatenate([[0], np.cumsum(counts)[:-1]])]
+        return on_surface[best], distances[best], faces[best]
+
+
+def _footprint(point, distance):
+    """The box of the footprint index around the XZ position of point, distance to every side."""
+    return (point[0] - distance, -FOOTPRINT_HEIGHT, point[2] - distance,
+            point[0] + distance, FOOTPRINT_HEIGHT, point[2] + distance)
+
+
+def terrain_intersector(mesh, source=None):
+    """
+    The TerrainRayIntersector of mesh, installed as mesh.ray if it has none yet.
+    A new one shares the index of source when source is a mesh with the same geometry
+    and a TerrainRayIntersector, e.g. the template a config scene was cloned from.
+    """
+    if isinstance(mesh.ray, TerrainRayIntersector):
+        return mesh.ray
+    index = None
+    if source is not None and isinstance(source.ray, TerrainRayIntersector) and source.ray.index.matches(mesh):
+        index = source.ray.index
+    mesh.ray = TerrainRayIntersector(mesh, index)
+    return mesh.ray
+
+
+def closest_points(mesh, points):
+    """
+    (closest points, distances, triangle ids) on the surface of mesh, through its footprint
+    index when it has a TerrainRayIntersector and with mesh.nearest.on_surface otherwise.
+    """
+    if isinstance(mesh.ray, TerrainRayIntersector):
+        return mesh.ray.closest_points(points)
+    return mesh.nearest.on_surface(points)
+
+
+def vertices_within(mesh, centers, radii):
+    """
+    Indices of the vertices of mesh within radii[i] of the XZ point centers[i],
+    one sorted array per center.
+    """
+    if len(centers) == 0:
+        return []
+    tree = terrain_intersector(mesh).index.vertex_tree
+    return [np.sort(np.asarray(found, dtype=np.int64)) for found in tree.query_ball_point(centers, radii)]
+
+
+def touched_faces(mesh, vertices):
+    """Indices of the faces of mesh that use any of the given vertices."""
+    if len(vertices) == 0:
+        return np.empty(0, dtype=np.int64)
+    used = np.zeros(len(mesh.vertices), dtype=bool)
+    used[vertices] = True
+    return np.nonzero(used[mesh.faces.view(np.ndarray)].any(axis=1))[0]
+
+
+def deform(mesh, vertices, moved):
+    """
+    Replace the vertices of mesh with vertices, in which only the vertices at the indices
+    moved changed and only along Y, and repair the mesh like remove_degenerate_faces,
+    remove_duplicate_faces and fix_normals would.
+    For a clean mesh only the faces around the moved vertices are checked and refitted;
+    any other mesh, or a deformation that needs a repair, is repaired over the whole mesh.
+    """
+    intersector = terrain_intersector(mesh)
+    mesh.vertices = vertices
+
+    touched = touched_faces(mesh, moved)
+    if intersector.index.clean:
+        intersector.refit(touched)
+        triangles = intersector.triangles[touched]
+        if triangles_mod.nondegenerate(triangles, height=tol.merge).all() and not _inverted(mesh, intersector):
+            _share_normals(mesh, intersector)
+            return mesh
+
+    faces = mesh.faces.view(np.ndarray)
+    mesh.remove_degenerate_faces()
+    mesh.remove_duplicate_faces()
+    mesh.fix_normals()
+    if np.array_equal(mesh.faces, faces):
+        intersector.refit(np.arange(len(faces)))
+        _share_normals(mesh, intersector)
+    else:
+        # The face indices of the index do not apply anymore
+        mesh.ray = TerrainRayIntersector(mesh)
+    return mesh
+
+
+def _share_normals(mesh, intersector):
+    """
+    Hand the refitted face normals to the deformed mesh, so exporting it does not compute
+    them again. A view, the mesh makes the arrays it keeps read-only and the intersector
+    refits its own.
+    """
+    mesh.face_normals = intersector.normals.view()
+
+
+def _inverted(mesh, intersector):
+    """Whether fix_normals would invert a body of the deformed mesh."""
+    bodies = intersector.index.bodies
+    if bodies is None:
+        return False
+    if len(bodies) == 1:
+        return mesh.volume < 0.0
+    triangles = intersector.triangles
+    return any(
+        triangles_mod.mass_properties(triangles[faces], skip_inertia=True)["volume"] < 0.0
+        for faces in bodies
+    )
+
+
+def _face_normals(triangles):
+    """Unit normals of the triangles like Trimesh.face_normals, zero for degenerate ones."""
+    normals, valid = triangles_mod.normals(triangles)
+    if valid.all():
+        return normals
+    padded = np.zeros((len(triangles), 3), dtype=np.float64)
+    padded[valid] = normals
+    return padded
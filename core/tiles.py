@@ -0,0 +1,186 @@
+"""
+tiles.py
+
+Splits a large base terrain into XZ tiles that worker processes deform and query in parallel.
+Every vertex belongs to the tile its XZ position falls into and only that tile reports it,
+so the heights stitched back together agree along the seams. A tile also holds every face
+that reaches into it from its neighbours (its overlap margin): a vertical ray anywhere
+inside the tile hits the same triangles as on the whole terrain, and the margin vertices
+are deformed exactly like their own tile deforms them. Each worker process keeps only
+the tiles it was given, never the whole terrain.
+"""
+import concurrent.futures
+from typing import NamedTuple
+import numpy as np
+import trimesh
+from core.augment_tool import ray_heights
+from core.mesh_cache import clone_geometry
+from core.terrain import terrain_intersector
+
+
+class TerrainTile(NamedTuple):
+    """
+    One tile of a terrain. vertex_ids are the indices of its vertices in the whole
+    terrain, faces index into vertices and owned marks the vertices that lie inside
+    the tile (the others belong to the overlap margin).
+    """
+    index: int
+    vertex_ids: np.ndarray
+    vertices: np.ndarray
+    faces: np.ndarray
+    owned: np.ndarray
+
+
+class TileGrid:
+    """
+    Regular grid of count x count tiles over the XZ bounds of a terrain.
+    Tile i * count + j covers the cell in row i along X and column j along Z.
+    """
+
+    def __init__(self, xz_min, xz_max, count):
+        count = int(count)
+        if count < 1:
+            raise ValueError(f"Tile count must be at least 1, got {count}")
+        self.count = count
+        self.origin = np.asarray(xz_min, dtype=np.float64)
+        self.size = (np.asarray(xz_max, dtype=np.float64) - self.origin) / count
+        self.size[self.size == 0] = 1.0
+
+    @classmethod
+    def of(cls, mesh, count):
+        bounds = np.asarray(mesh.bounds, dtype=np.float64)
+        return cls(bounds[0, [0, 2]], bounds[1, [0, 2]], count)
+
+    def __len__(self):
+        return self.count * self.count
+
+    def cells(self, xz):
+        """(row, column) of the cell every XZ point falls into, points outside the grid go to the nearest one."""
+        cells = np.floor((np.asarray(xz, dtype=np.float64).reshape(-1, 2) - self.origin) / self.size)
+        return np.clip(cells, 0, self.count - 1).astype(np.int64)
+
+    def locate(self, xz):
+        """Index of the tile every XZ point falls into."""
+        cells = self.cells(xz)
+        return cells[:, 0] * self.count + cells[:, 1]
+
+    def split(self, mesh):
+        """
+        The non-empty tiles of mesh. A face goes into every tile its XZ bounding box reaches,
+        a vertex is owned by the tile it lies in.
+        """
+        vertices = mesh.vertices.view(np.ndarray)
+        faces = mesh.faces.view(np.ndarray)
+        owner = self.locate(vertices[:, [0, 2]])
+        footprints = vertices[faces][:, :, [0, 2]]
+        low = self.cells(footprints.min(axis=1))
+        high = self.cells(footprints.max(axis=1))
+
+        tiles = []
+        for row in range(self.count):
+            in_row = (low[:, 0] <= row) & (row <= high[:, 0])
+            for column in range(self.count):
+                index = row * self.count + column
+                reaching = in_row & (low[:, 1] <= column) & (column <= high[:, 1])
+                vertex_ids = np.union1d(faces[reaching].ravel(), np.nonzero(owner == index)[0])
+                if len(vertex_ids) == 0:
+                    continue
+                tiles.append(TerrainTile(
+                    index=index,
+                    vertex_ids=vertex_ids,
+                    vertices=vertices[vertex_ids],
+                    faces=np.searchsorted(vertex_ids, faces[reaching]),
+                    owned=owner[vertex_ids] == index
+                ))
+        return tiles
+
+
+class TilePool:
+    """
+    Worker processes that deform the tiles of a terrain and cast ground rays against them.
+    The tiles are dealt out to the workers once, when the pool is made; afterwards only
+    landscapes, query points and the results travel between the processes.
+    landscape_builder (a LandScapeBuilder) deforms the tiles in the workers.
+    """
+
+    def __init__(self, mesh, count, workers, landscape_builder):
+        self.grid = TileGrid.of(mesh, count)
+        tiles = self.grid.split(mesh)
+        workers = max(1, min(int(workers), len(tiles)))
+        # One single-process executor per worker, so every tile is always sent to the process that holds it
+        self._workers = []
+        for first in range(workers):
+            assigned = tiles[first::workers]
+            executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=1,
+                initializer=_init_tile_worker,
+                initargs=(assigned, landscape_builder)
+            )
+            self._workers.append((executor, [tile.index for tile in assigned]))
+
+    def run(self, landscapes, points=None):
+        """
+        Deform every tile with the landscapes and find the ground under points (N x 3) on the
+        deformed tiles. Returns (moved, heights, ground): per tile the terrain indices of the
+        vertices it moved and their new heights, and the ground height of every point,
+        NaN where its ray missed the tile it fell into.
+        """
+        points = np.zeros((0, 3)) if points is None else np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        point_tiles = self.grid.locate(points[:, [0, 2]])
+        futures = []
+        for executor, indices in self._workers:
+            queries = {index: np.nonzero(point_tiles == index)[0] for index in indices}
+            future = executor.submit(
+                _run_tiles, landscapes, {index: points[found] for index, found in queries.items()}
+            )
+            futures.append((future, queries))
+
+        moved, heights = [], []
+        ground = np.full(len(points), np.nan)
+        for future, queries in futures:
+            for index, (tile_moved, tile_heights, tile_ground) in future.result().items():
+                moved.append(tile_moved)
+                heights.append(tile_heights)
+                ground[queries[index]] = tile_ground
+        return moved, heights, ground
+
+    def close(self):
+        for executor, _ in self._workers:
+            executor.shutdown(cancel_futures=True)
+        self._workers = []
+
+
+# Every tile worker keeps [(tile, undeformed tile mesh)] of its tiles and the landscape builder.
+_worker_tiles = None
+_worker_builder = None
+
+
+def _init_tile_worker(tiles, landscape_builder):
+    global _worker_tiles, _worker_builder
+    _worker_tiles = []
+    for tile in tiles:
+        template = trimesh.Trimesh(vertices=tile.vertices, faces=tile.faces, process=False)
+        template.vertices.flags.writeable = False
+        template.faces.flags.writeable = False
+        terrain_intersector(template)
+        _worker_tiles.append((tile, template))
+    _worker_builder = landscape_builder
+
+
+def _run_tiles(landscapes, points_by_tile):
+    """
+    {tile index: (terrain indices of the owned vertices that moved, their heights, ground
+    heights of the tile's points)} for the tiles of this worker.
+    """
+    results = {}
+    for tile, template in _worker_tiles:
+        mesh = template
+        if landscapes:
+            scene = trimesh.Scene()
+            scene.add_geometry(clone_geometry(template), geom_name="ground")
+            mesh = _worker_builder.apply_landscapes(scene, landscapes, query_mesh=template)
+        heights = mesh.vertices[:, 1]
+        moved = np.nonzero((heights != tile.vertices[:, 1]) & tile.owned)[0]
+        ground = ray_heights(points_by_tile[tile.index], mesh)
+        results[tile.index] = (tile.vertex_ids[moved], heights[moved], ground)
+    return results
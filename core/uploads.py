@@ -0,0 +1,98 @@
+"""
+uploads.py
+
+Streaming storage of uploaded files.
+Uploads are copied to disk in fixed-size chunks on a worker thread, never read into
+memory as a whole, and hashed while they are copied so the mesh cache does not have
+to read them again. Files are staged in a private folder and only moved into the
+upload folder (atomic rename) once the whole request has been validated.
+"""
+import asyncio
+import hashlib
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+from core.mesh_cache import mesh_cache
+
+# Largest accepted size of a single uploaded file
+MAX_UPLOAD_BYTES = int(os.environ.get("MAPGEN_MAX_UPLOAD_MB", "1024")) * 1024 * 1024
+UPLOAD_CHUNK = 1024 * 1024
+STAGING_FOLDER = ".staging"
+
+
+class UploadTooLargeError(ValueError):
+    """An uploaded file is larger than the upload limit."""
+
+
+class UploadStaging:
+    """
+    The uploaded files of one request.
+    add() streams a file into the staging folder, commit() moves every staged file
+    into the upload folder and discard() deletes them.
+    """
+
+    def __init__(self, upload_dir, max_bytes=MAX_UPLOAD_BYTES, chunk_size=UPLOAD_CHUNK):
+        self.upload_dir = Path(upload_dir)
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        staging_root = self.upload_dir / STAGING_FOLDER
+        staging_root.mkdir(parents=True, exist_ok=True)
+        self.staging_dir = Path(tempfile.mkdtemp(dir=staging_root))
+        # file name -> sha256 of the content
+        self.files = {}
+
+    async def add(self, upload):
+        """
+        Stream an UploadFile into the staging folder. Returns the staged path.
+        Raises UploadTooLargeError when the file is larger than max_bytes.
+        """
+        name = os.path.basename(upload.filename)
+        if not name:
+            raise ValueError(f"Invalid upload file name: {upload.filename!r}")
+        staged_path = self.staging_dir / name
+        digest = await asyncio.to_thread(self._copy, upload.file, staged_path, name)
+        self.files[name] = digest
+        return staged_path
+
+    def staged_path(self, name):
+        return self.staging_dir / name
+
+    def _copy(self, source, staged_path, name):
+        hasher = hashlib.sha256()
+        size = 0
+        source.seek(0)
+        try:
+            with open(staged_path, "wb") as target:
+                for chunk in iter(lambda: source.read(self.chunk_size), b""):
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise UploadTooLargeError(
+                            f"{name} is larger than the upload limit of {self.max_bytes // (1024 * 1024)} MB."
+                        )
+                    hasher.update(chunk)
+                    target.write(chunk)
+        except BaseException:
+            if staged_path.exists():
+                staged_path.unlink()
+            raise
+        return hasher.hexdigest()
+
+    def commit(self):
+        """
+        Move the staged files into the upload folder and remember their content hashes.
+        Returns {file name: path in the upload folder}.
+        """
+        committed = {}
+        for name, digest in self.files.items():
+            final_path = self.upload_dir / name
+            os.replace(self.staging_dir / name, final_path)
+            mesh_cache.remember_hash(final_path, digest)
+            committed[name] = final_path
+        self.discard()
+        return committed
+
+    def discard(self):
+        shutil.rmtree(self.staging_dir, ignore_errors=True)
+        self.files = {}
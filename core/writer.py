@@ -4,6 +4,7 @@ writer.py
 All of the file config writing operations are handled here.
 """
 
+import os
 import yaml
 from pathlib import Path
 from models.domain import MapConfig
@@ -11,12 +12,26 @@ from models.domain import MapConfig
 CONFIGS_DIR = Path("./configs")
 CONFIGS_DIR.mkdir(parents=True, exist_ok=True)  # Ensure it exists
 
-def write_config(map_name: str, map_config: MapConfig):
+# Format of the generated map configs: "yaml" (readable, hand-editable) or "json" (much faster
+# to write and to read back). core.reader picks the reader by the file extension.
+CONFIG_FORMATS = {"yaml": ".yaml", "json": ".json"}
+CONFIG_FORMAT = os.environ.get("MAPGEN_CONFIG_FORMAT", "yaml")
+# Same output as yaml.Dumper, from libyaml when PyYAML was built with it
+YAML_DUMPER = getattr(yaml, "CDumper", yaml.Dumper)
+
+def write_config(map_name: str, map_config: MapConfig, config_format=None):
     """
     Writing generated augmentation configs to the configs directory.
     """
+    config_format = config_format or CONFIG_FORMAT
+    if config_format not in CONFIG_FORMATS:
+        raise ValueError(f"Unknown config format: {config_format}")
     safe_name = Path(map_name).stem  # Remove extension if any
-    output_path = CONFIGS_DIR / f"{safe_name}.yaml"
+    output_path = CONFIGS_DIR / f"{safe_name}{CONFIG_FORMATS[config_format]}"
+
+    if config_format == "json":
+        output_path.write_text(map_config.model_dump_json(), encoding="utf-8")
+        return
 
     with open(output_path, "w", encoding="utf-8") as f:
-        yaml.dump(map_config.model_dump(), f, sort_keys=False)
+        yaml.dump(map_config.model_dump(), f, sort_keys=False, Dumper=YAML_DUMPER)
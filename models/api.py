@@ -1,13 +1,22 @@
 from pydantic import BaseModel, Field
-from typing import Optional
+from typing import Annotated, Optional, Literal, List
 
 
 class ConfigInput(BaseModel):
     obj_path: str
     mtl_path: str
     config_path: str
+    heightfield_resolution: Optional[int] = None
+    config_format: Optional[Literal["yaml", "json"]] = None
 
 
 
 class CreatorInput(BaseModel):
-    base_map: Optional[str] = None
\ No newline at end of file
+    base_map: Optional[str] = None
+    heightfield_resolution: Optional[int] = None
+    workers: Optional[int] = None
+    merge_objects: Optional[bool] = None
+    pipeline_depth: Optional[int] = None
+    priority: Optional[int] = None
+    terrain_tiles: Optional[int] = Field(None, ge=1)
+    lod_ratios: Optional[List[Annotated[float, Field(gt=0, lt=1)]]] = None
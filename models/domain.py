@@ -1,5 +1,6 @@
 from pydantic import BaseModel, Field
-from typing import Union, Optional, Literal, List
+from typing import Union, Optional, Literal, List, NamedTuple
+import numpy as np
 
 
 
@@ -14,6 +15,7 @@ class AddModelConfig(BaseAugmentConfig):
     count: int
     position: Union[str, list[float]]
     color: list[int] = Field(default_factory=lambda: [0, 0, 255])
+    max_attempts: Optional[int] = None
 
 class LandscapeConfig(BaseAugmentConfig):
     type: Literal["landscape"]
@@ -48,4 +50,123 @@ class CustomModelObject(ModelObject):
 class MapConfig(BaseModel):
     map: str
     objects: List[Union[StandardModelObject, CustomModelObject]]
-    landscapes: List[LandscapeModel]
\ No newline at end of file
+    landscapes: List[LandscapeModel]
+
+
+class PlacedObject(NamedTuple):
+    """One row of PlacedObjects, with the attributes of the object models the shape creators read."""
+    model: str
+    scale: float
+    position: list
+    color: list
+    model_path: Optional[str]
+
+
+class PlacedObjects:
+    """
+    Placed model objects as arrays instead of one pydantic model per object.
+    Row i is an object of kind kinds[kind_ids[i]], a (model, model_path) pair with
+    model_path None for standard models; custom models have a zero color.
+    The augmenters and the scene builder work on this form, it is converted from and
+    to StandardModelObject / CustomModelObject only where configs are read and written.
+    """
+
+    def __init__(self, kinds, kind_ids, positions, scales, colors):
+        self.kinds = list(kinds)
+        self.kind_ids = np.asarray(kind_ids, dtype=np.int32).reshape(-1)
+        self.positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+        self.scales = np.asarray(scales, dtype=np.float64).reshape(-1)
+        self.colors = np.asarray(colors, dtype=np.float64).reshape(-1, 3)
+
+    def __len__(self):
+        return len(self.kind_ids)
+
+    @classmethod
+    def of_kind(cls, model, positions, scale, color=None, model_path=None):
+        """Objects of one kind and scale at the given positions."""
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+        count = len(positions)
+        colors = np.zeros((count, 3))
+        if model_path is None:
+            colors[:] = color
+        return cls([(model, model_path)], np.zeros(count), positions, np.full(count, float(scale)), colors)
+
+    @classmethod
+    def from_models(cls, objects):
+        kinds = {}
+        kind_ids = []
+        colors = []
+        no_color = (0.0, 0.0, 0.0)
+        for obj in objects:
+            # Type checks, a missing attribute of a pydantic model is slow to look up
+            if type(obj) is StandardModelObject:
+                kind_ids.append(kinds.setdefault((obj.model, None), len(kinds)))
+                colors.append(obj.color)
+            else:
+                kind_ids.append(kinds.setdefault((obj.model, getattr(obj, "model_path", None)), len(kinds)))
+                colors.append(getattr(obj, "color", None) or no_color)
+        return cls(
+            kinds,
+            kind_ids,
+            [obj.position for obj in objects],
+            [obj.scale for obj in objects],
+            colors
+        )
+
+    @classmethod
+    def concatenate(cls, parts):
+        kinds = {}
+        kind_ids = []
+        for part in parts:
+            remap = np.array([kinds.setdefault(kind, len(kinds)) for kind in part.kinds], dtype=np.int32)
+            kind_ids.append(remap[part.kind_ids] if len(part.kinds) else part.kind_ids)
+        return cls(
+            kinds,
+            np.concatenate(kind_ids) if kind_ids else np.empty(0),
+            np.concatenate([part.positions for part in parts]) if parts else np.empty((0, 3)),
+            np.concatenate([part.scales for part in parts]) if parts else np.empty(0),
+            np.concatenate([part.colors for part in parts]) if parts else np.empty((0, 3))
+        )
+
+    def rows(self):
+        """Every object as a PlacedObject."""
+        for kind_id, scale, position, color in zip(self.kind_ids.tolist(), self.scales.tolist(),
+                                                   self.positions.tolist(), self.colors.tolist()):
+            model, model_path = self.kinds[kind_id]
+            yield PlacedObject(model, scale, position, color, model_path)
+
+    def model(self, index):
+        """The pydantic model of one object."""
+        model, model_path = self.kinds[self.kind_ids[index]]
+        data = {"model": model, "scale": float(self.scales[index]), "position": self.positions[index].tolist()}
+        if model_path is not None:
+            return CustomModelObject(model_path=model_path, **data)
+        return StandardModelObject(color=self.colors[index].tolist(), **data)
+
+    def to_models(self):
+        # The arrays hold validated values already, so the models are built without validation
+        models = []
+        for kind_id, scale, position, color in zip(self.kind_ids.tolist(), self.scales.tolist(),
+                                                   self.positions.tolist(), self.colors.tolist()):
+            model, model_path = self.kinds[kind_id]
+            if model_path is not None:
+                models.append(CustomModelObject.model_construct(
+                    model=model, scale=scale, position=position, model_path=model_path))
+            else:
+                models.append(StandardModelObject.model_construct(
+                    model=model, scale=scale, position=position, color=color))
+        return models
+
+    def groups(self):
+        """
+        (first index, indices) of the objects of every kind and color, in the order
+        the groups first appear; the indices of a group are in object order.
+        """
+        if len(self) == 0:
+            return []
+        keys = np.column_stack((self.kind_ids, self.colors))
+        _, first, inverse = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        order = np.argsort(inverse, kind="stable")
+        members = np.split(order, np.cumsum(np.bincount(inverse))[:-1])
+        return [(int(first[group]), members[group]) for group in np.argsort(first)]
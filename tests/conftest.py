@@ -0,0 +1,22 @@
+import sys
+import os
+
+# Add the parent directory (MapGen) to PYTHONPATH
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+import core.reader as reader
+
+
+@pytest.fixture
+def upload_dirs(tmp_path, monkeypatch):
+    """
+    (uploads, configs): empty folders in tmp_path that the reader module loads
+    base maps and configs from for the duration of the test.
+    """
+    uploads, configs = tmp_path / "uploads", tmp_path / "configs"
+    uploads.mkdir()
+    configs.mkdir()
+    monkeypatch.setattr(reader, "UPLOAD_DIR", uploads)
+    monkeypatch.setattr(reader, "CONFIG_DIR", configs)
+    return uploads, configs
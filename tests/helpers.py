@@ -0,0 +1,28 @@
+"""
+helpers.py
+
+Meshes shared by the tests and the benchmarks.
+"""
+import numpy as np
+import trimesh
+
+
+def make_grid(n=21, size=10.0, heights=None, textured=False):
+    """
+    Terrain of n x n vertices over [-size, size] in X and Z, two triangles per cell.
+    heights(x, z) gives the Y of the vertices, flat without it. A textured grid gets
+    UVs spanning the whole texture and a plain material.
+    """
+    xs = np.linspace(-size, size, n)
+    grid_x, grid_z = np.meshgrid(xs, xs, indexing="ij")
+    grid_x, grid_z = grid_x.ravel(), grid_z.ravel()
+    grid_y = np.zeros(grid_x.size) if heights is None else heights(grid_x, grid_z)
+    vertices = np.column_stack([grid_x, grid_y, grid_z])
+    index = np.arange(n * n).reshape(n, n)
+    a, b, c, d = index[:-1, :-1].ravel(), index[1:, :-1].ravel(), index[1:, 1:].ravel(), index[:-1, 1:].ravel()
+    faces = np.vstack([np.column_stack([a, d, b]), np.column_stack([b, d, c])])
+    mesh = trimesh.Trimesh(vertices=vertices, faces=faces, process=False)
+    if textured:
+        uv = (vertices[:, [0, 2]] + size) / (2 * size)
+        mesh.visual = trimesh.visual.TextureVisuals(uv=uv, material=trimesh.visual.material.SimpleMaterial())
+    return mesh
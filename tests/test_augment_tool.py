@@ -5,12 +5,18 @@ import os
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 import pytest
-from core.augment_tool import augment, AugmenterRegistry, ModelAdder, LandScape, control_collision
-from models.domain import ModelObject, CustomModelObject, StandardModelObject
+import numpy as np
+import trimesh
+from core.augment_tool import (
+    augment, augment_batch, AugmenterRegistry, ModelAdder, LandScape, control_collision,
+    control_random_creation, ground_heights, SpatialHashGrid, PlacementError
+)
+from models.domain import ModelObject, CustomModelObject, StandardModelObject, PlacedObjects
 
 
 class DummyAug:
-    def __init__(self, type_, count=1, position="random", scale=1.0, model="tree", custom_path=None, color=None):
+    def __init__(self, type_, count=1, position="random", scale=1.0, model="tree", custom_path=None, color=None,
+                 max_attempts=None):
         self.type = type_
         self.count = count
         self.position = position
@@ -18,6 +24,7 @@ class DummyAug:
         self.model = model
         self.custom_path = custom_path
         self.color = color
+        self.max_attempts = max_attempts
 
 class DummyMesh:
     def __init__(self):
@@ -26,11 +33,12 @@ class DummyMesh:
         self.nearest = self
     
     def intersects_location(self, ray_origins, ray_directions):
-        # Always return a fixed point
-        return ([ [0,0,0] ], None, None)
+        # Every ray hits the ground at y = 0
+        locations = [[origin[0], 0, origin[2]] for origin in ray_origins]
+        return (locations, list(range(len(ray_origins))), None)
     
     def on_surface(self, points):
-        return ([ [0,0,0] ], None, None)
+        return ([[0, 0, 0] for _ in points], None, None)
 
 def test_registry_register_and_get():
     assert AugmenterRegistry.get("add_model") is ModelAdder
@@ -93,3 +101,143 @@ def test_control_collision_without_collision():
     new_scale = 1.0
 
     assert control_collision(new_pos,new_scale, placed_objects) == False
+
+def test_ground_heights_batched_matches_single_queries():
+    mesh = trimesh.creation.box(extents=[10, 2, 10])
+    points = [[0, 5, 0], [1, -5, 1], [3, 0.5, -2], [20, 5, 20]]
+    heights = ground_heights(points, mesh)
+    expected = [control_random_creation(x, y, z, mesh) for x, y, z in points]
+    assert heights.shape == (4,)
+    assert np.allclose(heights, expected)
+    assert np.isclose(heights[0], 1.0)
+    assert np.isclose(heights[1], -1.0)
+
+def test_augment_add_model_snaps_all_objects_with_one_ray_query():
+    class CountingMesh(DummyMesh):
+        calls = 0
+
+        def intersects_location(self, ray_origins, ray_directions):
+            CountingMesh.calls += 1
+            return super().intersects_location(ray_origins, ray_directions)
+
+    bounds = [(0, 0, 0), (1000, 100, 1000)]
+    aug = DummyAug("add_model", count=50, position="random", scale=1.0, model="cube", color=[0, 0, 255])
+    results = augment(bounds, aug, CountingMesh())
+    assert len(results) == 50
+    assert all(obj.position[1] == 0.5 for obj in results)
+    # Only colliding candidates are redrawn, which is rare on a map this big.
+    assert CountingMesh.calls <= 3
+
+def test_spatial_hash_grid_matches_control_collision():
+    np.random.seed(1)
+    placed_objects = []
+    grid = SpatialHashGrid(cell_size=0.5)
+    for _ in range(200):
+        position = np.random.uniform(-5, 5, 3).tolist()
+        scale = float(np.random.choice([0.3, 0.5, 1.2]))
+        placed_objects.append(StandardModelObject(model="cube", position=position, scale=scale, color=[0, 0, 255]))
+        grid.insert(position, scale)
+
+    assert len(grid) == 200
+    for _ in range(500):
+        new_pos = np.random.uniform(-6, 6, 3).tolist()
+        new_scale = float(np.random.choice([0.1, 0.5, 2.0]))
+        assert grid.collides(new_pos, new_scale) == control_collision(new_pos, new_scale, placed_objects)
+
+
+def test_spatial_hash_grid_bulk_queries_match_single_queries():
+    np.random.seed(2)
+    grid = SpatialHashGrid(cell_size=0.5)
+    grid.insert_many(np.random.uniform(-5, 5, (150, 3)), np.full(150, 0.5))
+    grid.insert([0.0, 0.0, 0.0], 1.5)
+
+    candidates = np.random.uniform(-6, 6, (400, 3))
+    scales = np.random.choice([0.2, 0.5, 1.0], 400)
+    expected = [grid.collides(pos, scale) for pos, scale in zip(candidates.tolist(), scales.tolist())]
+    assert grid.collides_many(candidates, scales).tolist() == expected
+
+
+def test_spatial_hash_grid_first_non_colliding_keeps_earliest():
+    grid = SpatialHashGrid(cell_size=1.0)
+    positions = np.array([[0, 0, 0], [0.5, 0, 0], [5, 0, 0], [0.9, 0, 0], [1.2, 0, 0]], dtype=float)
+    keep = grid.first_non_colliding(positions, np.ones(5))
+    # [0.5] and [0.9] collide with [0]; [1.2] only collides with dropped ones.
+    assert keep.tolist() == [True, False, True, False, True]
+
+
+def test_augment_add_model_random_positions_do_not_collide():
+    bounds = [(0, 0, 0), (20, 0, 20)]
+    aug = DummyAug("add_model", count=150, position="random", scale=1.0, model="cube", color=[0, 0, 255])
+    results = augment(bounds, aug, DummyMesh())
+    assert len(results) == 150
+    for i, obj in enumerate(results):
+        assert not control_collision(obj.position, obj.scale, results[:i])
+
+
+def test_augment_add_model_too_dense_fails_fast():
+    bounds = [(0, 0, 0), (2, 0, 2)]
+    aug = DummyAug("add_model", count=50, position="random", scale=1.0, model="cube",
+                   color=[0, 0, 255], max_attempts=500)
+    with pytest.raises(PlacementError):
+        augment(bounds, aug, DummyMesh())
+
+
+def test_augment_batch_places_every_map_independently_with_shared_ray_queries():
+    class CountingMesh(DummyMesh):
+        calls = 0
+
+        def intersects_location(self, ray_origins, ray_directions):
+            CountingMesh.calls += 1
+            return super().intersects_location(ray_origins, ray_directions)
+
+    bounds = [(0, 0, 0), (15, 0, 15)]
+    aug = DummyAug("add_model", count=60, position="random", scale=1.0, model="cube", color=[0, 0, 255])
+    batch = augment_batch(bounds, aug, CountingMesh(), 40)
+
+    assert len(batch) == 40
+    for results in batch:
+        assert len(results) == 60
+        for i, obj in enumerate(results):
+            assert not control_collision(obj.position, obj.scale, results[:i])
+    # One ray query per placement round for all 40 maps
+    assert CountingMesh.calls < 40
+    assert batch[0][0].position != batch[1][0].position
+
+
+def test_augment_batch_landscapes_draw_random_values_per_map():
+    class LandscapeAug:
+        type = "landscape"
+        count = 3
+        position = "random"
+        smoothness = "random"
+        radius = 1.5
+
+    bounds = [(0, 0, 0), (10, 5, 10)]
+    batch = augment_batch(bounds, LandscapeAug(), DummyMesh(), 5)
+
+    assert [len(results) for results in batch] == [3] * 5
+    landscapes = [land for results in batch for land in results]
+    assert len({tuple(land.position) for land in landscapes}) == 15
+    assert all(0 <= land.smoothness < 1 and land.radius == 1.5 for land in landscapes)
+    assert all(0 <= land.position[0] <= 10 and 0 <= land.position[1] <= 5 for land in landscapes)
+
+
+def test_placed_objects_round_trip_and_groups_keep_object_order():
+    mesh = DummyMesh()
+    cubes = ModelAdder([(-10, 0, -10), (10, 0, 10)], mesh).place_batch(
+        DummyAug("add_model", count=3, model="cube", color=[255, 0, 0]), 2)
+    trees = ModelAdder([(-10, 0, -10), (10, 0, 10)], mesh).place_batch(
+        DummyAug("add_model", count=2, position=[1, 2, 3], model="custom", custom_path="tree.obj"), 2)
+    assert [len(placed) for placed in cubes] == [3, 3]
+
+    placed = PlacedObjects.concatenate([trees[0], cubes[0], trees[1]])
+    models = placed.to_models()
+    assert [obj.model for obj in models] == ["custom"] * 2 + ["cube"] * 3 + ["custom"] * 2
+    assert isinstance(models[0], CustomModelObject) and models[0].model_path == "tree.obj"
+    assert models[0].position == [1.0, 2.0, 3.0]
+    assert isinstance(models[2], StandardModelObject) and models[2].color == [255.0, 0.0, 0.0]
+    assert [obj.model_dump() for obj in PlacedObjects.from_models(models).to_models()] == \
+        [obj.model_dump() for obj in models]
+
+    groups = placed.groups()
+    assert [(first, indices.tolist()) for first, indices in groups] == [(0, [0, 1, 5, 6]), (2, [2, 3, 4])]
@@ -7,6 +7,7 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')
 import pytest
 from unittest.mock import MagicMock, patch
 import trimesh
+import numpy as np
 from pathlib import Path
 from core.reader import load_scene
 from core.augment_writer import (  
@@ -64,3 +65,304 @@ def test_basic_shape_creators_apply_transformations(creator_cls, expected_type):
     assert hasattr(mesh.visual, "vertex_colors")
     # The color array should have 4 elements (RGBA)
     assert len(mesh.visual.vertex_colors[0]) == 4
+
+
+def test_create_landscape_raises_hill_with_falloff():
+    from core.augment_writer import LandScapeBuilder
+    from models.domain import LandscapeModel
+
+    plane = trimesh.creation.box(extents=[20, 1, 20]).subdivide().subdivide().subdivide()
+    scene = trimesh.Scene()
+    scene.add_geometry(plane)
+    original = plane.vertices.copy()
+
+    landscape = LandscapeModel(position=[0.0, 4.0, 0.0], radius=1.0, smoothness=0.5)
+    mesh = LandScapeBuilder().create_landscape(scene, landscape)
+
+    distances = np.linalg.norm(original[:, [0, 2]], axis=1)
+    top = np.isclose(original[:, 1], 0.5)
+    # Vertices outside of the radius are untouched, the ones inside are only raised.
+    assert np.allclose(mesh.vertices[distances > 4.0], original[distances > 4.0])
+    assert np.all(mesh.vertices[top, 1] >= original[top, 1])
+    assert np.isclose(mesh.vertices[top & (distances == 0), 1].max(), 4.0)
+
+
+@pytest.mark.parametrize("resolution", [None, 33])
+def test_apply_landscapes_grounds_every_landscape_on_the_ones_before(resolution):
+    from core.augment_tool import ground_heights
+    from core.augment_writer import LandScapeBuilder
+    from core.heightfield import HeightField
+    from models.domain import LandscapeModel
+
+    def make_terrain():
+        # Walls and a bottom below the top: the ground under a vertex is not always the vertex
+        return trimesh.creation.box(extents=[20, 1, 20]).subdivide().subdivide().subdivide()
+
+    def apply_one_by_one(mesh, landscapes):
+        # Every landscape on the whole terrain, grounded on what the ones before it left
+        for landscape in landscapes:
+            heightfield = HeightField.from_mesh(mesh, resolution) if resolution else None
+            vertices = mesh.vertices.copy()
+            position = np.array(landscape.position, dtype=np.float64)
+            distances = np.linalg.norm(vertices[:, [0, 2]] - position[[0, 2]], axis=1)
+            max_radius = abs(position[1]) * landscape.radius
+            affected = np.nonzero(distances <= max_radius)[0]
+            falloff = LandScapeBuilder._compute_falloff(distances[affected], max_radius, landscape.smoothness)
+            ground = ground_heights(vertices[affected], mesh, heightfield)
+            if position[1] >= 0:
+                target = ground + (position[1] - ground) * falloff
+                update = (target > ground) & (target > vertices[affected, 1])
+            else:
+                target = ground - abs(position[1]) * falloff
+                update = (target < ground) & (target < vertices[affected, 1])
+            vertices[affected[update], 1] = target[update]
+            mesh = trimesh.Trimesh(vertices=vertices, faces=mesh.faces, process=False)
+            mesh.remove_degenerate_faces()
+            mesh.remove_duplicate_faces()
+            mesh.fix_normals()
+        return mesh
+
+    landscapes = [
+        LandscapeModel(position=[0.0, 3.0, 0.0], radius=1.5, smoothness=1.0),
+        LandscapeModel(position=[2.0, 4.0, 1.0], radius=1.0, smoothness=0.0),
+        LandscapeModel(position=[-1.0, -2.0, 2.0], radius=2.0, smoothness=0.5),
+        LandscapeModel(position=[9.0, -1.5, 8.0], radius=2.0, smoothness=0.3),
+        LandscapeModel(position=[30.0, 2.0, 30.0], radius=1.0, smoothness=0.5),
+    ]
+    expected = apply_one_by_one(make_terrain(), landscapes)
+
+    scene = trimesh.Scene()
+    scene.add_geometry(make_terrain())
+    heightfield = HeightField.from_mesh(next(iter(scene.geometry.values())), resolution) if resolution else None
+    mesh = LandScapeBuilder().apply_landscapes(scene, landscapes, heightfield)
+
+    assert np.allclose(mesh.vertices, expected.vertices, rtol=0, atol=1e-9)
+    assert np.array_equal(mesh.faces, expected.faces)
+    if heightfield is not None:
+        fresh = HeightField.from_mesh(mesh, resolution)
+        assert np.allclose(heightfield.heights, fresh.heights) and np.array_equal(heightfield.valid, fresh.valid)
+
+
+@pytest.mark.parametrize("workers,pipeline_depth", [(1, 0), (2, 0), (1, 2)])
+def test_run_scene_builder_reports_failed_maps_and_builds_the_rest(tmp_path, upload_dirs, workers, pipeline_depth):
+    import yaml
+    from models.domain import MapConfig, StandardModelObject
+
+    uploads, configs = upload_dirs
+    maps = tmp_path / "maps"
+    trimesh.creation.box(extents=[10, 1, 10]).export(uploads / "base.obj")
+
+    for name in ("map_a", "map_b"):
+        config = MapConfig(
+            map=f"{name}.obj",
+            objects=[StandardModelObject(model="cube", scale=1.0, position=[1, 0, 1], color=[0, 0, 255])],
+            landscapes=[]
+        )
+        (configs / f"{name}.yaml").write_text(yaml.dump(config.model_dump()), encoding="utf-8")
+    (configs / "map_broken.yaml").write_text("map: broken.obj\nobjects: 3\n", encoding="utf-8")
+
+    progress, failed, timings = [], [], []
+    failures = run_scene_builder(
+        config_folder=str(configs), base_map="base.obj", output_folder=str(maps),
+        progress_callback=progress.append, workers=workers,
+        failure_callback=lambda name, message: failed.append(name),
+        pipeline_depth=pipeline_depth, timings_callback=timings.append
+    )
+
+    assert list(failures) == ["map_broken.yaml"] == failed
+    assert (maps / "map_a.obj").exists() and (maps / "map_b.obj").exists()
+    assert progress[-1] == 1.0 and len(progress) == 3
+    assert not list(maps.glob("*.tmp"))
+    if pipeline_depth:
+        assert len(timings) == 3 and set(timings[-1]) == {"build", "serialize", "write"}
+        assert (maps / "map_a.obj").read_bytes() == (maps / "map_b.obj").read_bytes()
+
+
+def test_run_scene_builder_builds_given_configs_until_cancelled(tmp_path, upload_dirs):
+    import threading
+    import yaml
+    from models.domain import MapConfig, StandardModelObject
+
+    uploads, configs = upload_dirs
+    maps = tmp_path / "maps"
+    trimesh.creation.box(extents=[10, 1, 10]).export(uploads / "base.obj")
+
+    for name in ("map_a", "map_b", "map_c"):
+        config = MapConfig(
+            map=f"{name}.obj",
+            objects=[StandardModelObject(model="cube", scale=1.0, position=[1, 0, 1], color=[0, 0, 255])],
+            landscapes=[]
+        )
+        (configs / f"{name}.yaml").write_text(yaml.dump(config.model_dump()), encoding="utf-8")
+
+    cancel_event = threading.Event()
+    progress = []
+
+    def cancel_after_first(p):
+        progress.append(p)
+        cancel_event.set()
+
+    failures = run_scene_builder(
+        config_folder=str(configs), base_map="base.obj", output_folder=str(maps),
+        progress_callback=cancel_after_first,
+        config_files=[configs / "map_b.yaml", configs / "map_c.yaml"], cancel_event=cancel_event
+    )
+
+    assert failures == {}
+    assert progress == [0.5]
+    assert sorted(p.name for p in maps.glob("*.obj")) == ["map_b.obj"]
+
+
+def test_pipelined_build_survives_a_raising_callback(tmp_path, upload_dirs):
+    import threading
+    import yaml
+    from models.domain import MapConfig, StandardModelObject
+
+    uploads, configs = upload_dirs
+    maps = tmp_path / "maps"
+    trimesh.creation.box(extents=[10, 1, 10]).export(uploads / "base.obj")
+
+    names = [f"map_{i}" for i in range(5)]
+    for name in names:
+        config = MapConfig(
+            map=f"{name}.obj",
+            objects=[StandardModelObject(model="cube", scale=1.0, position=[1, 0, 1], color=[0, 0, 255])],
+            landscapes=[]
+        )
+        (configs / f"{name}.yaml").write_text(yaml.dump(config.model_dump()), encoding="utf-8")
+
+    def broken_progress(progress):
+        raise RuntimeError("watcher went away")
+
+    errors = []
+
+    def build():
+        try:
+            run_scene_builder(config_folder=str(configs), base_map="base.obj", output_folder=str(maps),
+                              progress_callback=broken_progress, pipeline_depth=1)
+        except RuntimeError as e:
+            errors.append(e)
+
+    builder = threading.Thread(target=build, daemon=True)
+    builder.start()
+    builder.join(30)
+
+    assert not builder.is_alive()
+    assert [str(e) for e in errors] == ["watcher went away"]
+    assert sorted(p.stem for p in maps.glob("*.obj")) == names
+
+
+def test_build_scene_instancing_shares_geometry_between_objects():
+    from core.augment_writer import ShapeFactory as RealShapeFactory
+    from models.domain import MapConfig, StandardModelObject
+
+    def make_config():
+        objects = [
+            StandardModelObject(model="cube", scale=float(i + 1), position=[i * 5.0, 0, 0], color=[255, 0, 0])
+            for i in range(4)
+        ] + [StandardModelObject(model="sphere", scale=1.0, position=[0, 0, 5.0], color=[0, 255, 0])]
+        return MapConfig(map="instanced.glb", objects=objects, landscapes=[])
+
+    def base_scene():
+        scene = trimesh.Scene()
+        scene.add_geometry(trimesh.creation.box(extents=[40, 1, 40]), geom_name="ground")
+        return scene
+
+    baked = build_scene(make_config(), RealShapeFactory(), base_scene())
+    instanced = build_scene(make_config(), RealShapeFactory(), base_scene(), instancing=True)
+
+    # ground + one cube + one sphere, referenced by one node per object
+    assert len(instanced.geometry) == 3
+    assert len(instanced.graph.nodes_geometry) == 6
+    assert np.allclose(instanced.bounds, baked.bounds)
+    assert np.isclose(instanced.to_geometry().volume, baked.to_geometry().volume)
+
+
+def test_primitive_creator_reuses_unit_shape_without_changing_output():
+    from core.augment_writer import CubeCreator as RealCubeCreator
+    from models.domain import StandardModelObject
+
+    creator = RealCubeCreator()
+    first = creator.create_shape(StandardModelObject(model="cube", scale=2.0, position=[1, 2, 3], color=[0, 0, 255]))
+    second = creator.create_shape(StandardModelObject(model="cube", scale=0.5, position=[0, 0, 0], color=[0, 0, 255]))
+
+    expected = trimesh.creation.box(extents=[2, 2, 2])
+    expected.apply_translation([1, 2, 3])
+    assert np.allclose(first.vertices, expected.vertices)
+    assert np.allclose(first.bounds, [[0, 1, 2], [2, 3, 4]])
+    assert np.allclose(second.bounds, [[-0.25, -0.25, -0.25], [0.25, 0.25, 0.25]])
+    assert (first.visual.face_colors == [0, 0, 255, 255]).all()
+
+    # faces are shared with the unit shape, vertices are not
+    assert np.shares_memory(first.faces, second.faces)
+    assert not np.shares_memory(first.vertices, second.vertices)
+    assert not np.shares_memory(first.vertices, creator.unit_shape().vertices)
+
+
+def test_build_scene_merge_objects_groups_by_model_and_color():
+    from core.augment_writer import ShapeFactory as RealShapeFactory
+    from models.domain import MapConfig, StandardModelObject, CustomModelObject
+
+    tree = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'Lowpoly_tree_sample.obj'))
+
+    def make_config():
+        objects = [
+            StandardModelObject(model="cube", scale=float(i + 1), position=[i * 5.0, 0, 0],
+                                color=[255, 0, 0] if i % 2 else [0, 0, 255])
+            for i in range(6)
+        ] + [
+            CustomModelObject(model="custom", model_path=tree, scale=0.5, position=[-10.0, 0, i * 6.0])
+            for i in range(3)
+        ]
+        return MapConfig(map="merged.obj", objects=objects, landscapes=[])
+
+    def base_scene():
+        scene = trimesh.Scene()
+        scene.add_geometry(trimesh.creation.box(extents=[40, 1, 40]), geom_name="ground")
+        return scene
+
+    factory = RealShapeFactory()
+    tree_parts = len(factory.create_template(make_config().objects[-1])[1].geometry)
+    baked = build_scene(make_config(), RealShapeFactory(), base_scene())
+    merged = build_scene(make_config(), RealShapeFactory(), base_scene(), merge_objects=True)
+
+    # ground + two cube colors + one mesh per part of the tree
+    assert len(merged.geometry) == 3 + tree_parts
+    assert np.allclose(merged.bounds, baked.bounds)
+    baked_mesh, merged_mesh = baked.to_geometry(), merged.to_geometry()
+    assert len(merged_mesh.faces) == len(baked_mesh.faces)
+    assert np.isclose(merged_mesh.area, baked_mesh.area)
+
+
+def test_run_scene_builder_on_terrain_tiles_builds_the_same_maps(tmp_path, upload_dirs):
+    import yaml
+    from models.domain import LandscapeModel, MapConfig, StandardModelObject
+
+    uploads, configs = upload_dirs
+    trimesh.creation.box(extents=[20, 1, 20]).subdivide().subdivide().subdivide().export(uploads / "base.obj")
+
+    rng = np.random.default_rng(3)
+    config = MapConfig(
+        map="map_a.obj",
+        objects=[
+            StandardModelObject(model="cube", scale=0.5, position=[float(x), 10.0, float(z)], color=[0, 0, 255])
+            for x, z in rng.uniform(-9.5, 9.5, (40, 2))
+        ],
+        # Landscapes across the seams between the tiles
+        landscapes=[
+            LandscapeModel(position=[0.0, 3.0, 0.0], radius=1.5, smoothness=1.0),
+            LandscapeModel(position=[5.0, -1.0, -0.5], radius=3.0, smoothness=0.5),
+        ]
+    )
+    (configs / "map_a.yaml").write_text(yaml.dump(config.model_dump()), encoding="utf-8")
+
+    maps = {}
+    for terrain_tiles in (None, 3):
+        maps[terrain_tiles] = tmp_path / f"maps_{terrain_tiles}"
+        failures = run_scene_builder(
+            config_folder=str(configs), base_map="base.obj", output_folder=str(maps[terrain_tiles]),
+            workers=2, terrain_tiles=terrain_tiles
+        )
+        assert failures == {}
+
+    assert (maps[3] / "map_a.obj").read_bytes() == (maps[None] / "map_a.obj").read_bytes()
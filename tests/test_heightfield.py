@@ -0,0 +1,109 @@
+import sys
+import os
+
+# Add the parent directory (MapGen) to PYTHONPATH
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import numpy as np
+import trimesh
+import core.reader as reader
+from core.augment_tool import ground_heights
+from core.heightfield import HeightField
+
+
+def make_slope():
+    """
+    A single sided sloped plane: y = 0.5 * x over [-10, 10] x [-10, 10].
+    """
+    xs, zs = np.meshgrid(np.linspace(-10, 10, 11), np.linspace(-10, 10, 11), indexing="ij")
+    vertices = np.column_stack([xs.ravel(), 0.5 * xs.ravel(), zs.ravel()])
+    faces = []
+    for i in range(10):
+        for j in range(10):
+            a, b, c, d = i * 11 + j, (i + 1) * 11 + j, i * 11 + j + 1, (i + 1) * 11 + j + 1
+            faces.extend([[a, c, b], [b, c, d]])
+    return trimesh.Trimesh(vertices=vertices, faces=faces)
+
+
+def test_heightfield_matches_ray_casting_on_slope():
+    mesh = make_slope()
+    field = HeightField.from_mesh(mesh, 41)
+    points = np.array([[1.3, 20.0, 2.7], [-4.4, 20.0, 6.1], [7.25, 20.0, -3.3]])
+
+    heights, valid = field.sample(points)
+
+    assert valid.all()
+    assert np.allclose(heights, 0.5 * points[:, 0])
+    assert np.allclose(heights, ground_heights(points, mesh))
+
+
+def test_heightfield_falls_back_to_rays_outside_grid_and_over_overhangs():
+    slope = make_slope()
+    # A floating plate above part of the slope is an overhang.
+    plate = trimesh.creation.box(extents=[2, 0.1, 2])
+    plate.apply_translation([5, 8, 5])
+    mesh = trimesh.util.concatenate([slope, plate])
+    field = HeightField.from_mesh(mesh, 41)
+
+    points = np.array([[5.0, 20.0, 5.0], [-5.0, 20.0, -5.0], [50.0, 20.0, 0.0]])
+    _, valid = field.sample(points)
+
+    assert list(valid) == [False, True, False]
+    assert np.allclose(field.ground_heights(points, mesh), ground_heights(points, mesh))
+
+
+def test_heightfield_refresh_follows_deformation():
+    mesh = make_slope()
+    field = HeightField.from_mesh(mesh, 21)
+    vertices = mesh.vertices.copy()
+    vertices[:, 1] += 3.0
+    mesh.vertices = vertices
+
+    field.refresh(mesh, (-10, -10), (0, 10))
+    heights, _ = field.sample([[-5.0, 20.0, 0.0], [5.0, 20.0, 0.0]])
+
+    assert np.allclose(heights, [0.5, 2.5])
+
+
+def test_load_heightfield_is_cached_next_to_upload(tmp_path, monkeypatch):
+    monkeypatch.setattr(reader, "UPLOAD_DIR", tmp_path)
+    mesh = make_slope()
+    mesh.export(tmp_path / "slope.obj")
+
+    first = reader.load_heightfield("slope.obj", mesh, 16)
+    cache_file = tmp_path / "slope.heightfield_16.npz"
+    assert cache_file.exists()
+
+    monkeypatch.setattr(HeightField, "from_mesh", classmethod(lambda cls, *args: None))
+    second = reader.load_heightfield("slope.obj", mesh, 16)
+    assert np.array_equal(first.heights, second.heights)
+    assert np.array_equal(first.valid, second.valid)
+
+
+def test_heightfield_follows_landscape_between_moved_vertices():
+    from core.augment_writer import LandScapeBuilder
+    from models.domain import LandscapeModel
+
+    # A 5 x 5 plane with 5 units between vertices, the hill only moves the middle vertex
+    xs, zs = np.meshgrid(np.linspace(-10, 10, 5), np.linspace(-10, 10, 5), indexing="ij")
+    vertices = np.column_stack([xs.ravel(), np.zeros(xs.size), zs.ravel()])
+    faces = []
+    for i in range(4):
+        for j in range(4):
+            a, b, c, d = i * 5 + j, (i + 1) * 5 + j, i * 5 + j + 1, (i + 1) * 5 + j + 1
+            faces.extend([[a, c, b], [b, c, d]])
+    scene = trimesh.Scene()
+    scene.add_geometry(trimesh.Trimesh(vertices=vertices, faces=faces), geom_name="ground")
+    field = HeightField.from_mesh(next(iter(scene.geometry.values())), 81)
+
+    mesh = LandScapeBuilder().create_landscape(
+        scene, LandscapeModel(position=[0.0, 4.0, 0.0], radius=1.0, smoothness=0.5), field
+    )
+
+    # The grid nodes under the faces around the moved vertex change too
+    offsets = np.array([-4.0, -3.0, -2.0, -1.0, 1.0, 2.0, 3.0, 4.0])
+    points = np.column_stack([offsets, np.full(len(offsets), 20.0), np.zeros(len(offsets))])
+    heights, valid = field.sample(points)
+    assert valid.all()
+    assert np.allclose(heights, ground_heights(points, mesh))
+    assert np.all(heights > 0)
@@ -0,0 +1,79 @@
+import sys
+import os
+
+# Add the parent directory (MapGen) to PYTHONPATH
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import threading
+import time
+from core.jobs import JobScheduler, RUNNING, DONE, FAILED, CANCELLED
+
+
+def wait_for(job, timeout=5):
+    for _ in range(int(timeout * 100)):
+        if job.done:
+            return
+        time.sleep(0.01)
+    raise AssertionError(f"Job {job.id} did not finish: {job.status}")
+
+
+def test_scheduler_runs_queued_jobs_by_priority_then_order():
+    scheduler = JobScheduler(max_concurrent=1)
+    started, release = threading.Event(), threading.Event()
+    order = []
+
+    blocker = scheduler.submit(lambda job: started.set() or release.wait(5), job_id="blocker")
+    started.wait(5)
+    low = scheduler.submit(lambda job: order.append("low"), job_id="low")
+    first = scheduler.submit(lambda job: order.append("first"), job_id="first", priority=5)
+    second = scheduler.submit(lambda job: order.append("second"), job_id="second", priority=5)
+
+    assert scheduler.status("first")["position"] == 0
+    assert scheduler.status("second")["position"] == 1
+    assert scheduler.status("low")["position"] == 2
+    assert scheduler.status("blocker")["status"] == RUNNING
+
+    release.set()
+    for job in (blocker, low, first, second):
+        wait_for(job)
+    assert order == ["first", "second", "low"]
+    assert low.status == DONE
+
+
+def test_scheduler_cancels_queued_and_running_jobs():
+    scheduler = JobScheduler(max_concurrent=1)
+    started = threading.Event()
+
+    def cooperative(job):
+        started.set()
+        job.cancel_event.wait(5)
+        return "stopped"
+
+    running = scheduler.submit(cooperative)
+    queued = scheduler.submit(lambda job: "never")
+    started.wait(5)
+
+    assert scheduler.cancel(queued.id)
+    assert queued.status == CANCELLED
+    assert scheduler.cancel(running.id)
+    wait_for(running)
+
+    assert running.status == CANCELLED
+    assert running.result == "stopped"
+    assert queued.result is None
+    assert not scheduler.cancel(running.id)
+    assert not scheduler.cancel("unknown")
+
+
+def test_scheduler_records_errors_of_failed_jobs():
+    scheduler = JobScheduler(max_concurrent=2)
+
+    def broken(job):
+        raise FileNotFoundError("map.obj")
+
+    job = scheduler.submit(broken)
+    wait_for(job)
+
+    status = scheduler.status(job.id)
+    assert status["status"] == FAILED
+    assert status["error"] == "FileNotFoundError: map.obj"
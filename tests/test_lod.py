@@ -0,0 +1,104 @@
+import sys
+import os
+
+# Add the parent directory (MapGen) to PYTHONPATH
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import json
+import struct
+import numpy as np
+import pytest
+import trimesh
+from core.augment_writer import run_scene_builder
+from core.lod import LodCache, check_ratios, decimate
+from tests.helpers import make_grid
+
+
+def make_terrain():
+    """A textured, wavy grid."""
+    return make_grid(41, heights=lambda x, z: np.sin(x) * 0.5, textured=True)
+
+
+def test_decimate_reaches_the_ratio_and_keeps_shape_and_texture():
+    mesh = make_terrain()
+    decimated = decimate(mesh, 0.25)
+
+    assert abs(len(decimated.faces) - 0.25 * len(mesh.faces)) <= 0.1 * len(mesh.faces)
+    assert np.allclose(decimated.bounds, mesh.bounds, atol=0.5)
+    assert decimated.visual.material is mesh.visual.material
+    assert decimated.visual.uv.shape == (len(decimated.vertices), 2)
+    # No collapsed faces, and the surface still faces up
+    assert np.all(decimated.area_faces > 0)
+    assert np.all(decimated.face_normals[:, 1] > 0)
+    assert np.array_equal(decimate(trimesh.creation.box(), 0.5).faces, trimesh.creation.box().faces)
+    with pytest.raises(ValueError):
+        check_ratios([0.5, 1.0])
+
+
+def test_lod_cache_decimates_equal_meshes_once():
+    cache = LodCache()
+    first = cache.decimate(make_terrain(), 0.5)
+    second = cache.decimate(make_terrain(), 0.5)
+    cache.decimate(make_terrain(), 0.25)
+
+    assert len(cache) == 2
+    assert first is not second
+    assert np.shares_memory(first.vertices, second.vertices)
+
+
+def test_lod_ratios_outside_zero_and_one_are_rejected_by_the_api():
+    from pydantic import ValidationError
+    from models.api import CreatorInput
+
+    assert CreatorInput(lod_ratios=[0.5, 0.2]).lod_ratios == [0.5, 0.2]
+    for ratios in ([0.5, 1.0], [0.0], [-0.5]):
+        with pytest.raises(ValidationError):
+            CreatorInput(lod_ratios=ratios)
+
+
+def test_run_scene_builder_writes_levels_of_detail(tmp_path, upload_dirs):
+    import yaml
+    from unittest.mock import patch
+    from core.lod import lod_cache
+    from models.domain import MapConfig, StandardModelObject
+
+    uploads, configs = upload_dirs
+    trimesh.creation.box(extents=[20, 1, 20]).subdivide().subdivide().subdivide().export(uploads / "base.obj")
+
+    objects = [
+        StandardModelObject(model="sphere", scale=1.0, position=[float(x), 10.0, 2.0], color=[0, 0, 255])
+        for x in (-5, 0, 5)
+    ]
+    for name, suffix in (("map_a", "obj"), ("map_b", "glb")):
+        config = MapConfig(map=f"{name}.{suffix}", objects=objects, landscapes=[])
+        (configs / f"{name}.yaml").write_text(yaml.dump(config.model_dump()), encoding="utf-8")
+
+    plain, lods = tmp_path / "plain", tmp_path / "lods"
+    assert run_scene_builder(config_folder=str(configs), base_map="base.obj", output_folder=str(plain)) == {}
+    with patch.object(lod_cache, "decimate", wraps=lod_cache.decimate) as cached:
+        assert run_scene_builder(config_folder=str(configs), base_map="base.obj", output_folder=str(lods),
+                                 lod_ratios=[0.5, 0.2]) == {}
+    # Every map has its own terrain, only the models go through the cache
+    terrain_faces = len(trimesh.load(uploads / "base.obj", force="mesh").faces)
+    assert cached.call_count > 0
+    assert all(len(call.args[0].faces) != terrain_faces for call in cached.call_args_list)
+
+    # Formats without LOD support get one file per level next to the unchanged map
+    assert (lods / "map_a.obj").read_bytes() == (plain / "map_a.obj").read_bytes()
+    faces = [len(trimesh.load(lods / name, force="mesh").faces)
+             for name in ("map_a.obj", "map_a_lod1.obj", "map_a_lod2.obj")]
+    assert faces[0] > faces[1] > faces[2]
+
+    # glTF keeps every level in one file, LOD0 points at the others with MSFT_lod
+    assert not list(lods.glob("map_b_lod*"))
+    data = (lods / "map_b.glb").read_bytes()
+    tree = json.loads(data[20:20 + struct.unpack("<I", data[12:16])[0]])
+    names = [node.get("name") for node in tree["nodes"]]
+    first = tree["nodes"][names.index("LOD0")]
+    assert "MSFT_lod" in tree["extensionsUsed"]
+    assert first["extensions"]["MSFT_lod"]["ids"] == [names.index("LOD1"), names.index("LOD2")]
+    assert first["extras"]["MSFT_screencoverage"] == [0.5, 0.25, 0.1]
+    reachable = set(tree["scenes"][0]["nodes"])
+    for node in reachable.copy():
+        reachable.update(tree["nodes"][node].get("children", []))
+    assert names.index("LOD1") not in reachable
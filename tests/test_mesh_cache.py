@@ -0,0 +1,124 @@
+import sys
+import os
+
+# Add the parent directory (MapGen) to PYTHONPATH
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import numpy as np
+import pytest
+import trimesh
+import core.mesh_cache as mesh_cache_module
+from core.mesh_cache import MeshCache, estimate_bytes
+
+
+@pytest.fixture
+def count_loads(monkeypatch):
+    """
+    Count how many times a file is really parsed.
+    """
+    calls = []
+    original_load = trimesh.load
+
+    def counting_load(*args, **kwargs):
+        calls.append(args[0])
+        return original_load(*args, **kwargs)
+
+    monkeypatch.setattr(mesh_cache_module.trimesh, "load", counting_load)
+    return calls
+
+
+def test_same_content_is_parsed_once_and_returned_as_copies(tmp_path, count_loads):
+    box = trimesh.creation.box()
+    box.export(tmp_path / "a.obj")
+    box.export(tmp_path / "b.obj")
+    cache = MeshCache()
+
+    first = cache.load(tmp_path / "a.obj")
+    second = cache.load(tmp_path / "b.obj")
+
+    assert len(count_loads) == 1
+    assert first is not second
+    assert np.shares_memory(first.vertices, second.vertices)
+    assert second.source.file_name == "b.obj"
+
+    first.apply_translation([5, 0, 0])
+    assert np.allclose(cache.load(tmp_path / "a.obj").vertices, second.vertices)
+
+
+def test_overwritten_upload_is_parsed_again(tmp_path, count_loads):
+    path = tmp_path / "model.obj"
+    trimesh.creation.box().export(path)
+    cache = MeshCache()
+    cache.load(path)
+
+    trimesh.creation.icosphere().export(path)
+    reloaded = cache.load(path)
+
+    assert len(count_loads) == 2
+    assert len(reloaded.vertices) == len(trimesh.creation.icosphere().vertices)
+
+
+def test_edited_material_or_texture_is_parsed_again(tmp_path, count_loads):
+    from PIL import Image
+
+    def touch(path):
+        # A new mtime even when the edit keeps the size
+        stat = path.stat()
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+    (tmp_path / "model.obj").write_text(
+        "mtllib model.mtl\nv 0 0 0\nv 1 0 0\nv 0 0 1\nvt 0 0\nvt 1 0\nvt 0 1\nusemtl skin\nf 1/1 2/2 3/3\n"
+    )
+    mtl = tmp_path / "model.mtl"
+    mtl.write_text("newmtl skin\nKd 1 0 0\nmap_Kd texture.png\n")
+    texture = tmp_path / "texture.png"
+    Image.new("RGB", (2, 2), (255, 0, 0)).save(texture)
+    cache = MeshCache()
+
+    cache.load(tmp_path / "model.obj")
+    cache.load(tmp_path / "model.obj")
+    assert len(count_loads) == 1
+
+    Image.new("RGB", (2, 2), (0, 255, 0)).save(texture)
+    touch(texture)
+    reloaded = cache.load(tmp_path / "model.obj")
+    assert len(count_loads) == 2
+    assert reloaded.visual.material.image.getpixel((0, 0))[:3] == (0, 255, 0)
+
+    mtl.write_text("newmtl skin\nKd 0 0 1\nmap_Kd texture.png\n")
+    touch(mtl)
+    cache.load(tmp_path / "model.obj")
+    assert len(count_loads) == 3
+
+
+def test_least_recently_used_meshes_are_evicted(tmp_path):
+    for i in range(3):
+        trimesh.creation.icosphere(subdivisions=2, radius=i + 1).export(tmp_path / f"{i}.obj")
+    size = estimate_bytes(trimesh.load(tmp_path / "0.obj"))
+    cache = MeshCache(max_bytes=int(size * 2.5))
+
+    for i in range(3):
+        cache.load(tmp_path / f"{i}.obj")
+
+    assert len(cache) == 2
+    assert cache.size <= cache.max_bytes
+
+
+def test_compiled_cache_survives_a_restart(tmp_path, count_loads):
+    repo_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+    for name in ("Lowpoly_tree_sample.obj", "Lowpoly_tree_sample.mtl"):
+        (tmp_path / name).write_bytes(open(os.path.join(repo_root, name), "rb").read())
+    model = tmp_path / "Lowpoly_tree_sample.obj"
+    disk_dir = tmp_path / "compiled"
+
+    before = MeshCache(disk_dir=disk_dir).load(model)
+    after = MeshCache(disk_dir=disk_dir).load(model)
+
+    assert len(count_loads) == 1
+    assert len(list(disk_dir.glob("*.npz"))) == 1
+    assert isinstance(after, trimesh.Scene)
+    assert set(after.geometry) == set(before.geometry)
+    for name, geometry in before.geometry.items():
+        assert np.array_equal(after.geometry[name].vertices, geometry.vertices)
+        assert np.array_equal(after.geometry[name].faces, geometry.faces)
+        assert np.array_equal(after.geometry[name].visual.material.diffuse, geometry.visual.material.diffuse)
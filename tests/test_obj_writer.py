@@ -0,0 +1,65 @@
+import sys
+import os
+
+# Add the parent directory (MapGen) to PYTHONPATH
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import numpy as np
+import trimesh
+from core.obj_writer import export_obj
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+
+def colored_scene():
+    scene = trimesh.Scene()
+    ground = trimesh.creation.box(extents=[20, 1, 20])
+    ground.visual.face_colors = [0, 128, 0, 255]
+    scene.add_geometry(ground, geom_name="ground")
+    sphere = trimesh.creation.uv_sphere(radius=0.5)
+    sphere.visual.face_colors = [255, 0, 0, 255]
+    scene.add_geometry(sphere, geom_name="sphere", transform=trimesh.transformations.translation_matrix([1, 2, 3]))
+    # rotated and mirrored nodes are baked like trimesh does
+    scene.add_geometry(trimesh.creation.box(), geom_name="rotated",
+                       transform=trimesh.transformations.rotation_matrix(0.7, [1, 1, 0]))
+    scene.add_geometry(trimesh.creation.box(), geom_name="mirrored", transform=np.diag([-1.0, 1, 1, 1]))
+    return scene
+
+
+def test_export_obj_matches_trimesh_exporter(tmp_path):
+    scene = colored_scene()
+    scene.export(str(tmp_path / "trimesh.obj"))
+    export_obj(scene, tmp_path / "streamed.obj")
+
+    assert (tmp_path / "streamed.obj").read_bytes() == (tmp_path / "trimesh.obj").read_bytes()
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+def test_export_obj_output_does_not_depend_on_chunk_size(tmp_path):
+    scene = colored_scene()
+    export_obj(scene, tmp_path / "small.obj", chunk_rows=7)
+    export_obj(scene, tmp_path / "large.obj")
+
+    assert (tmp_path / "small.obj").read_bytes() == (tmp_path / "large.obj").read_bytes()
+
+
+def test_export_obj_writes_materials_and_valid_indices(tmp_path):
+    tree = trimesh.load(os.path.join(REPO_ROOT, "Lowpoly_tree_sample.obj"), force="scene")
+    scene = colored_scene()
+    for i, (name, part) in enumerate(tree.geometry.items()):
+        scene.add_geometry(part, geom_name=name, transform=trimesh.transformations.translation_matrix([5, 0, i]))
+
+    export_obj(scene, tmp_path / "map.obj", include_normals=True)
+    lines = (tmp_path / "map.obj").read_text().splitlines()
+
+    assert (tmp_path / "material.mtl").exists()
+    assert lines[1] == "mtllib material.mtl"
+    counts = {prefix: sum(1 for line in lines if line.startswith(prefix + " ")) for prefix in ("v", "vt", "vn")}
+    assert counts["vn"] == counts["v"]
+    # uvs come after untextured geometry, their indices still stay inside the written uvs
+    corners = [corner.split("/") for line in lines if line.startswith("f ") for corner in line.split()[1:]]
+    assert max(int(corner[1]) for corner in corners if corner[1]) == counts["vt"]
+    assert max(int(corner[2]) for corner in corners) == counts["vn"]
+
+    loaded = trimesh.load(tmp_path / "map.obj", force="scene")
+    assert np.allclose(loaded.bounds, scene.bounds)
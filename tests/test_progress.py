@@ -0,0 +1,105 @@
+import sys
+import os
+
+# Add the parent directory (MapGen) to PYTHONPATH
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import asyncio
+import threading
+from core.progress import ProgressBroker
+
+
+def test_broker_pushes_thread_events_to_every_subscriber_until_finished():
+    broker = ProgressBroker(min_interval=0)
+
+    async def watch(received):
+        async for state in broker.subscribe("task"):
+            received.append(state)
+
+    async def main():
+        # Tasks are published before their id is handed out
+        broker.publish("task", progress=0.0)
+        watchers = [[] for _ in range(50)]
+        tasks = [asyncio.create_task(watch(received)) for received in watchers]
+        await asyncio.sleep(0.01)
+
+        def work():
+            broker.publish("task", config="map_a.yaml", stage="objects", objects=[5, 10])
+            broker.publish("task", failed={"map_b.yaml": "ValueError: broken"})
+            broker.publish("task", progress=0.5)
+            broker.publish("task", failed={"map_c.yaml": "ValueError: broken"})
+            broker.publish("task", progress=1.0)
+
+        worker = threading.Thread(target=work)
+        worker.start()
+        worker.join()
+        await asyncio.wait_for(asyncio.gather(*tasks), 5)
+        return watchers
+
+    watchers = asyncio.run(main())
+    for received in watchers:
+        assert received[0] == {"progress": 0.0}
+        last = received[-1]
+        assert last["progress"] == 1.0 and last["eta"] == 0.0
+        assert last["config"] == "map_a.yaml" and last["objects"] == [5, 10]
+        assert set(last["failed"]) == {"map_b.yaml", "map_c.yaml"}
+
+
+def test_broker_merges_changes_and_only_wakes_subscribers_on_change():
+    broker = ProgressBroker(min_interval=0.05)
+
+    async def main():
+        received = []
+
+        async def watch():
+            async for state in broker.subscribe("task"):
+                received.append(state)
+
+        broker.publish("task", progress=0.0)
+        watcher = asyncio.create_task(watch())
+        await asyncio.sleep(0.01)
+        for i in range(1, 100):
+            broker.publish("task", progress=i / 100)
+        await asyncio.sleep(0.2)
+        idle = len(received)
+        await asyncio.sleep(0.2)
+        assert len(received) == idle
+        broker.publish("task", status="cancelled")
+        await asyncio.wait_for(watcher, 5)
+        return received
+
+    received = asyncio.run(main())
+    assert len(received) <= 4
+    assert received[-2]["progress"] == 0.99 and received[-2]["eta"] >= 0
+    assert received[-1]["status"] == "cancelled"
+
+
+def test_broker_answers_late_and_unknown_subscribers_and_ends():
+    broker = ProgressBroker(retention=0.1, min_interval=0)
+
+    async def watch(task_id):
+        return [state async for state in broker.subscribe(task_id)]
+
+    async def main():
+        broker.publish("task", progress=0.5)
+        broker.publish("task", progress=1.0)
+        await asyncio.sleep(0.2)
+        return await asyncio.wait_for(watch("task"), 5), await asyncio.wait_for(watch("unknown"), 5)
+
+    late, unknown = asyncio.run(main())
+    assert [state["progress"] for state in late] == [1.0]
+    assert unknown == [{"status": "not_found"}]
+    assert "task" in broker and "unknown" not in broker
+
+
+def test_broker_forgets_tasks_published_before_any_subscriber():
+    broker = ProgressBroker(retention=0, max_finished=2)
+
+    for i in range(5):
+        broker.publish(f"task_{i}", progress=0.5)
+        broker.publish(f"task_{i}", status="done")
+    broker.publish("running", progress=0.5)
+
+    assert set(broker._topics) == {"running"}
+    assert broker.snapshot("task_4")["status"] == "done"
+    assert broker.snapshot("task_0") is None
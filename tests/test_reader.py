@@ -4,6 +4,7 @@ import os
 # Add the parent directory (MapGen) to PYTHONPATH
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
+import json
 import pytest
 import yaml
 import trimesh
@@ -147,3 +148,98 @@ def test_load_scene_file_not_found():
     """
     with pytest.raises(FileNotFoundError):
         reader.load_scene("nofile.obj")
+
+
+def test_scene_template_clone_shares_geometry_until_modified():
+    """
+    Clones share the template's arrays; deforming a clone must not change the template.
+    """
+    import numpy as np
+    from core.augment_writer import LandScapeBuilder
+    from models.domain import LandscapeModel
+
+    trimesh.creation.box(extents=[10, 1, 10]).subdivide().export(reader.UPLOAD_DIR / "base.obj")
+    template = reader.SceneTemplate.load("base.obj")
+    original = template.base_mesh.vertices.copy()
+
+    clone = template.clone()
+    clone_mesh = next(iter(clone.geometry.values()))
+    assert np.shares_memory(clone_mesh.vertices, template.base_mesh.vertices)
+    assert list(clone.geometry) == list(template.scene.geometry)
+
+    LandScapeBuilder().create_landscape(clone, LandscapeModel(position=[0, 3, 0], radius=1, smoothness=1))
+
+    assert not np.allclose(clone_mesh.vertices, original)
+    assert np.array_equal(template.base_mesh.vertices, original)
+
+
+def test_scene_template_is_compiled_once_and_memory_mapped_afterwards():
+    import mmap
+    import numpy as np
+    from core.augment_tool import ground_heights
+
+    base = trimesh.creation.box(extents=[10, 1, 10]).subdivide()
+    base.export(reader.UPLOAD_DIR / "base.obj")
+    parsed = reader.SceneTemplate.load("base.obj")
+    assert (reader.UPLOAD_DIR / "base.obj.terrain" / "signature.json").exists()
+
+    opened = reader.SceneTemplate.load("base.obj")
+    mesh = opened.base_mesh
+    for array in (mesh.vertices, mesh.faces, mesh.ray.triangles):
+        while not isinstance(array, (np.memmap, mmap.mmap)) and getattr(array, "base", None) is not None:
+            array = array.base
+        assert isinstance(array, (np.memmap, mmap.mmap))
+    assert np.array_equal(mesh.vertices, parsed.base_mesh.vertices)
+    assert np.array_equal(mesh.faces, parsed.base_mesh.faces)
+    assert list(opened.scene.geometry) == list(parsed.scene.geometry)
+    points = np.column_stack([np.linspace(-4, 4, 20), np.full(20, 5.0), np.linspace(4, -4, 20)])
+    assert np.array_equal(ground_heights(points, mesh), ground_heights(points, parsed.base_mesh))
+
+    # A new upload under the same name is compiled again
+    os.remove(reader.UPLOAD_DIR / "base.obj")
+    trimesh.creation.box(extents=[4, 1, 4]).export(reader.UPLOAD_DIR / "base.obj")
+    assert len(reader.SceneTemplate.load("base.obj").base_mesh.faces) == 12
+    assert not list(reader.UPLOAD_DIR.glob("*.tmp")) and not list(reader.UPLOAD_DIR.glob("*.old"))
+
+    # An upload with the same stem in another format is compiled on its own
+    trimesh.creation.box(extents=[6, 1, 6]).subdivide().export(reader.UPLOAD_DIR / "base.glb")
+    assert len(reader.SceneTemplate.load("base.glb").base_mesh.faces) == 48
+    assert len(reader.SceneTemplate.load("base.obj").base_mesh.faces) == 12
+    signature = json.loads((reader.UPLOAD_DIR / "base.glb.terrain" / "signature.json").read_text())
+    assert signature["name"] == "base.glb"
+
+
+def test_compiled_base_map_is_compiled_again_when_its_material_or_texture_changes():
+    from PIL import Image
+
+    def touch(path):
+        # A new mtime even when the edit keeps the size
+        stat = path.stat()
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+    def signature():
+        return json.loads((reader.UPLOAD_DIR / "base.obj.terrain" / "signature.json").read_text())
+
+    (reader.UPLOAD_DIR / "base.obj").write_text(
+        "mtllib base.mtl\nv 0 0 0\nv 1 0 0\nv 0 0 1\nvt 0 0\nvt 1 0\nvt 0 1\nusemtl ground\nf 1/1 2/2 3/3\n"
+    )
+    mtl = reader.UPLOAD_DIR / "base.mtl"
+    mtl.write_text("newmtl ground\nKd 1 0 0\nmap_Kd ground.png\n")
+    texture = reader.UPLOAD_DIR / "ground.png"
+    Image.new("RGB", (2, 2), (255, 0, 0)).save(texture)
+
+    first = reader.SceneTemplate.load("base.obj")
+    assert first.base_mesh.visual.material.image.getpixel((0, 0))[:3] == (255, 0, 0)
+    assert sorted(os.path.basename(name) for name in signature()["files"]) == ["base.mtl", "ground.png"]
+
+    Image.new("RGB", (2, 2), (0, 255, 0)).save(texture)
+    touch(texture)
+    second = reader.SceneTemplate.load("base.obj")
+    assert second.base_mesh.visual.material.image.getpixel((0, 0))[:3] == (0, 255, 0)
+
+    compiled = signature()
+    mtl.write_text("newmtl ground\nKd 0 0 1\nmap_Kd ground.png\n")
+    touch(mtl)
+    reader.SceneTemplate.load("base.obj")
+    assert signature() != compiled
+    assert signature()["files"][str(mtl.resolve())] == [mtl.stat().st_size, mtl.stat().st_mtime_ns]
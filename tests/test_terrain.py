@@ -0,0 +1,97 @@
+import sys
+import os
+
+# Add the parent directory (MapGen) to PYTHONPATH
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import numpy as np
+import trimesh
+from core.augment_tool import ground_heights
+from core.terrain import TerrainRayIntersector, closest_points, deform, terrain_intersector
+from tests.helpers import make_grid
+
+
+def deform_fully(mesh, vertices):
+    """The deformation the way it was done before: new vertices, then repairs over the whole mesh."""
+    mesh.vertices = vertices
+    mesh.remove_degenerate_faces()
+    mesh.remove_duplicate_faces()
+    mesh.fix_normals()
+    return mesh
+
+
+def hill(mesh, center, height, radius):
+    vertices = mesh.vertices.copy()
+    distances = np.linalg.norm(vertices[:, [0, 2]] - center, axis=1)
+    moved = np.nonzero(distances < radius)[0]
+    vertices[moved, 1] += height * (1 - distances[moved] / radius)
+    return vertices, moved
+
+
+def test_deformations_refit_the_shared_footprint_index_instead_of_rebuilding():
+    template = make_grid()
+    template_index = terrain_intersector(template).index
+    reference = make_grid()
+    clone = trimesh.Trimesh(vertices=template.vertices, faces=template.faces, process=False)
+    intersector = terrain_intersector(clone, source=template)
+    assert intersector.index is template_index
+
+    points = np.column_stack([np.linspace(-9, 9, 50), np.full(50, 20.0), np.linspace(9, -9, 50)])
+    for center, height in (([2.0, 3.0], 4.0), ([-3.0, -1.0], -2.0), ([2.5, 2.5], 1.5)):
+        vertices, moved = hill(clone, center, height, 5.0)
+        deform(clone, vertices, moved)
+        deform_fully(reference, vertices.copy())
+
+        assert clone.ray is intersector
+        assert np.array_equal(clone.faces, reference.faces)
+        assert np.array_equal(clone.face_normals, reference.face_normals)
+        # Rays through a shared edge hit two triangles, which one is kept may differ in the last bit
+        assert np.allclose(ground_heights(points, clone), ground_heights(points, reference), rtol=0, atol=1e-12)
+    # The template keeps its geometry and index
+    assert np.all(template.vertices[:, 1] == 0)
+    assert np.array_equal(template.ray.triangles, template.triangles)
+
+
+def test_closest_points_of_a_deformed_terrain_come_from_its_footprint_index():
+    template = make_grid()
+    terrain_intersector(template)
+    clone = trimesh.Trimesh(vertices=template.vertices, faces=template.faces, process=False)
+    terrain_intersector(clone, source=template)
+    vertices, moved = hill(clone, [2.0, 3.0], 6.0, 4.0)
+    deform(clone, vertices, moved)
+    reference = trimesh.Trimesh(vertices=vertices.copy(), faces=template.faces, process=False)
+
+    # Beside the terrain, above it and next to the hill, where the nearest footprint is not the closest
+    rng = np.random.default_rng(0)
+    points = np.vstack([
+        rng.uniform([-30, -5, -30], [30, 25, 30], (200, 3)),
+        [[13.0, 1.0, 0.0], [-2.5, 1.0, 3.0], [2.0, 30.0, 3.0], [2.0, 3.0, 3.0]],
+    ])
+    closest, distances, faces = closest_points(clone, points)
+    expected, expected_distances, _ = reference.nearest.on_surface(points)
+
+    assert np.allclose(distances, expected_distances, rtol=0, atol=1e-9)
+    assert np.allclose(closest, expected, rtol=0, atol=1e-9)
+    assert np.allclose(np.linalg.norm(closest - points, axis=1), distances)
+    assert np.allclose(trimesh.triangles.closest_point(reference.triangles[faces], points), closest)
+    assert len(closest_points(clone, np.empty((0, 3)))[0]) == 0
+
+
+def test_deformations_that_need_repairs_repair_the_whole_mesh():
+    mesh = make_grid(n=5)
+    # A vertical triangle that a deformation flattens into a line
+    vertices = np.vstack([mesh.vertices, [[20.0, 0.0, 0.0], [21.0, 0.0, 0.0], [22.0, 1.0, 0.0]]])
+    faces = np.vstack([mesh.faces, [[25, 26, 27]]])
+    mesh = trimesh.Trimesh(vertices=vertices, faces=faces, process=False)
+    reference = mesh.copy()
+    intersector = terrain_intersector(mesh)
+
+    flattened = mesh.vertices.copy()
+    flattened[27, 1] = 0.0
+    deform(mesh, flattened, np.array([27]))
+    deform_fully(reference, flattened.copy())
+
+    assert len(mesh.faces) == len(faces) - 1
+    assert np.array_equal(mesh.faces, reference.faces)
+    assert isinstance(mesh.ray, TerrainRayIntersector) and mesh.ray is not intersector
+    assert np.array_equal(mesh.ray.triangles, mesh.triangles)
@@ -0,0 +1,70 @@
+import sys
+import os
+
+# Add the parent directory (MapGen) to PYTHONPATH
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import numpy as np
+import pytest
+import trimesh
+from core.augment_tool import ground_heights
+from core.augment_writer import LandScapeBuilder
+from core.tiles import TileGrid, TilePool
+from models.domain import LandscapeModel
+from tests.helpers import make_grid
+
+
+def test_tiles_own_every_vertex_once_and_hold_every_face_reaching_into_them():
+    mesh = make_grid()
+    grid = TileGrid.of(mesh, 4)
+    tiles = grid.split(mesh)
+
+    assert len(tiles) == len(grid) == 16
+    owned = np.concatenate([tile.vertex_ids[tile.owned] for tile in tiles])
+    assert np.array_equal(np.sort(owned), np.arange(len(mesh.vertices)))
+    for tile in tiles:
+        assert np.array_equal(tile.vertices, mesh.vertices[tile.vertex_ids])
+        # Every point of the tile is covered by the same faces as in the whole mesh
+        points = mesh.vertices[tile.vertex_ids[tile.owned]][:, [0, 2]] + 0.25
+        inside = grid.locate(points) == tile.index
+        tile_mesh = trimesh.Trimesh(vertices=tile.vertices, faces=tile.faces, process=False)
+        probe = np.column_stack([points[inside, 0], np.full(inside.sum(), 5.0), points[inside, 1]])
+        assert np.array_equal(ground_heights(probe, tile_mesh), ground_heights(probe, mesh))
+
+
+def test_tile_pool_deforms_and_queries_like_the_whole_terrain():
+    landscapes = [
+        LandscapeModel(position=[0.0, 3.0, 0.0], radius=1.5, smoothness=1.0),
+        LandscapeModel(position=[4.0, -2.0, -5.0], radius=2.0, smoothness=0.5),
+        LandscapeModel(position=[-5.0, 2.0, 5.0], radius=2.0, smoothness=0.0),
+    ]
+    whole = trimesh.Scene()
+    whole.add_geometry(make_grid(), geom_name="ground")
+    expected = LandScapeBuilder().apply_landscapes(whole, landscapes)
+    points = np.column_stack([np.linspace(-9.7, 9.7, 40), np.full(40, 20.0), np.linspace(9.1, -9.3, 40)])
+
+    mesh = make_grid()
+    pool = TilePool(mesh, 4, 2, LandScapeBuilder())
+    try:
+        moved, heights, ground = pool.run(landscapes, points)
+    finally:
+        pool.close()
+
+    moved, heights = np.concatenate(moved), np.concatenate(heights)
+    assert len(np.unique(moved)) == len(moved)
+    vertices = mesh.vertices.copy()
+    vertices[moved, 1] = heights
+    # Both ground the landscapes with rays, which may hit another triangle around a vertex
+    assert np.allclose(vertices, expected.vertices, rtol=0, atol=1e-12)
+    assert np.allclose(ground, ground_heights(points, expected), rtol=0, atol=1e-12)
+
+
+def test_terrain_tiles_below_one_are_rejected_by_the_api():
+    from pydantic import ValidationError
+    from models.api import CreatorInput
+
+    assert CreatorInput(terrain_tiles=4).terrain_tiles == 4
+    assert CreatorInput().terrain_tiles is None
+    for count in (0, -2):
+        with pytest.raises(ValidationError):
+            CreatorInput(terrain_tiles=count)
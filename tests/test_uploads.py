@@ -0,0 +1,50 @@
+import sys
+import os
+
+# Add the parent directory (MapGen) to PYTHONPATH
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import asyncio
+import hashlib
+import io
+import pytest
+from fastapi import UploadFile
+import core.mesh_cache as mesh_cache_module
+from core.mesh_cache import mesh_cache
+from core.uploads import UploadStaging, UploadTooLargeError
+
+
+def upload(name, data):
+    return UploadFile(file=io.BytesIO(data), filename=name)
+
+
+def test_staged_files_are_moved_into_the_upload_folder_on_commit(tmp_path, monkeypatch):
+    data = os.urandom(10_000)
+    staging = UploadStaging(tmp_path, chunk_size=1024)
+
+    staged = asyncio.run(staging.add(upload("../map.obj", data)))
+
+    # nothing is visible in the upload folder before commit, and names can not escape it
+    assert staged.read_bytes() == data
+    assert not (tmp_path / "map.obj").exists()
+    staging.commit()
+    assert (tmp_path / "map.obj").read_bytes() == data
+    assert not staging.staging_dir.exists()
+    # the hash computed while streaming is reused, the mesh cache does not read the file again
+    def no_read(*args, **kwargs):
+        raise AssertionError("file was read again")
+    monkeypatch.setattr(mesh_cache_module, "open", no_read, raising=False)
+    assert mesh_cache.content_hash(tmp_path / "map.obj") == hashlib.sha256(data).hexdigest()
+
+
+def test_too_large_uploads_are_rejected_and_discarded(tmp_path):
+    staging = UploadStaging(tmp_path, max_bytes=4096, chunk_size=1024)
+    asyncio.run(staging.add(upload("config.yaml", b"map_count: 1\n")))
+
+    with pytest.raises(UploadTooLargeError):
+        asyncio.run(staging.add(upload("map.obj", b"v 0 0 0\n" * 1000)))
+    assert not (staging.staging_dir / "map.obj").exists()
+
+    staging.discard()
+    assert not staging.staging_dir.exists()
+    assert [p.name for p in tmp_path.iterdir()] == [".staging"]
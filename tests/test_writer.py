@@ -42,3 +42,29 @@ def test_write_config(tmp_path, monkeypatch):
         data = yaml.safe_load(f)
 
     assert data == dummy_config.model_dump()
+
+
+@pytest.mark.parametrize("config_format", ["yaml", "json"])
+def test_write_config_round_trips_through_reader(tmp_path, monkeypatch, config_format):
+    import core.reader as reader
+    from models.domain import StandardModelObject, CustomModelObject, LandscapeModel
+
+    monkeypatch.setattr(writer, "CONFIGS_DIR", tmp_path)
+    monkeypatch.setattr(reader, "CONFIG_DIR", tmp_path)
+    map_config = MapConfig(
+        map="map_a.obj",
+        objects=[
+            StandardModelObject(model="cube", scale=0.5, position=[1.25, 0.5, -3.0], color=[255, 0, 0]),
+            CustomModelObject(model="custom", scale=0.05, position=[0.1, 0.2, 0.3], model_path="./tree.obj"),
+        ],
+        landscapes=[LandscapeModel(position=[0.0, -4.0, 0.0], radius=1.0, smoothness=0.3333333333333333)]
+    )
+
+    writer.write_config("map_a", map_config, config_format=config_format)
+
+    output_file = tmp_path / f"map_a.{config_format}"
+    assert output_file.exists()
+    assert reader.load_map_config(output_file.name) == map_config
+    if config_format == "yaml":
+        # Same text as the pure Python dumper
+        assert output_file.read_text(encoding="utf-8") == yaml.dump(map_config.model_dump(), sort_keys=False)